@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+pysynscan benchmark suite.
+
+Runs against the local mount simulator (synscan.sim), either in-process
+(commSim) or over localhost UDP (simUDPServer), and prints the results
+as JSON so they can be stored and compared across releases::
+
+    python benchmarks/bench.py --transport all --output bench.json
+    python benchmarks/bench.py --transport udp --latency 0.005 --quick
+'''
+
+import json
+import os
+import platform
+import sys
+import time
+
+import click
+
+os.environ.setdefault('SYNSCAN_LOGGING_LEVEL','WARNING')
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+import synscan
+from synscan import codec
+from synscan.comm import comm
+from synscan.sim import simMount,simUDPServer,commSim
+
+
+def _result(name,transport,n,elapsed,**extra):
+    result={'name':name,
+            'transport':transport,
+            'n':n,
+            'total_s':elapsed,
+            'per_op_us':elapsed/n*1e6 if n else None,
+            'ops_per_s':n/elapsed if elapsed else None,
+            }
+    result.update(extra)
+    return result
+
+
+def _timeit(func,n):
+    t0=time.perf_counter()
+    for i in range(n):
+        func()
+    return time.perf_counter()-t0
+
+
+def bench_codec(n):
+    '''comm._int2hex/_hex2int and codec throughput'''
+    c=comm.__new__(comm)
+    results=[]
+    for ndigits,value in ((6,0x123456),(4,0x1234),(2,0x12)):
+        elapsed=_timeit(lambda: c._int2hex(value,ndigits),n)
+        results.append(_result(f'int2hex_{ndigits}',None,n,elapsed))
+        encoded=c._int2hex(value,ndigits).encode()
+        elapsed=_timeit(lambda: c._hex2int(encoded),n)
+        results.append(_result(f'hex2int_{ndigits}',None,n,elapsed))
+        elapsed=_timeit(lambda: codec.encode(value,ndigits),n)
+        results.append(_result(f'codec_encode_{ndigits}',None,n,elapsed))
+        elapsed=_timeit(lambda: codec.decode(encoded),n)
+        results.append(_result(f'codec_decode_{ndigits}',None,n,elapsed))
+    elapsed=_timeit(lambda: c._build_cmd('S',1,0x123456),n)
+    results.append(_result('build_cmd',None,n,elapsed))
+    elapsed=_timeit(lambda: c._decode_response(b':j1\r',b'=563412\r'),n)
+    results.append(_result('decode_response',None,n,elapsed))
+    return results
+
+
+def bench_decode_status(n):
+    '''motors._decode_status'''
+    m=synscan.motors.__new__(synscan.motors)
+    elapsed=_timeit(lambda: m._decode_status('411'),n)
+    return [_result('decode_status',None,n,elapsed)]
+
+
+def bench_update_current_values(smc,transport,n):
+    '''Full update_current_values cycle'''
+    elapsed=_timeit(lambda: smc.update_current_values(logaxis=None),n)
+    return [_result('update_current_values',transport,n,elapsed)]
+
+
+def bench_goto(smc,transport,n,degrees):
+    '''goto(...,synchronous=True) wall time'''
+    smc.set_pos(0,0)
+    t0=time.perf_counter()
+    for i in range(n):
+        target=degrees if i%2==0 else 0
+        smc.goto(target,target,synchronous=True)
+    elapsed=time.perf_counter()-t0
+    return [_result('goto_synchronous',transport,n,elapsed,degrees=degrees)]
+
+
+def bench_track_ramp(smc,transport,steps):
+    '''axis_track call rate on a ramp like examples/one_axis_variablespeedtrack.py'''
+    speeds=[s/10 for s in range(0,steps)]+[s/10 for s in range(steps,0,-1)]
+    speeds=speeds+[-s for s in speeds]
+    t0=time.perf_counter()
+    for speed in speeds:
+        smc.axis_track(2,speed)
+    elapsed=time.perf_counter()-t0
+    smc.axis_stop_motion(2,synchronous=False)
+    return [_result('axis_track_ramp',transport,len(speeds),elapsed)]
+
+
+def _transports(names,latency,loss):
+    '''Yield (name,motors) for every requested transport'''
+    # Fast kinematics so goto wall time is dominated by the library, not the slew
+    mountArgs={'gotoSpeed':20.0,'acceleration':40.0}
+    if 'inproc' in names:
+        yield 'inproc',synscan.motors(transport=commSim(simMount(**mountArgs)))
+    if 'udp' in names:
+        with simUDPServer(mount=simMount(**mountArgs),latency=latency,loss=loss) as sim:
+            #Measure the full parameter handshake and leave the user cache untouched
+            yield 'udp',synscan.motors(*sim.address,paramCache=False)
+
+
+@click.command()
+@click.option('--transport', type=click.Choice(['inproc','udp','all']), help='Mount stand-in to use', default='all')
+@click.option('--latency', type=float, help='Simulated one way latency for udp (seconds)', default=0)
+@click.option('--loss', type=float, help='Simulated loss probability for udp', default=0)
+@click.option('--quick', is_flag=True, help='Fewer iterations')
+@click.option('--output', type=click.Path(), help='Write JSON to file instead of stdout', default=None)
+def main(transport,latency,loss,quick,output):
+    """Run the benchmark suite and emit JSON"""
+    scale=0.1 if quick else 1
+    names=['inproc','udp'] if transport=='all' else [transport]
+    results=[]
+    results+=bench_codec(int(100000*scale))
+    results+=bench_decode_status(int(100000*scale))
+    for name,smc in _transports(names,latency,loss):
+        results+=bench_update_current_values(smc,name,max(1,int(500*scale)))
+        results+=bench_track_ramp(smc,name,50)
+        results+=bench_goto(smc,name,2 if quick else 4,1.0)
+    report={'meta':{'python':platform.python_version(),
+                    'platform':platform.platform(),
+                    'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'latency':latency,
+                    'loss':loss,
+                    'quick':quick,
+                    },
+            'results':results}
+    text=json.dumps(report,indent=4)
+    if output:
+        with open(output,'w') as f:
+            f.write(text+'\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
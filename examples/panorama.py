@@ -1,15 +1,17 @@
-import time
 import synscan
+from synscan import planning
 
 smc=synscan.motors()
 
 #Set actual position az=0 alt=0 
 smc.set_pos(0,0)
 
-#define a grid and walk over his points
-for az in range(0,180,30):
-    for alt in range(0,90,30):
-        smc.goto(az,alt,synchronous=True)    #Goto and wait to finish
-        smc.set_switch(True)                #Activate camera with the integrate switch
-        time.sleep(2)
-        smc.set_switch(False)
+#define a grid and walk over his points in the fastest order (needs numpy)
+grid=[(az,alt) for az in range(0,180,30) for alt in range(0,90,30)]
+plan=planning.plan_mosaic(smc,grid,start=(0,0))
+print(f"Estimated slew time {plan['time']:.1f}s ({plan['originalTime']:.1f}s in grid order)")
+
+#Activate camera with the integrated switch for 2 seconds at every point.
+#The next slew is prepared during the exposure and starts when it ends
+sequencer=smc.capture(plan['points'],exposure=2,settle=0.5)
+print(sequencer.stats)
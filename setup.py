@@ -28,6 +28,7 @@ setup(
     install_requires=['click'],
     extras_require={
         'test': ['pytest'],
+        'numpy': ['numpy'],
     },
     entry_points="""
       [console_scripts]
@@ -37,4 +38,7 @@ setup(
       synscanWatch=synscan.scripts.cli:watch
       synscanSync=synscan.scripts.cli:synchronize
       synscanSwitch=synscan.scripts.cli:switch
+      synscanSim=synscan.scripts.cli:sim
+      synscanFleet=synscan.scripts.cli:fleet
+      synscand=synscan.scripts.cli:daemon
       """)
@@ -2,3 +2,4 @@ name = 'synscan'
 __all__ = []
 
 from synscan.motors import motors
+from synscan.asyncmotors import AsyncMotors
@@ -0,0 +1,192 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+import asyncio
+import collections
+import logging
+import time
+
+from synscan import codec
+from synscan.codec import debug_enabled
+from synscan import metrics
+from synscan.comm import comm,commSerial,UDP_IP,UDP_PORT,SERIAL_BAUDRATE
+
+
+class _synscanDatagramProtocol(asyncio.DatagramProtocol):
+    '''
+    asyncio protocol for the Synscan UDP port.
+    The motor controller answers in order, so every datagram received
+    resolves the oldest pending (command,future), unless it does not
+    match the command (see codec.response_matches).
+    '''
+    def __init__(self):
+        self.transport=None
+        self.pending=collections.deque()
+
+    def connection_made(self,transport):
+        self.transport=transport
+
+    def datagram_received(self,data,addr):
+        while self.pending and self.pending[0][1].done():
+            self.pending.popleft()
+        if not self.pending:
+            metrics.registry.count_discarded('stale')
+            logging.debug(f"Discarding unexpected datagram: {data}")
+            return
+        msg,future=self.pending[0]
+        if not codec.response_matches(msg,data):
+            metrics.registry.count_discarded('mismatch')
+            logging.debug(f"Discarding {data}. Not a response to {msg}")
+            return
+        self.pending.popleft()
+        if debug_enabled():
+            logging.debug(f"response: {data} host:{addr[0]} port:{addr[1]}" )
+        future.set_result(data)
+
+    def error_received(self,exc):
+        logging.debug(f"Socket error: {exc}")
+
+    def connection_lost(self,exc):
+        while self.pending:
+            msg,future=self.pending.popleft()
+            if not future.done():
+                future.set_exception(NameError('SynscanSocketTimeoutError'))
+
+
+class commAsyncUDP:
+    '''
+    asyncio UDP Comunication module.
+    Same contract as commUDP but cmd/cmds are coroutines and timeouts
+    are handled by the event loop.
+    '''
+    #Metrics registry. See synscan.metrics
+    metrics=metrics.registry
+
+    def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT):
+        self.udp_ip=udp_ip
+        self.udp_port=udp_port
+        self.commOK=False
+        self.transport=None
+        self.protocol=None
+        self.lock=asyncio.Lock()
+
+    async def connect(self):
+        '''Open the datagram endpoint'''
+        if self.transport is None:
+            loop=asyncio.get_running_loop()
+            self.transport,self.protocol=await loop.create_datagram_endpoint(
+                _synscanDatagramProtocol,
+                remote_addr=(self.udp_ip,self.udp_port))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport=None
+
+    async def cmd(self,cmd,timeout_in_seconds=2):
+        '''Low level send command coroutine '''
+        responses=await self.cmds([cmd],timeout_in_seconds)
+        return responses[0]
+
+    async def cmds(self,cmds,timeout_in_seconds=2):
+        '''Send a list of commands and wait for all the responses in order'''
+        await self.connect()
+        loop=asyncio.get_running_loop()
+        async with self.lock:
+            futures=[]
+            for cmd in cmds:
+                future=loop.create_future()
+                self.protocol.pending.append((cmd,future))
+                futures.append(future)
+                self.transport.sendto(cmd)
+            self.metrics.count_bytes(sent=sum(len(cmd) for cmd in cmds))
+            gathered=asyncio.gather(*futures)
+            #Retrieve the outcome even if nobody waits for it anymore
+            gathered.add_done_callback(lambda f: f.cancelled() or f.exception())
+            try:
+                responses=await asyncio.wait_for(gathered,timeout_in_seconds)
+            except asyncio.CancelledError:
+                self.protocol.pending.clear()
+                raise
+            except asyncio.TimeoutError:
+                self.commOK=False
+                self.metrics.count_timeout()
+                #Late replies must not be taken as responses of the next command
+                self.protocol.pending.clear()
+                if debug_enabled():
+                    logging.debug(f"Socket timeout. {timeout_in_seconds}s without response" )
+                raise(NameError('SynscanSocketTimeoutError'))
+            self.commOK=True
+            self.metrics.count_bytes(received=sum(len(r) for r in responses))
+        return responses
+
+
+class commAsyncExecutor:
+    '''
+    Run a blocking transport (i.e. commSerial) in the loop default executor
+    '''
+    def __init__(self,transport):
+        self.transport=transport
+
+    @property
+    def commOK(self):
+        return self.transport.commOK
+
+    async def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def cmd(self,cmd,timeout_in_seconds=2):
+        loop=asyncio.get_running_loop()
+        return await loop.run_in_executor(None,self.transport.cmd,cmd,timeout_in_seconds)
+
+    async def cmds(self,cmds,timeout_in_seconds=2):
+        loop=asyncio.get_running_loop()
+        return await loop.run_in_executor(None,self.transport.cmds,cmds,timeout_in_seconds)
+
+
+class asyncComm(comm):
+    '''
+    Virtual. asyncio version of comm. Message coding and error decoding
+    are shared with comm; only the send functions are coroutines.
+    '''
+    def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT,serial_dev=None,baudrate=SERIAL_BAUDRATE):
+        logging.info(f"UDP target IP: {udp_ip}")
+        logging.info(f"UDP target port: {udp_port}")
+        if serial_dev:
+            self.comm = commAsyncExecutor(commSerial(serial_dev,baudrate))
+        else:
+            self.comm = commAsyncUDP(udp_ip,udp_port)
+
+    async def _send_raw_cmd(self,cmd,timeout_in_seconds=2):
+        return await self.comm.cmd(cmd, timeout_in_seconds)
+
+    async def _send_raw_cmds(self,cmds,timeout_in_seconds=2):
+        return await self.comm.cmds(cmds, timeout_in_seconds)
+
+    async def _send_cmd(self,cmd,axis,data=None,ndigits=6):
+        '''Command coroutine '''
+        msg=self._build_cmd(cmd,axis,data,ndigits)
+        if debug_enabled():
+            logging.debug(f'sending cmd:{msg}')
+        t0=time.perf_counter()
+        raw_response=await self._send_raw_cmd(msg)
+        self.metrics.observe_latency(cmd,time.perf_counter()-t0)
+        return self._decode_response(msg,raw_response)
+
+    async def _send_cmds(self,cmds):
+        '''Batch command coroutine. See comm._send_cmds'''
+        msgs=[self._build_cmd(*c) for c in cmds]
+        if debug_enabled():
+            logging.debug(f'sending cmds:{msgs}')
+        t0=time.perf_counter()
+        raw_responses=await self._send_raw_cmds(msgs)
+        self._observe_batch(cmds,time.perf_counter()-t0)
+        return self._decode_responses(msgs,raw_responses)
+
+    def close(self):
+        self.comm.close()
@@ -0,0 +1,283 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+import asyncio
+import logging
+import time
+
+from synscan.asynccomm import asyncComm
+from synscan.motors import motorsLogic,axis_constants,UDP_IP,UDP_PORT,SERIAL_BAUDRATE,VALUES_CMDS,PARAMETERS_CMDS,WAIT_POLL_MIN,WAIT_POLL_MAX
+from synscan.motors import INIT_TIMEOUT,UPDATE_VALUES_TIMEOUT,RETRY_INITIAL,RETRY_MAX
+
+
+async def _retry(operation,timeout,timeoutError,errors=(NameError,)):
+    '''Await operation() until it does not raise errors, backing off like
+    motors._retry (without blocking the event loop)'''
+    deadline=time.monotonic()+timeout
+    wait=RETRY_INITIAL
+    while True:
+        try:
+            return await operation()
+        except errors as error:
+            logging.warning(error)
+            remaining=deadline-time.monotonic()
+            if remaining<=0:
+                raise(NameError(timeoutError))
+            wait=min(wait,remaining)
+            logging.warning(f'Retrying in {wait:.2f}...')
+            await asyncio.sleep(wait)
+            wait=min(2*wait,RETRY_MAX)
+
+
+class AsyncMotors(motorsLogic,asyncComm):
+    '''
+    asyncio version of motors.
+
+    Mirrors the motors API (goto, track, axis_wait2stop, update_current_values...)
+    as coroutines so a single event loop can drive several mounts at once::
+
+        smc=await AsyncMotors.create('192.168.4.1',11880)
+        await smc.goto(30,30,synchronous=True)
+
+    Unit conversions, speed planning, status and motion mode coding and
+    values decoding are shared with motors (see motorsLogic).
+    '''
+
+    def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT,serial_dev=None,baudrate=SERIAL_BAUDRATE):
+        '''Create the transport. Call (await) init() before use or use create()'''
+        super(AsyncMotors, self).__init__(udp_ip,udp_port,serial_dev,baudrate)
+        self.params={}
+        self.axisConstants={}
+        self.values={}
+        self.waitPollMin=WAIT_POLL_MIN
+        self.waitPollMax=WAIT_POLL_MAX
+
+    @classmethod
+    async def create(cls,udp_ip=UDP_IP,udp_port=UDP_PORT,serial_dev=None,baudrate=SERIAL_BAUDRATE):
+        '''Build and initialize an AsyncMotors instance'''
+        smc=cls(udp_ip,udp_port,serial_dev,baudrate)
+        await smc.init()
+        return smc
+
+    async def init(self,timeout=INIT_TIMEOUT):
+        '''Get main motor parameters and current values. If comm fails it is
+        retried with backoff. NameError('getParametersTimeout') is raised after
+        timeout seconds'''
+        self.params=await _retry(self.get_parameters,timeout,'getParametersTimeout')
+        self.axisConstants=axis_constants(self.params)
+        await self.update_current_values()
+
+    async def get_values(self,parameterDict,initDone=True):
+        '''See motors.get_values'''
+        try:
+            responses=await self._send_cmds(self._values_cmds(parameterDict,initDone))
+        except NameError as error:
+            logging.warning(error)
+            raise(NameError('getValuesError'))
+        return self._parse_values(parameterDict,responses,initDone)
+
+    async def get_parameters(self):
+        '''See motors.get_parameters'''
+        try:
+            params=await self.get_values(PARAMETERS_CMDS, initDone=True)
+        except NameError as error:
+            logging.warning(error)
+            raise(NameError('getParametersError'))
+        logging.info(f'MOUNT PARAMETERS: {params}')
+        return params
+
+    async def update_current_values(self,logaxis=2,timeout=UPDATE_VALUES_TIMEOUT):
+        '''See motors.update_current_values'''
+        async def _update():
+            params=await self.get_values(VALUES_CMDS, initDone=False)
+            for axis in range(1,3):
+                params[axis]=self._decode_raw(axis,params[axis])
+            return params
+        params=await _retry(_update,timeout,'updateValuesTimeout',(NameError,KeyError,TypeError))
+        self.values=params
+        if logaxis==3:
+            logging.info(f'{params}')
+        if logaxis in [1,2] and self.params[logaxis]['countsPerRevolution']:
+            logging.info(f'AXIS{logaxis} {params[logaxis]}')
+        return params
+
+    async def axes_get_values(self,axes,fields=VALUES_CMDS):
+        '''Query fields of the given axes in a single batch.
+        Returns a dictionary axis:values (see motors.axes_get_values)'''
+        stale=[(axis,field) for axis in axes for field in fields]
+        responses=await self._send_cmds([(VALUES_CMDS[field],axis,None) for axis,field in stale])
+        raw={axis:{} for axis in axes}
+        for (axis,field),response in zip(stale,responses):
+            raw[axis][field]=response
+        for axis in axes:
+            self.values.setdefault(axis,{}).update(self._decode_raw(axis,raw[axis]))
+        return {axis:self.values[axis] for axis in axes}
+
+    async def axis_get_posCounts(self,axis):
+        '''Get actual position in StepsCounts.'''
+        return await self._send_cmd('j',axis)-0x800000  # GetAxisPosition
+
+    async def axis_get_pos(self,axis):
+        '''Get actual position in Degrees.'''
+        return self.counts2degrees(axis,await self.axis_get_posCounts(axis))
+
+    async def axis_set_pos(self,axis,degrees):
+        '''Synchronize position Degrees.'''
+        if not self.params[axis]['countsPerRevolution']:
+          return None
+        logging.info(f'AXIS{axis}: Synchronizing actual position to {degrees} degrees')
+        counts=int(self.degrees2counts(axis,degrees))
+        return await self._send_cmd('E',axis,counts+0x800000) # SetAxisPosition
+
+    async def set_pos(self,alpha,beta):
+        ''' Synchronize actual position with alpha and beta'''
+        await self.axis_set_pos(1,alpha)
+        await self.axis_set_pos(2,beta)
+
+    async def axis_set_motion_mode(self,axis,Tracking,CW=True,fastSpeed=False):
+        '''Set Motion Mode. See motors.axis_set_motion_mode'''
+        if not self.params[axis]['countsPerRevolution']:
+          return None
+        value=self._motion_mode_value(Tracking,CW,fastSpeed)
+        logging.info(f'AXIS{axis}: Setting Motion Mode: {value} HEX:{value:02X}')
+        return await self._send_cmd('G',axis,value,ndigits=2)   # SetMotionMode
+
+    async def axis_set_goto_target(self,axis,targetDegrees):
+        '''GoTo Target value in Degrees. Motors has to be stopped'''
+        if not self.params[axis]['countsPerRevolution']:
+          return None
+        logging.info(f'AXIS{axis}: Setting goto target to {targetDegrees} degrees')
+        targetCounts=int(self.degrees2counts(axis,targetDegrees))
+        return await self._send_cmd('S',axis,targetCounts+0x800000) # SetGotoTarget
+
+    async def axis_set_speed(self,axis,degreesPerSecond):
+        '''Set the tracking speed in degreesPerSecond'''
+        if not self.params[axis]['countsPerRevolution']:
+          return None
+        logging.info(f'AXIS{axis}: Setting speed to:{degreesPerSecond} degrees per second')
+        T1preset=None
+        if degreesPerSecond!=0:
+            T1preset=self._T1preset_value(self._degreesPerSecond2T1preset(axis,abs(degreesPerSecond)))
+        if T1preset is None:
+            logging.info(f'AXIS{axis}: Requested speed {degreesPerSecond} too slow or 0. Stopping axis')
+            return await self.axis_stop_motion(axis)
+        return await self._send_cmd('I',axis,T1preset) # SetStepPeriod
+
+    async def axis_start_motion(self,axis):
+        '''Start Goto'''
+        if not self.params[axis]['countsPerRevolution']:
+          return None
+        logging.info(f'AXIS{axis}: Starting motion')
+        return await self._send_cmd('J',axis) # StartMotion
+
+    async def axis_stop_motion(self,axis,synchronous=True):
+        '''Soft stop. If synchronous==True wait to finish'''
+        if not self.params[axis]['countsPerRevolution']:
+          return None
+        logging.info(f'AXIS{axis}: Stopping')
+        response=await self._send_cmd('K',axis) # AxisStop (Not Instant stop)
+        if synchronous:
+            await self.axis_wait2stop(axis)
+        return response
+
+    async def axis_stop_motion_hard(self,axis,synchronous=True):
+        '''Hard stop. If synchronous==True wait to finish'''
+        if not self.params[axis]['countsPerRevolution']:
+          return None
+        logging.info(f'AXIS{axis}: Stopping (hard)')
+        response=await self._send_cmd('L',axis) # AxisStop (Instant stop)
+        if synchronous:
+            await self.axis_wait2stop(axis)
+        return response
+
+    async def axis_wait2stop(self,axis):
+        '''Wait for given axis to Stop, or overshoot Target. See motors.axis_wait2stop'''
+        await self.axes_wait2stop([axis])
+
+    async def axes_wait2stop(self,axes=(1,2)):
+        '''Wait for all given axes to Stop, or overshoot Target.
+        Only goto target, position and status of the given axes are polled, in
+        one batch, with the adaptive interval of motors.axes_wait2stop'''
+        axes=[axis for axis in axes if self.params[axis]['countsPerRevolution']]
+        if not axes:
+          return
+        for axis in axes:
+            logging.info(f'AXIS{axis}: Waiting to stop.')
+        values=await self.axes_get_values(axes,['GotoTarget','Position','Status'])
+        now=time.monotonic()
+        CW0={}
+        speed={}
+        last={}
+        for axis in axes:
+            CW0[axis] = values[axis]['Position'] - values[axis]['GotoTarget'] # >0 = CW, <0 = CCW
+            speed[axis]=0
+            last[axis]=(values[axis]['Position'],now)
+        waiting=[axis for axis in axes if not values[axis]['Status']['Stopped']]
+        interval=None
+        while waiting:
+            interval=min(self._wait2stop_interval(values[axis],speed[axis],interval) for axis in waiting)
+            await asyncio.sleep(interval)
+            values=await self.axes_get_values(waiting,['Position','Status'])
+            now=time.monotonic()
+            for axis in list(waiting):
+                lastPosition,lastTime=last[axis]
+                if now>lastTime and values[axis]['Position']!=lastPosition:
+                    speed[axis]=abs(values[axis]['Position']-lastPosition)/(now-lastTime)
+                last[axis]=(values[axis]['Position'],now)
+                if values[axis]['Status']['Stopped']:
+                    logging.info(f'AXIS{axis}: Stopped')
+                    waiting.remove(axis)
+                    continue
+                # stop axis if the motor has gone too far, not when axis is Tracking
+                check=self._wait2stop_check(values[axis],CW0[axis])
+                if check=='soft':
+                    await self.axis_stop_motion(axis,synchronous=False)
+                elif check=='hard':
+                    await self.axis_stop_motion_hard(axis,synchronous=False)
+
+    async def axis_goto(self,axis,targetDegrees):
+        '''Move given axis to target (goto)'''
+        if not self.params[axis]['countsPerRevolution']:
+          return
+        await self.axis_stop_motion(axis)
+        actualPos=await self.axis_get_pos(axis)
+        await self.axis_set_motion_mode(axis,False,(targetDegrees<actualPos),True)
+        await self.axis_set_goto_target(axis,targetDegrees)
+        await self.axis_start_motion(axis)
+
+    async def goto(self,alpha,beta,synchronous=False):
+        '''GOTO. alpha,beta in degrees. Both axes are driven concurrently'''
+        logging.info(f'GOTO axis1={alpha} axis2={beta} degrees')
+        await asyncio.gather(self.axis_goto(1,alpha),self.axis_goto(2,beta))
+        if synchronous:
+            await self.axes_wait2stop()
+
+    async def axis_track(self,axis,speed):
+        '''Move given axis at speed degrees per second. See motors.axis_track'''
+        if not self.params[axis]['countsPerRevolution']:
+          return
+        await self.update_current_values(axis)
+        status=self.values[axis]['Status']
+        CW=not status['CCW']
+        if not status['Stopped']:
+            if status['Tracking'] and not ((CW and (speed <0)) or (not CW and (speed >0))):
+                await self.axis_set_speed(axis,speed)
+                return
+            logging.info(f"TRACK asked to change dir or mode tracking:{status['Tracking']} CW:{CW} speed:{speed}")
+            await self.axis_stop_motion(axis,synchronous=True)
+        await self.axis_set_motion_mode(axis,True,(speed <0),False)
+        await self.axis_set_speed(axis,speed)
+        await self.axis_start_motion(axis)
+
+    async def track(self,alpha,beta):
+        '''TRACK. alpha,beta in degrees per second'''
+        logging.info(f'TRACK speeds axis1={alpha} axis2={beta} degrees per seconds')
+        await self.axis_track(1,alpha)
+        await self.axis_track(2,beta)
+
+    async def set_switch(self,on):
+        '''Switch on/off auxiliary switch'''
+        logging.info(f'Auxiliary switch: {on}')
+        return await self._send_cmd('O',1,int(bool(on)),ndigits=1)  # SetSwitch
@@ -0,0 +1,129 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Table driven codec of the Synscan motor protocol data segment.
+
+Data is sent/received as hex digits with the byte pairs in little endian order:
+
+* 24 bits Data Sample: for HEX number 0x123456, in the data segment of
+  a command or response, it is sent/received in this order: "5" "6" "3" "4" "1" "2".
+* 16 bits Data Sample: For HEX number 0x1234, in the data segment of a command or
+  response, it is sent/received in this order: "3" "4" "1" "2".
+* 8 bits Data Sample: For HEX number 0x12, in the data segment of a command or
+  response, it is sent/received in this order: "1" "2".
+
+All functions work on bytes (or memoryview for decoding) and avoid
+intermediate strings. They are used by comm on every command and reply.
+'''
+
+import binascii
+import logging
+
+#Two uppercase hex digits for every byte value
+HEX_BYTE=tuple(b'%02X' % i for i in range(256))
+#One uppercase hex digit for every nibble value
+HEX_NIBBLE=tuple(b'%X' % i for i in range(16))
+#Max value for every data length (hex digits)
+MAX_VALUE={0:0,1:0xF,2:0xFF,4:0xFFFF,6:0xFFFFFF}
+
+COMMANDS='abdefghijqsDEFGHIJKLMOPQSUVW'
+#Prebuilt ':<cmd><axis>' headers
+HEADERS={(cmd,axis):b':%s%d' % (cmd.encode(),axis) for cmd in COMMANDS for axis in (1,2,3)}
+
+#Data digits of a successful ('=') response per command letter.
+#Setters answer with no data. Letters not listed are not checked
+RESPONSE_DIGITS={'a':6,'b':6,'d':6,'e':6,'h':6,'i':6,'j':6,'q':6,'s':6,'D':6,
+                 'g':2,
+                 'f':3,
+                 'E':0,'F':0,'G':0,'H':0,'I':0,'J':0,'K':0,'L':0,'M':0,
+                 'O':0,'P':0,'S':0,'U':0,'V':0,'W':0,
+                 }
+#Same table indexed by the command byte (msg[1]) for the transports
+_RESPONSE_DIGITS={ord(cmd):ndigits for cmd,ndigits in RESPONSE_DIGITS.items()}
+
+_unhexlify=binascii.unhexlify
+_from_bytes=int.from_bytes
+
+
+def debug_enabled():
+    '''True if debug messages would be emitted. Guard costly debug formatting with it'''
+    return logging.root.isEnabledFor(logging.DEBUG)
+
+
+def encode(value,ndigits=6):
+    '''Encode value as ndigits (0,1,2,4 or 6) Synscan hex digits'''
+    if ndigits==6:
+        if not 0<=value<=0xFFFFFF:
+            raise ValueError(f'{value} does not fit in 24 bits')
+        return HEX_BYTE[value & 0xFF]+HEX_BYTE[(value>>8) & 0xFF]+HEX_BYTE[value>>16]
+    if ndigits==2:
+        if not 0<=value<=0xFF:
+            raise ValueError(f'{value} does not fit in 8 bits')
+        return HEX_BYTE[value]
+    if ndigits==0:
+        return b''
+    if ndigits==1:
+        if not 0<=value<=0xF:
+            raise ValueError(f'{value} does not fit in 4 bits')
+        return HEX_NIBBLE[value]
+    if ndigits==4:
+        if not 0<=value<=0xFFFF:
+            raise ValueError(f'{value} does not fit in 16 bits')
+        return HEX_BYTE[value & 0xFF]+HEX_BYTE[value>>8]
+    raise ValueError(f'ndigits must be one of [0,1,2,4,6]. Actual={ndigits}')
+
+
+def decode(data):
+    '''Decode Synscan hex digits (bytes or memoryview) to an integer'''
+    if len(data)&1:
+        #Odd length (i.e. one digit error codes) are plain hex
+        return int(bytes(data),16)
+    return _from_bytes(_unhexlify(data),'little')
+
+
+def decode_data(data):
+    '''Decode the data segment of a response.
+
+    * Empty data (commands without answer) returns ''
+    * Status (3 hex digits) is returned as string
+    * Rest of cases are returned as integer
+    '''
+    length=len(data)
+    if length==0:
+        return ''
+    if length==3:
+        return bytes(data).decode('ascii')
+    if length>6:
+        raise ValueError(f'Max allow value is FFFFFF. Actual={bytes(data)}')
+    return decode(data)
+
+
+def build_cmd(cmd,axis,data=None,ndigits=6):
+    '''Build the raw message of a command'''
+    try:
+        header=HEADERS[(cmd,axis)]
+    except KeyError:
+        header=b':%s%d' % (cmd.encode(),axis)
+    if data is None:
+        return header+b'\r'
+    return header+encode(data,ndigits)+b'\r'
+
+
+def response_matches(msg,response):
+    '''True if response has the shape expected for the command msg (raw bytes).
+
+    Error responses ('!' and one or two digits) match any command. Used by
+    the transports to discard stale or out of order datagrams.
+    '''
+    length=len(response)
+    if length<2 or response[-1]!=13:
+        return False
+    if response[0]==33:
+        return length in (3,4)
+    if response[0]!=61:
+        return False
+    ndigits=_RESPONSE_DIGITS.get(msg[1])
+    return ndigits is None or length-2==ndigits
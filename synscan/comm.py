@@ -7,8 +7,14 @@
 import socket
 import logging
 import os
+import re
 import select
 import threading
+import time
+
+from synscan import codec
+from synscan import metrics
+from synscan.codec import debug_enabled
 
 
 
@@ -17,10 +23,59 @@ UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",11880))
 
 LOGGING_LEVEL=os.getenv("SYNSCAN_LOGGING_LEVEL",logging.INFO)
 
+#Default commSerial baud rate (EQMOD style cables and motor boards use 9600; some 115200)
+SERIAL_BAUDRATE=int(os.getenv("SYNSCAN_SERIAL_BAUDRATE",9600))
+#Max time a commSerial read blocks before checking the deadline (seconds)
+SERIAL_READ_SLICE=0.05
+#First byte of a response ('=' or '!')
+_RESPONSE_START=re.compile(b'[=!]')
+
+#Retransmission timeout of commUDP (seconds). See rttEstimator
+RTO_INITIAL=0.25
+RTO_MIN=0.02
+RTO_MAX=1.0
+#Commands that can be retransmitted: inquiries (no side effects) and
+#absolute setters (init done, mode, period, target, position, stops, switch),
+#which give the same result when repeated. Not J (start) nor increments (H, M)
+IDEMPOTENT_CMDS=b'abdefghijqsDEFGIKLOSV'
+
+
+class rttEstimator:
+    '''
+    Smoothed round trip time and retransmission timeout (TCP style, RFC 6298):
+
+        RTO = SRTT + 4*RTTVAR  (bounded to [minimum,maximum])
+    '''
+    def __init__(self,initial=RTO_INITIAL,minimum=RTO_MIN,maximum=RTO_MAX):
+        self.minimum=minimum
+        self.maximum=maximum
+        self.srtt=None
+        self.rttvar=None
+        self.rto=initial
+
+    def observe(self,rtt):
+        '''Update with the round trip time of a non retransmitted exchange (Karn)'''
+        if self.srtt is None:
+            self.srtt=rtt
+            self.rttvar=rtt/2
+        else:
+            self.rttvar=0.75*self.rttvar+0.25*abs(self.srtt-rtt)
+            self.srtt=0.875*self.srtt+0.125*rtt
+        self.rto=min(max(self.srtt+4*self.rttvar,self.minimum),self.maximum)
+
+
 class commUDP:
     '''
     UDP Comunication module.
+
+    Idempotent commands (IDEMPOTENT_CMDS) are retransmitted when no response arrives
+    within the adaptive retransmission timeout (see rttEstimator), doubling
+    it on every retry. timeout_in_seconds is the total deadline of a call.
+    Other commands are sent once.
     '''
+    #Metrics registry. See synscan.metrics
+    metrics=metrics.registry
+
     def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT):
         ''' Init the UDP socket '''
         self._sock = socket.socket(socket.AF_INET, # Internet
@@ -30,103 +85,336 @@ class commUDP:
         self.udp_port=udp_port
         self.commOK=False
         self.lock= threading.Lock()
+        self.rtt=rttEstimator()
 
     def cmd(self,cmd,timeout_in_seconds=2):
         '''Low level send command function '''
-        with self.lock:
+        return self.cmds([cmd],timeout_in_seconds)[0]
+
+    def _send(self,cmds):
+        for cmd in cmds:
             self._sock.sendto(cmd,(self.udp_ip,self.udp_port))
-            ready = select.select([self._sock], [], [], timeout_in_seconds)
-            if ready[0]:
-                self.commOK=True
-                response,(fromhost,fromport) = self._sock.recvfrom(1024)
+        self.metrics.count_bytes(sent=sum(len(cmd) for cmd in cmds))
+
+    def _receive(self,responses,cmds,until):
+        '''Append the responses of cmds until all arrived or the until time is reached.
+        Datagrams with a shape not matching the expected command are discarded'''
+        while len(responses)<len(cmds):
+            ready = select.select([self._sock], [], [], max(0,until-time.monotonic()))
+            if not ready[0]:
+                return False
+            response,(fromhost,fromport) = self._sock.recvfrom(1024)
+            self.metrics.count_bytes(received=len(response))
+            if debug_enabled():
                 logging.debug(f"response: {response} host:{fromhost} port:{fromport}" )
+            if not codec.response_matches(cmds[len(responses)],response):
+                self.metrics.count_discarded('mismatch')
+                logging.debug(f"Discarding {response}. Not a response to {cmds[len(responses)]}")
+                continue
+            responses.append(response)
+        return True
+
+    def _drain(self):
+        '''Discard pending datagrams (late responses of previous commands)'''
+        while select.select([self._sock], [], [], 0)[0]:
+            response,_ = self._sock.recvfrom(1024)
+            self.metrics.count_bytes(received=len(response))
+            self.metrics.count_discarded('stale')
+            if debug_enabled():
+                logging.debug(f"Discarding stale datagram {response}")
+
+    def _quiet(self,quietSec,deadline):
+        '''Discard datagrams until none arrives for quietSec (or deadline).
+        Late responses of a batch would be taken as the answer of another
+        command of the same shape'''
+        while True:
+            wait=min(quietSec,deadline-time.monotonic())
+            if wait<=0 or not select.select([self._sock], [], [], wait)[0]:
+                return
+            response,_ = self._sock.recvfrom(1024)
+            self.metrics.count_bytes(received=len(response))
+            self.metrics.count_discarded('stale')
+            if debug_enabled():
+                logging.debug(f"Discarding late datagram {response}")
+
+    def _timeout(self,timeout_in_seconds):
+        self.commOK=False
+        self.metrics.count_timeout()
+        if debug_enabled():
+            logging.debug(f"Socket timeout. {timeout_in_seconds}s without response" )
+        raise(NameError('SynscanSocketTimeoutError'))
+
+    def _exchange(self,cmd,deadline,timeout_in_seconds):
+        '''Send an idempotent command until it is answered or deadline,
+        doubling the retransmission timeout on every retry.
+        A late response to an earlier send of the same command is a valid
+        answer. Once answered, duplicates are waited out (see _quiet)'''
+        rto=self.rtt.rto
+        sends=0
+        while True:
+            self.metrics.count_retransmit()
+            if debug_enabled():
+                logging.debug(f"Retransmitting {cmd}" )
+            self._send([cmd])
+            sends+=1
+            responses=[]
+            if self._receive(responses,[cmd],min(time.monotonic()+rto,deadline)):
+                if sends>1:
+                    self._quiet(self.rtt.rto,deadline)
+                return responses[0]
+            if time.monotonic()>=deadline:
+                self._timeout(timeout_in_seconds)
+            rto=min(2*rto,self.rtt.maximum)
+
+    def cmds(self,cmds,timeout_in_seconds=2):
+        '''Send a list of commands in one lock hold.
+        Pending datagrams are discarded first. Then all the commands are sent
+        and the responses are collected in order, discarding the ones that do
+        not match the expected shape (see codec.response_matches).
+
+        If a response is missing and all the commands are idempotent, they are
+        retransmitted one by one (responses carry no id, so it is unknown which
+        datagram was lost) until timeout_in_seconds, once no late response
+        of the batch has arrived for one retransmission timeout.
+
+        Responses carry no id, so they are matched by arrival order: the link
+        is assumed not to reorder datagrams (the mount answers in order over a
+        single hop). Reordered responses of the same shape (i.e. Position and
+        GotoTarget) can not be detected, nor can a response arriving later
+        than about twice the retransmission timeout (it is taken as lost).
+        '''
+        retransmit=all(cmd[1] in IDEMPOTENT_CMDS for cmd in cmds)
+        with self.lock:
+            deadline=time.monotonic()+timeout_in_seconds
+            self._drain()
+            sent=time.monotonic()
+            self._send(cmds)
+            responses=[]
+            until=min(sent+self.rtt.rto,deadline) if retransmit else deadline
+            if self._receive(responses,cmds,until):
+                #Only exchanges without retransmission are sampled (Karn)
+                self.rtt.observe(time.monotonic()-sent)
+            elif retransmit:
+                #Wait out the late responses of the batch before retransmitting
+                self._quiet(self.rtt.rto,deadline)
+                responses=[self._exchange(cmd,deadline,timeout_in_seconds) for cmd in cmds]
             else:
-                self.commOK=False
-                logging.debug(f"Socket timeout. {timeout_in_seconds}s without response" )
-                raise(NameError('SynscanSocketTimeoutError'))
-                response = False
-        return response
+                self._timeout(timeout_in_seconds)
+            self.commOK=True
+        return responses
 
 
 class commSerial:
     '''
     Serial Comunication module.
+
+    Responses are framed on '\\r' from a reusable input buffer. Echoed
+    commands (some direct cables echo every byte sent) are skipped, as are
+    responses not matching the command sent (see codec.response_matches).
+    timeout_in_seconds is the total deadline of a call.
     '''
-    def __init__(self,serial_dev):
-        import serial
+    #Metrics registry. See synscan.metrics
+    metrics=metrics.registry
+
+    def __init__(self,serial_dev,baudrate=SERIAL_BAUDRATE):
         ''' Init the serial port '''
-        self.serial = serial.Serial(serial_dev, 9600, timeout=.02)
+        import serial
+        self.serial = serial.Serial(serial_dev, baudrate, timeout=SERIAL_READ_SLICE)
         self.lock = threading.Lock()
         self.commOK=False
+        self._buffer=bytearray()
 
     def cmd(self,cmd,timeout_in_seconds=2):
         '''Low level send command function '''
+        return self.cmds([cmd],timeout_in_seconds)[0]
+
+    def cmds(self,cmds,timeout_in_seconds=2):
+        '''Send a list of commands in one write and one lock hold.
+        Responses are returned in the same order'''
         with self.lock:
-            self.serial.write(cmd)
-            response = self.serial.readline()
-            while response and response[0] not in b'!=':
-                # Strip echo of command
-                response = response[1:]
-            if response:
-                self.commOK=True
+            deadline=time.monotonic()+timeout_in_seconds
+            self._discard_input()
+            data=b''.join(cmds)
+            self.serial.write(data)
+            self.metrics.count_bytes(sent=len(data))
+            responses=[]
+            for cmd in cmds:
+                response=self._read_response(cmd,deadline)
+                if response is None:
+                    self.commOK=False
+                    self.metrics.count_timeout()
+                    if debug_enabled():
+                        logging.debug(f"Device timeout. {timeout_in_seconds}s without response" )
+                    raise(NameError('SynscanSocketTimeoutError'))
+                responses.append(response)
+            self.commOK=True
+        return responses
+
+    def _discard_input(self):
+        '''Forget late responses of previous commands'''
+        if self._buffer or self.serial.in_waiting:
+            self.serial.reset_input_buffer()
+            self._buffer.clear()
+            self.metrics.count_discarded('stale')
+
+    def _read_frame(self,deadline):
+        '''Next '\\r' terminated frame or None at deadline'''
+        buffer=self._buffer
+        while True:
+            end=buffer.find(b'\r')
+            if end>=0:
+                frame=bytes(buffer[:end+1])
+                del buffer[:end+1]
+                return frame
+            if time.monotonic()>=deadline:
+                return None
+            # Returns as soon as something arrives or after SERIAL_READ_SLICE
+            data=self.serial.read(self.serial.in_waiting or 1)
+            if data:
+                self.metrics.count_bytes(received=len(data))
+                buffer+=data
+
+    def _read_response(self,cmd,deadline):
+        '''Response to cmd, skipping echoes and mismatching frames'''
+        while True:
+            frame=self._read_frame(deadline)
+            if frame is None:
+                return None
+            # One pass echo strip: the response starts at the first '=' or '!'
+            start=_RESPONSE_START.search(frame)
+            if start is None:
+                # Echo of the command alone
+                continue
+            response=frame[start.start():]
+            if not codec.response_matches(cmd,response):
+                self.metrics.count_discarded('mismatch')
+                logging.debug(f"Discarding {response}. Not a response to {cmd}")
+                continue
+            if debug_enabled():
                 logging.debug(f"response: {response}")
-            else:
-                self.commOK=False
-                logging.debug(f"Device timeout. {timeout_in_seconds}s without response" )
-                raise(NameError('SynscanSocketTimeoutError'))
-                response = False
-        return response
+            return response
 
 
 class comm:
     '''
     Virtual. Used as base class. All members are protected
     '''
-    def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT,serial_dev=None):
-        ''' Init the UDP socket '''
-        logging.basicConfig(
-            format='%(asctime)s %(levelname)s:synscanComm %(message)s',
-            level=LOGGING_LEVEL
-            )
+    #Metrics registry. See synscan.metrics
+    metrics=metrics.registry
+
+    def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT,serial_dev=None,baudrate=SERIAL_BAUDRATE,transport=None,basicConfig=True,paramCache=True):
+        ''' Init the UDP socket (or the serial port serial_dev at baudrate).
+        If transport is given (i.e. synscan.trace.commReplay) it is used instead.
+        With paramCache=False the parameters of this endpoint are not read
+        from nor stored in the on-disk cache (i.e. simulators, see synscan.paramcache)
+        '''
+        if basicConfig:
+            logging.basicConfig(
+                format='%(asctime)s %(levelname)s:synscanComm %(message)s',
+                level=LOGGING_LEVEL
+                )
+        self.paramCache = paramCache
+        if transport is not None:
+            self.comm = transport
+            #Unknown endpoint. Nothing is cached for it (see synscan.paramcache)
+            self.endpoint = None
+            return
         logging.info(f"UDP target IP: {udp_ip}")
         logging.info(f"UDP target port: {udp_port}")
         if serial_dev:
-            self.comm = commSerial(serial_dev)
+            self.comm = commSerial(serial_dev,baudrate)
+            self.endpoint = f'serial:{serial_dev}'
         else:
             self.comm = commUDP(udp_ip,udp_port)
+            self.endpoint = f'udp:{udp_ip}:{udp_port}'
 
     def _send_raw_cmd(self,cmd,timeout_in_seconds=2):
         return self.comm.cmd(cmd, timeout_in_seconds)
 
-    def _send_cmd(self,cmd,axis,data=None,ndigits=6):
-        '''Command function '''
+    def _send_raw_cmds(self,cmds,timeout_in_seconds=2):
+        if hasattr(self.comm,'cmds'):
+            return self.comm.cmds(cmds, timeout_in_seconds)
+        return [self.comm.cmd(cmd, timeout_in_seconds) for cmd in cmds]
+
+    def _build_cmd(self,cmd,axis,data=None,ndigits=6):
+        '''Build the raw message for a command'''
         if data is None:
            ndigits=0
-        msg=bytes(f':{cmd}{axis}{self._int2hex(data,ndigits)}\r','utf-8')
-        logging.debug(f'sending cmd:{msg}')
+        return codec.build_cmd(cmd,axis,data,ndigits)
+
+    def _send_cmd(self,cmd,axis,data=None,ndigits=6):
+        '''Command function '''
+        msg=self._build_cmd(cmd,axis,data,ndigits)
+        if debug_enabled():
+            logging.debug(f'sending cmd:{msg}')
+        t0=time.perf_counter()
         raw_response=self._send_raw_cmd(msg)
+        self.metrics.observe_latency(cmd,time.perf_counter()-t0)
+        return self._decode_response(msg,raw_response)
+
+    def _send_cmds(self,cmds):
+        '''Batch command function.
 
+        cmds is a list of (cmd,axis,data) or (cmd,axis,data,ndigits) tuples.
+        All messages are written in one transport lock hold and the
+        responses are returned as a list in the same order.
+        Errors are decoded per command; the first one found is raised
+        once every response has been collected.
+        '''
+        msgs=[self._build_cmd(*c) for c in cmds]
+        if debug_enabled():
+            logging.debug(f'sending cmds:{msgs}')
+        t0=time.perf_counter()
+        raw_responses=self._send_raw_cmds(msgs)
+        self._observe_batch(cmds,time.perf_counter()-t0)
+        return self._decode_responses(msgs,raw_responses)
+
+    def _observe_batch(self,cmds,seconds):
+        '''Pipelined commands complete together: all get the batch round trip'''
+        for c in cmds:
+            self.metrics.observe_latency(c[0],seconds)
+
+    def _decode_responses(self,msgs,raw_responses):
+        '''Decode a list of raw responses. Raise the first error found'''
+        responses=[]
+        error=None
+        for msg,raw_response in zip(msgs,raw_responses):
+            try:
+                responses.append(self._decode_response(msg,raw_response))
+            except NameError as e:
+                responses.append(None)
+                if error is None:
+                    error=e
+        if error is not None:
+            raise(error)
+        return responses
+
+    def _decode_response(self,msg,raw_response):
+        '''Decode a raw response. Raise NameError on error codes'''
         #If everything is OK first char must be '=' (code 61)
         if raw_response[0]==61:
-            response=self._hex2int(raw_response[1:-1])
+            response=codec.decode_data(memoryview(raw_response)[1:-1])
             return response
 
         #If something goes wrong first char must be '!' (code 33)
         if raw_response[0]==33:
             ErrorDict={0:'UnknownCommand',1:'CommandLengthError',2:'MotorNotStopped',3:'InvalidCharacter',
                        4:'NotInitialized',5:'DriverSleeping',7:'PECTrainingIsRunning',8:'NoValidPECdata'}
-            errorNumber=self._hex2int(raw_response[1:-1])
+            errorNumber=codec.decode(memoryview(raw_response)[1:-1])
             if errorNumber not in [0,1,2,3,4,5,7,8]:
                 logging.warning(f'Unknown Error {raw_response}')
+                self.metrics.count_error('CMDUnknowError')
                 raise(NameError('CMDUnknowError'))
                 return False                    
             errorStr=ErrorDict[errorNumber]
+            self.metrics.count_error(errorStr)
             logging.warning(f'CMD:{msg} Error:{errorStr} {raw_response}')
             raise(NameError(errorStr))
             return False
         #Catch the rest
         else:
             logging.warning(f'Unknown Error {raw_response}')
+            self.metrics.count_error('CMDUnknowError')
             raise(NameError('CMDUnknowError'))
             return False
 
@@ -144,24 +432,13 @@ class comm:
           response, it is sent/received in this order: "3" "4" "1" "2". 
         * 8 bits Data Sample: For HEX number 0x12, in the data segment of a command or
           response, it is sent/received in this order: "1" "2".
-        '''
 
+        Returns a string. See codec.encode for the bytes version
+        '''
         assert (ndigits in [0,1,2,4,6]), "ndigits must be one of [0,2,4,6]"
-        if ndigits==6:
-            strData=f'{data:06X}'
-        if ndigits==4:
-            strData=f'{data:04X}'
-        if ndigits==2:
-            strData=f'{data:02X}'
-        if ndigits==1:
-            strData=f'{data:01X}'
-        if ndigits==0:
-            strData=f''
-        length=len(strData)
-        strHEX=''
-        for i in range(length,0,-2):
-            strHEX=strHEX+f'{strData[i-2:i]}'
-        logging.debug(f'{data}(decimal) => {strData}(hex) => {strHEX}(synscan hex)')
+        strHEX=codec.encode(data,ndigits).decode('ascii')
+        if debug_enabled():
+            logging.debug(f'{data}(decimal) => {strHEX}(synscan hex)')
         return strHEX
         
     def _hex2int(self,data):
@@ -174,25 +451,14 @@ class comm:
           response, it is sent/received in this order: "3" "4" "1" "2". 
         * 8 bits Data Sample: For HEX number 0x12, in the data segment of a command or
           response, it is sent/received in this order: "1" "2".
+
+        Empty data returns '' and status msg (3 hex digits) are returned as string.
+        See codec.decode_data
         '''
-        strData=data.decode("utf-8") 
-        length=len(strData)
-        assert (length<=6), f"Max allow value is FFFFFF. Actual={strData}"
-        #Special cases
-        #Some commands dont return data
-        if length==0:
-            return ''
-        #Status msg only return 12 bits (1.5bytes or 3 hex digits)
-        if length==3:
-            logging.debug(f'3bytes response. Not converting to init. Returning as it as string')        
-            return strData
-        #General case. Returned msd has 1,2,3 bytes (2,4 or 6 hex digits)
-        logging.debug(f'Converting {strData} to a integer')
-        strHEX=''
-        for i in range(length,0,-2):
-            strHEX=strHEX+f'{strData[i-2:i]}'
-        v=int(strHEX,16)
-        logging.debug(f'{strData}(synscan hex) => {strHEX}(hex) => {v}(decimal)')
+        assert (len(data)<=6), f"Max allow value is FFFFFF. Actual={data}"
+        v=codec.decode_data(data)
+        if debug_enabled():
+            logging.debug(f'{data}(synscan hex) => {v}(decimal)')
         return v
 
     def _test_comm(self):
@@ -0,0 +1,199 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+synscand: long lived mount daemon.
+
+The daemon owns the connection to one mount (parameters already read,
+telemetry poller running) and serves motors methods on a local Unix
+socket, so short lived clients (the CLI tools) do not pay the mount
+handshake::
+
+    synscand --host 192.168.4.1 &
+    synscanStop            # one round trip to the mount
+
+Protocol: one JSON object per line. Request {"method":..,"args":[..],"kwargs":{..}}.
+Reply {"result":..} or {"error":..}.
+
+Clients use connect(), which returns a daemonClient if the daemon of that
+mount is running and a plain motors instance otherwise.
+'''
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+
+#motors methods served by the daemon
+METHODS=( 'goto','track','set_pos','set_switch',
+          'axis_goto','axis_track','axis_set_pos',
+          'axis_stop_motion','axis_stop_motion_hard',
+          'axis_get_pos','axes_wait2stop','update_current_values',
+          'snapshot','ping','params',
+          )
+
+
+def socket_path(udp_ip,udp_port):
+    '''Default Unix socket of the daemon of a mount. SYNSCAN_SOCKET overrides it'''
+    path=os.getenv('SYNSCAN_SOCKET')
+    if path:
+        return path
+    directory=os.getenv('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory,f'synscand-{os.getuid()}-{udp_ip}-{udp_port}.sock')
+
+
+def _jsonable(value):
+    '''Values (i.e. snapshots) as plain JSON types'''
+    if hasattr(value,'items'):
+        return {str(k):_jsonable(v) for k,v in value.items()}
+    if isinstance(value,(list,tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+def _axiskeys(value):
+    '''Restore the integer axis keys lost in JSON'''
+    if isinstance(value,dict):
+        return {(int(k) if k in ('1','2','3') else k):_axiskeys(v) for k,v in value.items()}
+    return value
+
+
+class _handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request=json.loads(line)
+                reply={'result':_jsonable(self.server.synscand.call(request['method'],
+                                                                   *request.get('args',[]),
+                                                                   **request.get('kwargs',{})))}
+            except Exception as error:
+                logging.warning(f'SYNSCAND: {error!r}')
+                reply={'error':str(error),'type':type(error).__name__}
+            self.wfile.write(json.dumps(reply).encode()+b'\n')
+
+
+class _server(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+    daemon_threads=True
+
+
+class synscanDaemon:
+    '''
+    Serve a motors instance on a Unix socket.
+    Every client connection gets its own thread so a stop can interrupt a
+    synchronous goto of another client.
+    '''
+    def __init__(self,smc,path,pollRates=None):
+        self.smc=smc
+        self.path=path
+        if not smc.poller:
+            smc.start_poller(pollRates)
+        if os.path.exists(path):
+            if _alive(path):
+                raise(NameError(f'SynscandAlreadyRunning: {path}'))
+            os.unlink(path)
+        self.server=_server(path,_handler)
+        self.server.synscand=self
+        self._thread=None
+
+    def call(self,method,*args,**kwargs):
+        if method not in METHODS:
+            raise(NameError(f'SynscandUnknownMethod: {method}'))
+        if method=='ping':
+            return 'pong'
+        if method=='params':
+            return self.smc.params
+        return getattr(self.smc,method)(*args,**kwargs)
+
+    def serve_forever(self):
+        logging.info(f'SYNSCAND: serving on {self.path}')
+        try:
+            self.server.serve_forever()
+        finally:
+            self.close()
+
+    def start(self):
+        '''Serve in a background thread'''
+        self._thread=threading.Thread(target=self.server.serve_forever,name='synscand',daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread=None
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class daemonClient:
+    '''
+    Proxy of a motors instance served by synscand.
+    Methods in METHODS are forwarded; errors are raised as NameError
+    like motors does.
+    '''
+    def __init__(self,path,timeout=None):
+        self.path=path
+        self._sock=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        self._file=self._sock.makefile('rwb')
+        self._lock=threading.Lock()
+
+    def call(self,method,*args,**kwargs):
+        request={'method':method,'args':list(args),'kwargs':kwargs}
+        with self._lock:
+            self._file.write(json.dumps(request).encode()+b'\n')
+            self._file.flush()
+            line=self._file.readline()
+        if not line:
+            raise(NameError('SynscandConnectionClosed'))
+        reply=json.loads(line)
+        if 'error' in reply:
+            raise(NameError(reply['error']))
+        return _axiskeys(reply['result'])
+
+    @property
+    def params(self):
+        return self.call('params')
+
+    def __getattr__(self,name):
+        if name not in METHODS:
+            raise AttributeError(name)
+        return lambda *args,**kwargs: self.call(name,*args,**kwargs)
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def _alive(path):
+    try:
+        client=daemonClient(path,timeout=1)
+    except OSError:
+        return False
+    try:
+        return client.call('ping')=='pong'
+    except (OSError,NameError,ValueError):
+        return False
+    finally:
+        client.close()
+
+
+def connect(udp_ip,udp_port,path=None):
+    '''daemonClient of the synscand serving this mount if running, motors otherwise'''
+    path=path or socket_path(udp_ip,udp_port)
+    if os.path.exists(path):
+        try:
+            client=daemonClient(path)
+            logging.info(f'Using synscand on {path}')
+            return client
+        except OSError as error:
+            logging.info(f'synscand not available ({error}). Direct mode')
+    import synscan
+    return synscan.motors(udp_ip,udp_port)
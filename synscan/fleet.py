@@ -0,0 +1,150 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Control several mounts from a single asyncio event loop.
+
+Every mount is an AsyncMotors instance. UDP mounts share the loop
+selector (one non blocking socket each, no threads). Serial mounts run
+their blocking transport in the loop executor::
+
+    async def main():
+        mounts=await fleet.create(['192.168.4.1','192.168.4.2:11880','/dev/ttyUSB0'])
+        await mounts.goto(30,30,synchronous=True)
+        print(await mounts.telemetry())
+        mounts.close()
+
+Broadcast operations send the commands to all mounts at the same time,
+so commanding N mounts costs about the same wall time as commanding one.
+They return a dictionary name:result where result is the exception raised
+by that mount, if any. A failing mount never stops the others.
+'''
+
+import asyncio
+import logging
+
+from synscan.asyncmotors import AsyncMotors
+from synscan.motors import UDP_PORT
+
+
+def parse_endpoint(endpoint):
+    '''
+    Parse a mount endpoint. Accepted forms:
+
+    * 'host' or 'host:port' (UDP, default port 11880)
+    * '/dev/ttyUSB0' (serial device, any path starting with '/')
+
+    Returns a dictionary with the AsyncMotors arguments
+    '''
+    if endpoint.startswith('/'):
+        return {'udp_ip':None,'udp_port':None,'serial_dev':endpoint}
+    host,_,port=endpoint.partition(':')
+    return {'udp_ip':host,'udp_port':int(port) if port else UDP_PORT,'serial_dev':None}
+
+
+class fleet:
+    '''
+    Group of mounts driven concurrently.
+
+    endpoints is a list of endpoint strings (see parse_endpoint) or a
+    dictionary name:endpoint. Mounts that can not be initialized within
+    timeoutSec are left out and reported in the errors attribute.
+    '''
+    def __init__(self,endpoints,timeoutSec=5):
+        if not isinstance(endpoints,dict):
+            endpoints={endpoint:endpoint for endpoint in endpoints}
+        self.endpoints=endpoints
+        self.timeoutSec=timeoutSec
+        self.mounts={}
+        self.errors={}
+
+    @classmethod
+    async def create(cls,endpoints,timeoutSec=5):
+        '''Build a fleet and connect all the mounts'''
+        mounts=cls(endpoints,timeoutSec)
+        await mounts.connect()
+        return mounts
+
+    async def _connect_one(self,name,endpoint):
+        smc=AsyncMotors(**parse_endpoint(endpoint))
+        try:
+            await asyncio.wait_for(smc.init(),self.timeoutSec)
+        except asyncio.TimeoutError:
+            smc.close()
+            raise(NameError(f'{name}: no response in {self.timeoutSec}s'))
+        return smc
+
+    async def connect(self):
+        '''Initialize all the mounts concurrently'''
+        names=[name for name in self.endpoints if name not in self.mounts]
+        results=await asyncio.gather(*[self._connect_one(name,self.endpoints[name]) for name in names],
+                                     return_exceptions=True)
+        for name,result in zip(names,results):
+            if isinstance(result,Exception):
+                logging.warning(f'FLEET: {name} not available: {result}')
+                self.errors[name]=result
+            else:
+                self.errors.pop(name,None)
+                self.mounts[name]=result
+        logging.info(f'FLEET: {len(self.mounts)}/{len(self.endpoints)} mounts ready')
+        return self
+
+    def close(self):
+        for smc in self.mounts.values():
+            smc.close()
+        self.mounts={}
+
+    def _selected(self,names):
+        if names is None:
+            return self.mounts
+        return {name:self.mounts[name] for name in names}
+
+    async def broadcast(self,operation,names=None):
+        '''
+        Run operation(smc) coroutine on every mount (or the given names)
+        concurrently. Returns name:result
+        '''
+        mounts=self._selected(names)
+        results=await asyncio.gather(*[operation(smc) for smc in mounts.values()],
+                                     return_exceptions=True)
+        for name,result in zip(mounts,results):
+            if isinstance(result,Exception):
+                logging.warning(f'FLEET: {name}: {result}')
+        return dict(zip(mounts,results))
+
+    async def goto(self,alpha,beta,synchronous=False,names=None):
+        '''GOTO all mounts. alpha,beta in degrees'''
+        return await self.broadcast(lambda smc: smc.goto(alpha,beta,synchronous),names)
+
+    async def track(self,alpha,beta,names=None):
+        '''TRACK all mounts. alpha,beta in degrees per second'''
+        return await self.broadcast(lambda smc: smc.track(alpha,beta),names)
+
+    async def stop(self,hard=False,synchronous=False,names=None):
+        '''Stop both axes of all mounts'''
+        async def _stop(smc):
+            stop=smc.axis_stop_motion_hard if hard else smc.axis_stop_motion
+            await asyncio.gather(stop(1,synchronous),stop(2,synchronous))
+        return await self.broadcast(_stop,names)
+
+    async def set_switch(self,on,names=None):
+        '''Switch on/off the auxiliary switch of all mounts'''
+        return await self.broadcast(lambda smc: smc.set_switch(on),names)
+
+    async def set_pos(self,alpha,beta,names=None):
+        '''Synchronize the position of all mounts'''
+        return await self.broadcast(lambda smc: smc.set_pos(alpha,beta),names)
+
+    async def telemetry(self,names=None):
+        '''
+        Current values of every mount: name:{1:values,2:values}.
+        A mount not answering within timeoutSec gets its exception instead.
+        '''
+        async def _values(smc):
+            return await asyncio.wait_for(smc.update_current_values(logaxis=None),self.timeoutSec)
+        results=await self.broadcast(_values,names)
+        for name,error in self.errors.items():
+            results.setdefault(name,error)
+        return results
@@ -0,0 +1,183 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+In-process metrics of the Synscan link.
+
+comm and the transports feed the module level registry (metrics.registry):
+
+* per command letter latency histograms (seconds)
+* commands answered per command letter
+* timeouts and retransmissions
+* discarded datagrams (stale, or not matching the command sent)
+* redundant writes suppressed by motors (see motors.shadow)
+* error codes returned by the motor controller (MotorNotStopped, DriverSleeping...)
+* bytes sent and received
+
+Read it with snapshot(), or dump it with to_json() / to_prometheus()::
+
+    from synscan import metrics
+    print(metrics.registry.to_prometheus())
+'''
+
+import bisect
+import json
+import threading
+
+#Histogram upper bounds in seconds. The last bucket (+Inf) is implicit
+LATENCY_BUCKETS=(0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0)
+
+
+class _histogram:
+    '''Fixed buckets histogram'''
+    def __init__(self,buckets):
+        self.buckets=buckets
+        self.counts=[0]*(len(buckets)+1)
+        self.sum=0.0
+        self.count=0
+        self.max=0.0
+
+    def observe(self,value):
+        self.counts[bisect.bisect_left(self.buckets,value)]+=1
+        self.sum+=value
+        self.count+=1
+        if value>self.max:
+            self.max=value
+
+    def snapshot(self):
+        cumulative=[]
+        total=0
+        for count in self.counts:
+            total+=count
+            cumulative.append(total)
+        return {'buckets':dict(zip([str(b) for b in self.buckets]+['+Inf'],cumulative)),
+                'sum':self.sum,
+                'count':self.count,
+                'mean':self.sum/self.count if self.count else None,
+                'max':self.max,
+                }
+
+
+class metricsRegistry:
+    '''
+    Thread safe registry of link metrics.
+    '''
+    def __init__(self,buckets=LATENCY_BUCKETS):
+        self.buckets=tuple(buckets)
+        self.lock=threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''Clear all metrics'''
+        with self.lock:
+            self.latency={}
+            self.commands={}
+            self.errors={}
+            self.timeouts=0
+            self.retransmits=0
+            self.discarded={}
+            self.suppressed={}
+            self.bytesSent=0
+            self.bytesReceived=0
+
+    def observe_latency(self,cmd,seconds):
+        '''Record the latency of one command (cmd is the command letter)'''
+        with self.lock:
+            histogram=self.latency.get(cmd)
+            if histogram is None:
+                histogram=self.latency[cmd]=_histogram(self.buckets)
+            histogram.observe(seconds)
+            self.commands[cmd]=self.commands.get(cmd,0)+1
+
+    def count_error(self,error):
+        '''Count an error code returned by the motor controller'''
+        with self.lock:
+            self.errors[error]=self.errors.get(error,0)+1
+
+    def count_timeout(self):
+        with self.lock:
+            self.timeouts+=1
+
+    def count_retransmit(self):
+        with self.lock:
+            self.retransmits+=1
+
+    def count_discarded(self,reason):
+        '''Count a datagram discarded by a transport (reason: stale, mismatch)'''
+        with self.lock:
+            self.discarded[reason]=self.discarded.get(reason,0)+1
+
+    def count_suppressed(self,cmd):
+        '''Count a write not sent because the axis already has that value'''
+        with self.lock:
+            self.suppressed[cmd]=self.suppressed.get(cmd,0)+1
+
+    def count_bytes(self,sent=0,received=0):
+        with self.lock:
+            self.bytesSent+=sent
+            self.bytesReceived+=received
+
+    def snapshot(self):
+        '''Return all the metrics as a dictionary'''
+        with self.lock:
+            return {'latency':{cmd:h.snapshot() for cmd,h in sorted(self.latency.items())},
+                    'commands':dict(sorted(self.commands.items())),
+                    'errors':dict(sorted(self.errors.items())),
+                    'timeouts':self.timeouts,
+                    'retransmits':self.retransmits,
+                    'discarded':dict(sorted(self.discarded.items())),
+                    'suppressed':dict(sorted(self.suppressed.items())),
+                    'bytesSent':self.bytesSent,
+                    'bytesReceived':self.bytesReceived,
+                    }
+
+    def to_json(self,**kwargs):
+        '''JSON dump of snapshot()'''
+        return json.dumps(self.snapshot(),**kwargs)
+
+    def to_prometheus(self,prefix='synscan'):
+        '''Prometheus text exposition format'''
+        snap=self.snapshot()
+        lines=[]
+        name=f'{prefix}_command_latency_seconds'
+        lines.append(f'# HELP {name} Command round trip time by command letter')
+        lines.append(f'# TYPE {name} histogram')
+        for cmd,h in snap['latency'].items():
+            for le,count in h['buckets'].items():
+                lines.append(f'{name}_bucket{{cmd="{cmd}",le="{le}"}} {count}')
+            lines.append(f'{name}_sum{{cmd="{cmd}"}} {h["sum"]}')
+            lines.append(f'{name}_count{{cmd="{cmd}"}} {h["count"]}')
+        name=f'{prefix}_commands_total'
+        lines.append(f'# HELP {name} Commands answered by command letter')
+        lines.append(f'# TYPE {name} counter')
+        for cmd,count in snap['commands'].items():
+            lines.append(f'{name}{{cmd="{cmd}"}} {count}')
+        name=f'{prefix}_errors_total'
+        lines.append(f'# HELP {name} Error codes returned by the motor controller')
+        lines.append(f'# TYPE {name} counter')
+        for error,count in snap['errors'].items():
+            lines.append(f'{name}{{error="{error}"}} {count}')
+        name=f'{prefix}_discarded_total'
+        lines.append(f'# HELP {name} Datagrams discarded by reason (stale, mismatch)')
+        lines.append(f'# TYPE {name} counter')
+        for reason,count in snap['discarded'].items():
+            lines.append(f'{name}{{reason="{reason}"}} {count}')
+        name=f'{prefix}_suppressed_total'
+        lines.append(f'# HELP {name} Redundant writes not sent by command letter')
+        lines.append(f'# TYPE {name} counter')
+        for cmd,count in snap['suppressed'].items():
+            lines.append(f'{name}{{cmd="{cmd}"}} {count}')
+        for key,metric,text in (('timeouts','timeouts_total','Commands without response'),
+                                ('retransmits','retransmits_total','Commands sent again after a timeout'),
+                                ('bytesSent','bytes_sent_total','Bytes written to the link'),
+                                ('bytesReceived','bytes_received_total','Bytes read from the link')):
+            lines.append(f'# HELP {prefix}_{metric} {text}')
+            lines.append(f'# TYPE {prefix}_{metric} counter')
+            lines.append(f'{prefix}_{metric} {snap[key]}')
+        return '\n'.join(lines)+'\n'
+
+
+#Default registry used by comm and the transports
+registry=metricsRegistry()
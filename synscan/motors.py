@@ -46,7 +46,16 @@
 
 import os
 import logging
-from synscan.comm import comm
+import threading
+import contextlib
+import functools
+from synscan.comm import comm,SERIAL_BAUDRATE
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+from synscan import paramcache
+from synscan.codec import debug_enabled
 import time
 
 UDP_IP = os.getenv("SYNSCAN_UDP_IP","192.168.4.1")
@@ -54,7 +63,317 @@ UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",11880))
 
 LOGGING_LEVEL=os.getenv("SYNSCAN_LOGGING_LEVEL",logging.INFO)
 
-class motors(comm):
+#Inquiry command of every current value
+VALUES_CMDS={ 'GotoTarget':'h', # Inquire Goto Target Position
+              'Position':'j',   # Inquire Position
+              'StepPeriod':'i', # Inquire Step Period
+              'Status':'f'      # Inquire Status
+              }
+
+#Inquiry command of every motor parameter
+PARAMETERS_CMDS={ 'countsPerRevolution':'a',  # Inquire Counts Per Revolution
+                  'TimerInterruptFreq':'b',   # Inquire Timer Interrupt Freq
+                  'StepPeriod':'i',           # Inquire Step Period
+                  'MotorBoardVersion':'e',    # Inquire Motor Board Version
+                  'HighSpeedRatio':'g',       # Inquire High Speed Ratio
+                  }
+
+#Default max age (seconds) of cached current values. See motors.axis_get_values
+CACHE_MAX_AGE={ 'GotoTarget':10.0,
+                'Position':0.2,
+                'StepPeriod':1.0,
+                'Status':1.0,
+                }
+
+#Commands that change the axis state and invalidate its cached values
+CACHE_INVALIDATING_CMDS='GJKLES'
+
+#Default bound (seconds) of the parameters retries (lazy mode and constructor)
+LAZY_INIT_TIMEOUT=10
+INIT_TIMEOUT=60
+#Default bound (seconds) of the update_current_values retries
+UPDATE_VALUES_TIMEOUT=30
+#Recovery retries back off exponentially from RETRY_INITIAL up to RETRY_MAX (seconds)
+RETRY_INITIAL=0.25
+RETRY_MAX=4.0
+
+#Speed mode planner (see motors.axis_speed_plan). High speed mode is used when
+#the low speed T1 preset would be below FAST_SPEED_T1 (coarse speed steps).
+#Back to low speed only above FAST_SPEED_T1*FAST_SPEED_HYSTERESIS
+FAST_SPEED_T1=64
+FAST_SPEED_HYSTERESIS=1.25
+#T1 preset bounds. Faster speeds are clamped to MIN_T1_PRESET; slower
+#speeds (T1 does not fit in 24 bits) are planned as a stop
+MIN_T1_PRESET=6
+MAX_T1_PRESET=0xFFFFFF
+
+#Setters whose last value is remembered per axis (mode, T1 preset, goto target).
+#Writing the same value again is suppressed. See motors.shadow
+SHADOW_CMDS='GIS'
+#Shadowed values forgotten by other commands (J in goto mode also forgets G and I)
+SHADOW_INVALIDATING_CMDS={'K':'GI','L':'GI','H':'S','M':'S'}
+
+#axis_wait2stop poll intervals (seconds)
+WAIT_POLL_MIN=0.02
+WAIT_POLL_MAX=1.0
+WAIT_POLL_TRACKING=0.05
+
+
+def axis_constants(params):
+    '''Per axis conversion constants, computed once from the motor parameters'''
+    constants={}
+    for axis,p in params.items():
+        CPR=p.get('countsPerRevolution') or 0
+        constants[axis]={'countsPerDegree':CPR/360,
+                         'degreesPerCount':360/CPR if CPR else 0,
+                         'timerFreq':p.get('TimerInterruptFreq') or 0,
+                         'highSpeedRatio':p.get('HighSpeedRatio') or 1,
+                         }
+    return constants
+
+def _retry(operation,timeout,timeoutError,errors=(NameError,)):
+    '''Call operation until it does not raise errors. Sleep RETRY_INITIAL
+    seconds after the first failure, doubling up to RETRY_MAX. Raise
+    NameError(timeoutError) after timeout seconds'''
+    deadline=time.monotonic()+timeout
+    wait=RETRY_INITIAL
+    while True:
+        try:
+            return operation()
+        except errors as error:
+            logging.warning(error)
+            remaining=deadline-time.monotonic()
+            if remaining<=0:
+                raise(NameError(timeoutError))
+            wait=min(wait,remaining)
+            logging.warning(f'Retrying in {wait:.2f}...')
+            time.sleep(wait)
+            wait=min(2*wait,RETRY_MAX)
+
+def _motion(method):
+    '''Run method inside a motion sequence (see motors.motion_sequence)'''
+    @functools.wraps(method)
+    def wrapper(self,*args,**kwargs):
+        with self.motion_sequence():
+            return method(self,*args,**kwargs)
+    return wrapper
+
+class motorsLogic:
+    '''
+    Transport free motor logic shared by motors and AsyncMotors: unit
+    conversions, speed planning, status and motion mode coding and
+    current values decoding. Needs params and axisConstants (and
+    waitPollMin/waitPollMax for the wait intervals).
+    '''
+    def degrees2counts(self,axis,degrees):
+        '''Return position or speed in counts for a given deg or deg/seconds value.
+        degrees can be a number or a NumPy array'''
+        return degrees*self.axisConstants[axis]['countsPerDegree']
+
+    def counts2degrees(self,axis,counts):
+        '''Return position or speed in degrees for a given counts or counts/seconds value.
+        counts can be a number or a NumPy array'''
+        return counts*self.axisConstants[axis]['degreesPerCount']
+
+    def _degreesPerSecond2T1preset(self,axis,degreesPerSecond):
+        '''Convert degrees per second to T1_preset (StepPeriod).
+        degreesPerSecond can be a number or a NumPy array'''
+        countsPerSecond=abs(self.degrees2counts(axis,degreesPerSecond))
+        TMR_Freq=self.axisConstants[axis]['timerFreq']
+        if _np is not None and isinstance(countsPerSecond,_np.ndarray):
+            with _np.errstate(divide='ignore'):
+                return _np.where(countsPerSecond>0,TMR_Freq/countsPerSecond,TMR_Freq)
+        if countsPerSecond <=0:
+            T1preset=TMR_Freq
+        else:
+            T1preset=TMR_Freq/countsPerSecond
+        return T1preset
+
+    def axis_speed_plan(self,axis,degreesPerSecond,fastSpeed=None):
+        '''
+        Plan a tracking speed. Return a dictionary with:
+
+            * fastSpeed: use high speed mode. In high speed mode every T1 interrupt
+              moves HighSpeedRatio counts, so T1 is HighSpeedRatio times larger
+              (finer speed steps, higher max speed)
+            * T1preset: integer T1 preset (StepPeriod) to write
+            * speed: exactly achievable speed in degrees per second (with sign)
+            * error: speed - degreesPerSecond
+            * relativeError: error/degreesPerSecond
+
+        fastSpeed is the current mode of the axis (None if unknown). It gives
+        hysteresis around FAST_SPEED_T1 so a speed close to the boundary
+        does not switch modes back and forth.
+
+        The T1 preset is clamped to MIN_T1_PRESET (speed and error are those
+        of the clamped preset). A speed too slow for a 24 bits preset is
+        planned as a stop (speed 0).
+        '''
+        TMR_Freq=self.params[axis]['TimerInterruptFreq']
+        ratio=self.params[axis].get('HighSpeedRatio') or 1
+        countsPerSecond=abs(self.degrees2counts(axis,degreesPerSecond))
+        if countsPerSecond<=0 or TMR_Freq/countsPerSecond>MAX_T1_PRESET:
+            return {'fastSpeed':bool(fastSpeed),
+                    'T1preset':TMR_Freq,
+                    'speed':0.0,
+                    'error':-degreesPerSecond,
+                    'relativeError':-1.0 if degreesPerSecond else 0.0,
+                    }
+        slowT1=TMR_Freq/countsPerSecond
+        threshold=FAST_SPEED_T1*FAST_SPEED_HYSTERESIS if fastSpeed else FAST_SPEED_T1
+        fast=ratio>1 and slowT1<threshold
+        countsPerInterrupt=ratio if fast else 1
+        T1preset=self._T1preset_value(slowT1*countsPerInterrupt)
+        speed=self.counts2degrees(axis,TMR_Freq*countsPerInterrupt/T1preset)
+        if degreesPerSecond<0:
+            speed=-speed
+        error=speed-degreesPerSecond
+        return {'fastSpeed':fast,
+                'T1preset':T1preset,
+                'speed':speed,
+                'error':error,
+                'relativeError':error/degreesPerSecond,
+                }
+
+    def _T1preset_value(self,T1preset):
+        '''Integer T1 preset to write (at least MIN_T1_PRESET).
+        None if it does not fit in 24 bits (too slow: stop)'''
+        if T1preset>MAX_T1_PRESET:
+            return None
+        return max(MIN_T1_PRESET,int(round(T1preset)))
+
+    def _decode_status(self,hexstring):
+        ''' Decode Status msg.
+        Status msg is 12bits long (3 HEX digits). 
+        
+        HEX digit1 bits:
+
+        * B0: 1=Tracking,0=Goto
+        * B1: 1=CCW,0=CW
+        * B2: 1=Fast,0=Slow
+
+        HEX digit2 bits:
+
+        * B0: 1=Running,0=Stopped
+        * B1: 1=Blocked,0=Normal
+
+        HEX digit3 bits:
+
+        * B0: 0 = Not Init,1 = Init done
+        * B1: 1 = Level switch on
+
+        The decode value is returned as a dictionary with the following keys:
+
+        * Tracking
+        * CCW
+        * FastSpeed
+        * Stopped
+        * Blocked
+        * InitDone
+        * LevelSwitchOn
+
+        '''
+        A=int(hexstring[0],16)       
+        B=int(hexstring[1],16)
+        C=int(hexstring[2],16)
+        if debug_enabled():
+            logging.debug(f'Decode status {hexstring} A:{A} B:{B} C:{C}')
+        status=dict()
+        status['Tracking']=bool(A & 0x01)
+        status['CCW']=bool((A & 0x02) >> 1)
+        status['FastSpeed']=bool((A & 0x04) >> 2)
+        status['Stopped']=not(B & 0x01)
+        status['Blocked']=bool((B & 0x02) >> 1)
+        status['InitDone']=not(C & 0x01)
+        status['LevelSwitchOn']=bool((B & 0x02) >> 1)
+        return status
+
+    def _motion_mode_value(self,Tracking,CW=True,fastSpeed=False):
+        '''Motion mode byte. See axis_set_motion_mode'''
+        if not Tracking:
+            if fastSpeed:
+                speedBit=0
+            else:
+                speedBit=1
+        else:
+            if fastSpeed:
+                speedBit=1
+            else:
+                speedBit=0
+        if Tracking:
+            value=16
+        else:
+            value=0
+        return value+speedBit*32+CW
+
+    def _values_cmds(self,parameterDict,initDone=True):
+        '''Batch of inquiries of parameterDict for both axes (see get_values)'''
+        cmds=[]
+        for axis in range(1,3):
+            for parameter,cmd in parameterDict.items():
+                cmds.append((cmd,axis,None))
+            #Send init done
+            if initDone:
+                cmds.append(('F',axis,None))  # Initialize
+        return cmds
+
+    def _parse_values(self,parameterDict,responses,initDone=True):
+        '''Responses of _values_cmds as a dictionary axis:parameter:value'''
+        responses=iter(responses)
+        params=dict()
+        for axis in range(1,3):
+            params[axis]=dict()
+            for parameter in parameterDict:
+                params[axis][parameter]=next(responses)
+            if initDone:
+                next(responses)
+        return params
+
+    def _decode_raw(self,axis,raw):
+        '''Convert raw current values of axis (positions without offset,
+        also in degrees, and decoded status)'''
+        values={}
+        degreesPerCount=self.axisConstants[axis]['degreesPerCount']
+        for parameter,value in raw.items():
+            if parameter in ['GotoTarget','Position']:
+                #Position values are offseting by 0x800000
+                value=value-0x800000
+                values[parameter+'Deg']=value*degreesPerCount
+            if parameter=='Status':
+                value=self._decode_status(value)
+                if not self.params[axis]['countsPerRevolution']:
+                  value['Blocked']=True
+            values[parameter]=value
+        return values
+
+    def _wait2stop_check(self,values,CW0):
+        '''Safety check of a goto being waited. CW0 is Position-GotoTarget
+        when the wait started. Returns 'hard' if the axis is getting farther
+        from the target, 'soft' if it overshot or goes in the wrong direction
+        and None otherwise (or when the axis is Tracking)'''
+        if values['Status']['Tracking']:
+            return None
+        CW1 = values['Position'] - values['GotoTarget']
+        if abs(CW1) > abs(CW0):
+            return 'hard'
+        if CW0*CW1 <= 0: # changed sign = overshot, or wrong direction
+            return 'soft'
+        return None
+
+    def _wait2stop_interval(self,values,speed,previous=None):
+        '''Seconds to sleep until the next poll of axis_wait2stop.
+        speed is the measured speed in counts per second (0 if not measured yet)
+        and previous the last interval (None on the first poll)'''
+        if values['Status']['Tracking']:
+            #Decelerating to stop in speed mode. Arrival can not be predicted
+            return WAIT_POLL_TRACKING
+        if speed<=0 or previous is None:
+            return self.waitPollMin
+        eta=abs(values['GotoTarget']-values['Position'])/speed
+        return min(self.waitPollMax,2*previous,max(self.waitPollMin,eta/2))
+
+
+class motors(motorsLogic,comm):
     '''
     Implementation of motor commands and logic
     following the document:
@@ -89,65 +408,269 @@ class motors(comm):
 
     **NOTE:** Methods begining with axis prefix act only onto selected axis.
 
+    **Telemetry cache:** current values read from the mount are cached per axis and field.
+    A cached value is reused while it is younger than cacheMaxAge[field] seconds
+    (see CACHE_MAX_AGE). Commands that change the axis state (G, J, K, L, E, S)
+    invalidate the cache of that axis.
+
+    **Redundant writes:** the last mode (G), T1 preset (I) and goto target (S)
+    written to every axis are kept in shadow. Writing the same value again is
+    not sent to the mount. Stops, errors and gotos forget them
+    (see SHADOW_INVALIDATING_CMDS and invalidate_shadow).
+
 
 
     '''
 
+    def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT,serial_dev=None,baudrate=SERIAL_BAUDRATE,transport=None,lazy=False,initTimeout=None,paramCache=True):
+        '''Init UDP comunication (serial if serial_dev is given, at baudrate).
+        transport can be any object with the commUDP interface (see synscan.trace)
 
-    def __init__(self,udp_ip=UDP_IP,udp_port=UDP_PORT,serial_dev=None):
-        '''Init UDP comunication '''      
-        logging.basicConfig(
-            format='%(asctime)s %(levelname)s:synscanMotor: %(message)s',
-            level=LOGGING_LEVEL
-            )
-        super(motors, self).__init__(udp_ip,udp_port,serial_dev)
-        self._init()
-        self.update_current_values()
+        With lazy=True the constructor does not touch the network nor the
+        logging configuration. Parameters are read on first use of params
+        (both axes in one batch) and current values on first query.
+        initTimeout bounds the parameters retries (seconds). None uses
+        INIT_TIMEOUT, or LAZY_INIT_TIMEOUT in lazy mode.
+        paramCache=False disables the on-disk parameters cache (see load_parameters).
+        '''
+        if not lazy:
+            logging.basicConfig(
+                format='%(asctime)s %(levelname)s:synscanMotor: %(message)s',
+                level=LOGGING_LEVEL
+                )
+        super(motors, self).__init__(udp_ip,udp_port,serial_dev,baudrate,transport,basicConfig=not lazy,paramCache=paramCache)
+        self.cacheMaxAge=dict(CACHE_MAX_AGE)
+        self._cache={1:{},2:{}}
+        self.values={1:{},2:{}}
+        self.waitPollMin=WAIT_POLL_MIN
+        self.waitPollMax=WAIT_POLL_MAX
+        self._motionCount=0
+        self._motionLock=threading.Lock()
+        self.poller=None
+        self._moveWorker=None
+        self.shadow={1:{},2:{}}
+        self._params=None
+        self._paramsLock=threading.Lock()
+        if initTimeout is None:
+            initTimeout=LAZY_INIT_TIMEOUT if lazy else INIT_TIMEOUT
+        self.initTimeout=initTimeout
+        if not lazy:
+            self._init()
+            self.update_current_values()
 
+    @property
+    def params(self):
+        '''Main motor parameters per axis. Read from the mount on first use'''
+        if self._params is None:
+            self._init()
+        return self._params
+
+    @params.setter
+    def params(self,value):
+        self._axisConstants=axis_constants(value)
+        self._params=value
+
+    @property
+    def axisConstants(self):
+        '''Per axis conversion constants (see axis_constants)'''
+        if self._params is None:
+            self._init()
+        return self._axisConstants
 
     def _init(self):
-        '''Get main motor parameters. Retry if comm fails'''
-        retrySec=2
+        '''Get main motor parameters. Retry with backoff if comm fails until initTimeout'''
+        with self._paramsLock:
+            if self._params is not None:
+                return
+            self.params=_retry(self.load_parameters,self.initTimeout,'getParametersTimeout')
+
+    def _send_cmd(self,cmd,axis,data=None,ndigits=6):
+        '''Command function. Invalidate cached values if the command changes the axis state.
+        Writes of the value the axis already has are suppressed (see shadow)'''
+        if self._shadowed(cmd,axis,data):
+            self.metrics.count_suppressed(cmd)
+            return ''
         try:
-            self.params=self.get_parameters()
-        except NameError as error:
-            logging.warning(error)
-            logging.warning(f'Retrying in {retrySec}...')
-            time.sleep(retrySec)
-            self._init()
+            response=super(motors, self)._send_cmd(cmd,axis,data,ndigits)
+        except NameError:
+            self.invalidate_shadow(axis)
+            raise
+        finally:
+            if cmd in CACHE_INVALIDATING_CMDS:
+                self.invalidate_cache(axis)
+        self._update_shadow(cmd,axis,data)
+        return response
 
-    def _degreesPerSecond2T1preset(self,axis,degreesPerSecond):
-        '''Convert degrees per second to T1_preset (StepPeriod)'''
-        countsPerSecond=self.degrees2counts(axis,degreesPerSecond)
-        TMR_Freq=self.params[axis]['TimerInterruptFreq']
-        if abs(countsPerSecond) <=0:
-            T1preset=TMR_Freq
-        else:
-            T1preset=TMR_Freq/abs(countsPerSecond)
-        return T1preset
+    def _send_cmds(self,cmds):
+        '''Batch command function. Invalidate cached values and suppress
+        redundant writes like _send_cmd'''
+        suppressed=[self._shadowed(c[0],c[1],c[2]) for c in cmds]
+        send=[c for c,skip in zip(cmds,suppressed) if not skip]
+        for c,skip in zip(cmds,suppressed):
+            if skip:
+                self.metrics.count_suppressed(c[0])
+        try:
+            sent=iter(super(motors, self)._send_cmds(send) if send else [])
+        except NameError:
+            for c in send:
+                self.invalidate_shadow(c[1])
+            raise
+        finally:
+            for c in send:
+                if c[0] in CACHE_INVALIDATING_CMDS:
+                    self.invalidate_cache(c[1])
+        responses=[]
+        for c,skip in zip(cmds,suppressed):
+            if skip:
+                responses.append('')
+            else:
+                responses.append(next(sent))
+                self._update_shadow(c[0],c[1],c[2])
+        return responses
+
+    def _shadowed(self,cmd,axis,data):
+        '''True if cmd writes the value the axis already has'''
+        return data is not None and cmd in SHADOW_CMDS and self.shadow.get(axis,{}).get(cmd)==data
+
+    def _update_shadow(self,cmd,axis,data):
+        '''Track the last value written by the shadowed commands'''
+        for a in ([1,2] if axis==3 else [axis]):
+            shadow=self.shadow[a]
+            if cmd in SHADOW_CMDS:
+                shadow[cmd]=data
+            elif cmd=='J':
+                if not shadow.get('G',0) & 0x10:
+                    #Goto: the controller drives T1 and returns to speed mode when it arrives
+                    shadow.pop('G',None)
+                    shadow.pop('I',None)
+            elif cmd in SHADOW_INVALIDATING_CMDS:
+                for c in SHADOW_INVALIDATING_CMDS[cmd]:
+                    shadow.pop(c,None)
+
+    def invalidate_shadow(self,axis=None):
+        '''Forget the last mode, T1 preset and goto target written to axis (both if None).
+        Use it if something else (i.e. a hand controller) commands the mount'''
+        for a in ([1,2] if axis in (None,3) else [axis]):
+            self.shadow[a]={}
+
+    @contextlib.contextmanager
+    def motion_sequence(self):
+        '''Mark a motion sequence (stop, set mode, target, start...) in progress.
+        The background poller does not use the link meanwhile'''
+        with self._motionLock:
+            self._motionCount+=1
+        try:
+            yield
+        finally:
+            with self._motionLock:
+                self._motionCount-=1
+
+    def motion_active(self):
+        '''True while a motion sequence is in progress'''
+        return self._motionCount>0
+
+    def start_poller(self,rates=None):
+        '''Start a background telemetry poller.
+        rates is a dictionary field:Hz. See synscan.poller.POLL_RATES
+        '''
+        from synscan.poller import telemetryPoller
+        self.stop_poller()
+        self.poller=telemetryPoller(self,rates).start()
+        return self.poller
+
+    def follow(self,samples,**kwargs):
+        '''Follow a path of (t,axis1Degrees,axis2Degrees) samples with speed commands.
+        Blocks until the path ends. See synscan.trajectory.trajectoryFollower
+        for the options. Returns the follower (results in follower.stats)
+        '''
+        from synscan.trajectory import trajectoryFollower
+        follower=trajectoryFollower(self,samples,**kwargs)
+        follower.follow()
+        return follower
+
+    def capture(self,points,**kwargs):
+        '''Take one exposure (auxiliary switch) at every (axis1,axis2) point, pipelining
+        the slews with the exposures. Blocks until the last frame. See
+        synscan.sequencer.captureSequencer for the options. Returns the sequencer
+        (results in sequencer.frames and sequencer.stats)
+        '''
+        from synscan.sequencer import captureSequencer
+        sequencer=captureSequencer(self,points,**kwargs)
+        sequencer.run()
+        return sequencer
+
+    def stop_poller(self):
+        '''Stop the background telemetry poller'''
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller=None
+
+    def snapshot(self):
+        '''Last snapshot published by the background poller (None if not running).
+        Reading it does not use the link'''
+        if self.poller is None:
+            return None
+        return self.poller.snapshot
+
+    def invalidate_cache(self,axis=None):
+        '''Forget cached current values of axis (both axes if None)'''
+        for a in ([1,2] if axis in (None,3) else [axis]):
+            self._cache[a]={}
+
+    def _decode_values(self,axis,raw):
+        '''Convert raw current values of axis and store them in values and in the cache'''
+        values=self.values.setdefault(axis,{})
+        now=time.monotonic()
+        values.update(self._decode_raw(axis,raw))
+        for parameter in raw:
+            self._cache[axis][parameter]=now
+        return values
+
+    def axis_get_values(self,axis,fields=VALUES_CMDS,maxAge=None):
+        '''Return current values of axis (dictionary like values[axis]).
+
+        Only fields older than their max age are queried, all in a single batch.
+        maxAge overrides cacheMaxAge for all fields (0 forces a query).
+        '''
+        return self.axes_get_values([axis],fields,maxAge)[axis]
 
+    def axes_get_values(self,axes,fields=VALUES_CMDS,maxAge=None):
+        '''Like axis_get_values for several axes in a single batch.
+        Returns a dictionary axis:values
+        '''
+        now=time.monotonic()
+        stale=[]
+        for axis in axes:
+            cache=self._cache[axis]
+            for field in fields:
+                age=maxAge if maxAge is not None else self.cacheMaxAge.get(field,0)
+                t=cache.get(field)
+                if t is None or now-t>age:
+                    stale.append((axis,field))
+        if stale:
+            responses=self._send_cmds([(VALUES_CMDS[field],axis,None) for axis,field in stale])
+            raw={axis:{} for axis in axes}
+            for (axis,field),response in zip(stale,responses):
+                raw[axis][field]=response
+            for axis in axes:
+                self._decode_values(axis,raw[axis])
+        return {axis:self.values[axis] for axis in axes}
 
     def get_values(self,parameterDict,initDone=True):
         '''
         Send all cmd in the parameterDict for both axis and return
         a dictionary with the values.
+        All queries are pipelined in a single batch (see comm._send_cmds)
 
         Used by get_parameters and update_current_values functions
 
         '''
-        params=dict()
-        for axis in range(1,3):
-            params[axis]=dict()
-            for parameter,cmd in parameterDict.items():
-                try:
-                    params[axis][parameter]=self._send_cmd(cmd,axis)
-                except NameError as error:
-                    logging.warning(error)
-                    raise(NameError('getValuesError'))
-            #Send init done
-            if initDone:
-                self._send_cmd('F',axis)  # Initialize
-        return params
+        try:
+            responses=self._send_cmds(self._values_cmds(parameterDict,initDone))
+        except NameError as error:
+            logging.warning(error)
+            raise(NameError('getValuesError'))
+        return self._parse_values(parameterDict,responses,initDone)
 
     def get_parameters(self):
         '''
@@ -164,14 +687,8 @@ class motors(comm):
             * HighSpeedRatio
 
         '''
-        parameterDict={ 'countsPerRevolution':'a',  # Inquire Counts Per Revolution 
-                        'TimerInterruptFreq':'b',   # Inquire Timer Interrupt Freq
-                        'StepPeriod':'i',           # Inquire Step Period 
-                        'MotorBoardVersion':'e',    # Inquire Motor Board Version 
-                        'HighSpeedRatio':'g',       # Inquire High Speed Ratio
-                        }
         try:
-            params=self.get_values(parameterDict, initDone=True)
+            params=self.get_values(PARAMETERS_CMDS, initDone=True)
         except NameError as error:
             logging.warning(error)
             raise(NameError('getParametersError'))
@@ -179,6 +696,42 @@ class motors(comm):
         logging.info(f'MOUNT PARAMETERS: {params}')
         return params
 
+    def load_parameters(self,refresh=False):
+        '''
+        Get main motor parameters using the on-disk cache (see synscan.paramcache).
+
+        Cached parameters are validated with the motor board version of both
+        axes. Board version, StepPeriod and InitDone go in a single batch, so a
+        valid cache costs one round trip. With refresh=True, a missing cache or
+        a board version mismatch all parameters are queried (get_parameters)
+        and stored. Nothing is read nor stored if paramCache is False.
+        '''
+        cached=None if refresh or not self.paramCache else paramcache.load(self.endpoint)
+        if cached:
+            cmds=[]
+            for axis in range(1,3):
+                cmds+=[('e',axis,None),('i',axis,None),('F',axis,None)]
+            try:
+                responses=self._send_cmds(cmds)
+            except NameError as error:
+                logging.warning(error)
+                raise(NameError('getParametersError'))
+            if all(cached[axis].get('MotorBoardVersion')==responses[3*(axis-1)] for axis in range(1,3)):
+                for axis in range(1,3):
+                    cached[axis]['StepPeriod']=responses[3*(axis-1)+1]
+                logging.info(f'MOUNT PARAMETERS (cached): {cached}')
+                return cached
+            logging.info('Motor board version changed. Refreshing parameters cache')
+        params=self.get_parameters()
+        if self.paramCache:
+            paramcache.store(self.endpoint,params)
+        return params
+
+    def refresh_parameters(self):
+        '''Query all motor parameters again and update the on-disk cache'''
+        self.params=self.load_parameters(refresh=True)
+        return self.params
+
     def axis_get_pos(self,axis):
         '''Get actual position in Degrees.'''
         counts=self.axis_get_posCounts(axis)
@@ -191,52 +744,6 @@ class motors(comm):
           counts=self.degrees2counts(axis,degrees)
           response=self.axis_set_posCounts(axis,int(counts))
 
-    def _decode_status(self,hexstring):
-        ''' Decode Status msg.
-        Status msg is 12bits long (3 HEX digits). 
-        
-        HEX digit1 bits:
-
-        * B0: 1=Tracking,0=Goto
-        * B1: 1=CCW,0=CW
-        * B2: 1=Fast,0=Slow
-
-        HEX digit2 bits:
-
-        * B0: 1=Running,0=Stopped
-        * B1: 1=Blocked,0=Normal
-
-        HEX digit3 bits:
-
-        * B0: 0 = Not Init,1 = Init done
-        * B1: 1 = Level switch on
-
-        The decode value is returned as a dictionary with the following keys:
-
-        * Tracking
-        * CCW
-        * FastSpeed
-        * Stopped
-        * Blocked
-        * InitDone
-        * LevelSwitchOn
-
-        '''
-        A=int(hexstring[0],16)       
-        B=int(hexstring[1],16)
-        C=int(hexstring[2],16)
-        logging.debug(f'Decode status {hexstring} A:{A} B:{B} C:{C}')
-        status=dict()
-        status['Tracking']=bool(A & 0x01)
-        status['CCW']=bool((A & 0x02) >> 1)
-        status['FastSpeed']=bool((A & 0x04) >> 2)
-        status['Stopped']=not(B & 0x01)
-        status['Blocked']=bool((B & 0x02) >> 1)
-        status['InitDone']=not(C & 0x01)
-        status['LevelSwitchOn']=bool((B & 0x02) >> 1)
-        return status
-
-
     def axis_set_motion_mode(self,axis,Tracking,CW=True,fastSpeed=False):
         '''Set Motion Mode.
 
@@ -261,21 +768,7 @@ class motors(comm):
         '''
         if not self.params[axis]['countsPerRevolution']:
           return None
-        if not Tracking:
-            if fastSpeed:
-                speedBit=0
-            else:
-                speedBit=1
-        else:
-            if fastSpeed:
-                speedBit=1
-            else:
-                speedBit=0
-        if Tracking:
-            value=16
-        else:
-            value=0
-        value=value+speedBit*32+CW
+        value=self._motion_mode_value(Tracking,CW,fastSpeed)
         #Send as two HEX digits
         logging.info(f'AXIS{axis}: Setting Motion Mode: {value} HEX:{value:02X}')
         response=self._send_cmd('G',axis,value,ndigits=2)   # SetMotionMode
@@ -319,23 +812,63 @@ class motors(comm):
         return response
 
     def axis_wait2stop(self,axis):    
-        '''Wait for given axis to Stop, or overshoot Target'''
-        if not self.params[axis]['countsPerRevolution']:
+        '''Wait for given axis to Stop, or overshoot Target.
+
+        Only position and status of the given axis are polled. The poll interval
+        adapts to the estimated time to arrival (distance to target / speed):
+        sparse far from the target and dense (waitPollMin) near it.
+        The speed is measured from consecutive positions; until there are two
+        samples the axis is polled every waitPollMin (in goto mode the
+        controller manages T1, so the step period does not give the speed).
+        The speed measured while accelerating is low, so the interval can at
+        most double from one poll to the next.
+        '''
+        self.axes_wait2stop([axis])
+
+    def axes_wait2stop(self,axes=(1,2)):
+        '''Wait for all given axes to Stop, or overshoot Target.
+        Axes are polled together in one batch. See axis_wait2stop
+        '''
+        axes=[axis for axis in axes if self.params[axis]['countsPerRevolution']]
+        if not axes:
           return
-        logging.info(f'AXIS{axis}: Waiting to stop.')
-        self.update_current_values()
-        CW0 = self.values[axis]['Position'] - self.values[axis]['GotoTarget'] # >0 = CW, <0 = CCW 
-        while not self.values[axis]['Status']['Stopped']:
-            time.sleep(1)
-            self.update_current_values()
-            # stop axis if the motor has gone too far, not when axis is Tracking, 
-            CW1 = self.values[axis]['Position'] - self.values[axis]['GotoTarget']
-            if not self.values[axis]['Status']['Tracking']:
-              if CW0*CW1 <= 0: # changed sign = overshot, or wrong direction
-                self.axis_stop_motion(axis)
-              if abs(CW1) > abs(CW0):
-                self.axis_stop_motion_hard(axis)
-        logging.info(f'AXIS{axis}: Stopped')
+        for axis in axes:
+            logging.info(f'AXIS{axis}: Waiting to stop.')
+        values=self.axes_get_values(axes,['GotoTarget','Position','Status'])
+        CW0={}
+        speed={}
+        last={}
+        for axis in axes:
+            CW0[axis] = values[axis]['Position'] - values[axis]['GotoTarget'] # >0 = CW, <0 = CCW 
+            speed[axis]=0
+            #No speed sample yet (the position may come from the cache)
+            last[axis]=None
+        waiting=[axis for axis in axes if not values[axis]['Status']['Stopped']]
+        interval=None
+        while waiting:
+            interval=min(self._wait2stop_interval(values[axis],speed[axis],interval) for axis in waiting)
+            time.sleep(interval)
+            values=self.axes_get_values(waiting,['Position','Status'],maxAge=0)
+            #Fresh values (maxAge=0). Not read from the cache, that a concurrent
+            #stop or invalidate_cache may empty
+            now=time.monotonic()
+            for axis in list(waiting):
+                if last[axis] is not None:
+                    lastPosition,lastTime=last[axis]
+                    if now>lastTime and values[axis]['Position']!=lastPosition:
+                        speed[axis]=abs(values[axis]['Position']-lastPosition)/(now-lastTime)
+                last[axis]=(values[axis]['Position'],now)
+                status=values[axis]['Status']
+                if status['Stopped']:
+                    logging.info(f'AXIS{axis}: Stopped')
+                    waiting.remove(axis)
+                    continue
+                # stop axis if the motor has gone too far, not when axis is Tracking
+                check=self._wait2stop_check(values[axis],CW0[axis])
+                if check=='soft':
+                    self.axis_stop_motion(axis,synchronous=False)
+                elif check=='hard':
+                    self.axis_stop_motion_hard(axis,synchronous=False)
 
     def axis_set_posCounts(self,axis,counts):
         '''Synchronize position Counts.'''
@@ -355,50 +888,66 @@ class motors(comm):
         response=self.axis_set_goto_targetCounts(axis,int(posCounts))
         return response
 
+    @_motion
     def axis_goto(self,axis,targetDegrees):
       '''Move given axis to target (goto)'''
       if self.params[axis]['countsPerRevolution']:
         self.axis_stop_motion(axis)
-        actualPos=self.axis_get_pos(axis)
+        actualPos=self.axis_get_values(axis,['Position'])['PositionDeg']
         self.axis_set_motion_mode(axis,False,(targetDegrees<actualPos),True)
         self.axis_set_goto_target(axis,targetDegrees)
         self.axis_start_motion(axis)
 
-    def axis_set_speed(self,axis,degreesPerSecond):
-        '''Set the tracking speed in degreesPerSecond'''
+    def axis_set_speed(self,axis,degreesPerSecond,fastSpeed=False):
+        '''Set the tracking speed in degreesPerSecond.
+        fastSpeed must match the motion mode of the axis (see axis_speed_plan)'''
         if not self.params[axis]['countsPerRevolution']:
           return None
         logging.info(f'AXIS{axis}: Setting speed to:{degreesPerSecond} degrees per second')
+        T1preset=None
         if degreesPerSecond!=0:
-            response=self._set_T1_preset(axis,int(self._degreesPerSecond2T1preset(axis,abs(degreesPerSecond))))
+            T1preset=self._degreesPerSecond2T1preset(axis,abs(degreesPerSecond))
+            if fastSpeed:
+                T1preset=T1preset*self.params[axis]['HighSpeedRatio']
+            T1preset=self._T1preset_value(T1preset)
+        if T1preset is not None:
+            response=self._set_T1_preset(axis,T1preset)
         else:
-            logging.info(f'AXIS{axis}: Requested speed==0. Stopping axis')
+            logging.info(f'AXIS{axis}: Requested speed {degreesPerSecond} too slow or 0. Stopping axis')
             response=self.axis_stop_motion(axis)
         return response
 
+    @_motion
     def axis_track(self,axis,speed):
-        #Check if we need to stop axis
-        if self.params[axis]['countsPerRevolution']:
-          self.update_current_values(axis)
-          stopped=self.values[axis]['Status']['Stopped']
-          CW=not self.values[axis]['Status']['CCW']
-          tracking=self.values[axis]['Status']['Tracking']
-          if not stopped:
-              if not tracking or (CW and (speed <0)) or (not CW and (speed >0)):
-                  logging.info(f'TRACK asked to change dir or mode tracking:{tracking} CW:{CW} speed:{speed}')
-                  self.axis_stop_motion(axis,synchronous=True)
-                  self.axis_set_motion_mode(axis,True,(speed <0),False)
-                  self.axis_set_speed(axis,speed)
-                  self.axis_start_motion(axis)
-                  return 
-              else:
-                  self.axis_set_speed(axis,speed)
-                  return 
-          else:
-              self.axis_set_motion_mode(axis,True,(speed <0),False)
-              self.axis_set_speed(axis,speed)
-              self.axis_start_motion(axis)
-              return
+        '''Move given axis at speed degrees per second.
+
+        High or low speed mode is chosen by axis_speed_plan. The mode is
+        reprogrammed (stop, set mode, start) only when the direction changes
+        or the speed crosses the mode boundary. Returns the speed plan
+        (achieved speed and quantization error) or None.
+        '''
+        if not self.params[axis]['countsPerRevolution']:
+            return None
+        status=self.axis_get_values(axis,['Status'])['Status']
+        stopped=status['Stopped']
+        CW=not status['CCW']
+        tracking=status['Tracking']
+        plan=self.axis_speed_plan(axis,speed,status['FastSpeed'] if tracking and not stopped else None)
+        if plan['speed']==0:
+            self.axis_set_speed(axis,0)
+            return plan
+        logging.info(f"AXIS{axis}: Speed plan {plan}")
+        if not stopped:
+            if not tracking or (CW and (speed <0)) or (not CW and (speed >0)) or plan['fastSpeed']!=status['FastSpeed']:
+                logging.info(f"TRACK asked to change dir or mode tracking:{tracking} CW:{CW} fast:{status['FastSpeed']} speed:{speed}")
+                self.axis_stop_motion(axis,synchronous=True)
+            else:
+                self._set_T1_preset(axis,plan['T1preset'])
+                return plan
+        self.axis_set_motion_mode(axis,True,(speed <0),plan['fastSpeed'])
+        self._set_T1_preset(axis,plan['T1preset'])
+        self.axis_start_motion(axis)
+        return plan
 
     def axis_start_motion(self,axis):
         '''Start Goto'''
@@ -408,24 +957,30 @@ class motors(comm):
         logging.info(f'AXIS{axis}: Starting motion')
         return response
 
+    @_motion
     def axis_stop_motion(self,axis,synchronous=True):
         '''Soft stop. If synchronous==True wait to finish'''
         if not self.params[axis]['countsPerRevolution']:
           return None
         logging.info(f'AXIS{axis}: Stopping')
         response=self._send_cmd('K',axis) # AxisStop (Not Instant stop), then set to Tracking. 'Ĺ' for hard stop
+        if self._moveWorker is not None:
+            self._moveWorker.notify_stop(axis)
         if synchronous:
             self.axis_wait2stop(axis)
         else:
             logging.info(f'AXIS{axis}: Ask to stop. In progress')
         return response
         
+    @_motion
     def axis_stop_motion_hard(self,axis,synchronous=True):
         '''Hard stop. If synchronous==True wait to finish'''
         if not self.params[axis]['countsPerRevolution']:
           return None
         logging.info(f'AXIS{axis}: Stopping (hard)')
         response=self._send_cmd('L',axis) # AxisStop (Instant stop)
+        if self._moveWorker is not None:
+            self._moveWorker.notify_stop(axis)
         if synchronous:
             self.axis_wait2stop(axis)
         else:
@@ -433,24 +988,6 @@ class motors(comm):
         return response
 
     #HIGH LEVEL API (arguments in degrees)
-    def degrees2counts(self,axis,degrees):
-        '''Return position or speed in counts for a given deg or deg/seconds value'''
-        CPR=self.params[axis]['countsPerRevolution']
-        if CPR:
-            value=degrees*CPR/360
-        else:
-            value=0
-        return value
-
-    def counts2degrees(self,axis,counts):
-        '''Return position or speed in degrees for a given counts or counts/seconds value'''
-        CPR=self.params[axis]['countsPerRevolution']
-        if CPR:
-            value=counts*360/CPR
-        else:
-            value=0
-        return value
-
     def set_switch(self,on):
         '''Switch on/off auxiliary switch'''
         if on:
@@ -468,26 +1005,69 @@ class motors(comm):
         if self.params[2]['countsPerRevolution']:
             self.axis_set_pos(2,beta)
 
+    @_motion
     def goto(self,alpha,beta,synchronous=False):
-        '''GOTO. alpha,beta in degrees'''
+        '''GOTO. alpha,beta in degrees.
+
+        Both axes are driven together: they are stopped at once, waited with a
+        single combined wait, programmed and started in the same batches.
+        So a two axis goto takes as long as the slowest axis.
+        '''
         logging.info(f'GOTO axis1={alpha} axis2={beta} degrees')
         angle={}
         angle[1]=alpha
         angle[2]=beta
-        for axis in [1,2]:
-            if self.params[axis]['countsPerRevolution']:
-              self.axis_goto(axis,angle[axis])
-              '''
-              self.axis_stop_motion(axis)
-              self.axis_set_motion_mode(axis,False,False,True)
-              self.axis_set_goto_target(axis,angle[axis])
-              self.axis_start_motion(axis)
-              '''
+        axes=[axis for axis in [1,2] if self.params[axis]['countsPerRevolution']]
+        if not axes:
+            return
+        for axis in axes:
+            logging.info(f'AXIS{axis}: Stopping')
+        self._send_cmds([('K',axis,None) for axis in axes]) # AxisStop (Not Instant stop)
+        self.axes_wait2stop(axes)
+        positions=self.axes_get_values(axes,['Position'])
+        cmds=[]
+        for axis in axes:
+            value=self._motion_mode_value(False,(angle[axis]<positions[axis]['PositionDeg']),True)
+            targetCounts=int(self.degrees2counts(axis,angle[axis]))
+            logging.info(f'AXIS{axis}: Setting Motion Mode: {value} HEX:{value:02X}')
+            logging.info(f'AXIS{axis}: Setting goto target to {angle[axis]} degrees ({targetCounts} counts)')
+            cmds.append(('G',axis,value,2))                 # SetMotionMode
+            cmds.append(('S',axis,targetCounts+0x800000))   # SetGotoTarget
+        self._send_cmds(cmds)
+        for axis in axes:
+            logging.info(f'AXIS{axis}: Starting motion')
+        self._send_cmds([('J',axis,None) for axis in axes]) # StartMotion
         if synchronous:
-            for axis in [1,2]:
-              if self.params[axis]['countsPerRevolution']:
-                self.axis_wait2stop(axis)
+            self.axes_wait2stop(axes)
+
+    def goto_async(self,alpha,beta):
+        '''Non blocking GOTO. alpha,beta in degrees.
 
+        Returns a moveHandle (a concurrent.futures.Future) that resolves when
+        both axes arrive. See synscan.moves
+        '''
+        axes=[axis for axis in [1,2] if self.params[axis]['countsPerRevolution']]
+        start=lambda: self.goto(alpha,beta,synchronous=False)
+        return self._submit_move(axes,start,f'GOTO({alpha},{beta})')
+
+    def track_async(self,alpha,beta):
+        '''Non blocking TRACK. alpha,beta in degrees per second.
+
+        Returns a moveHandle that resolves when both axes stop
+        (i.e. after cancel() or a stop). See synscan.moves
+        '''
+        axes=[axis for axis in [1,2] if self.params[axis]['countsPerRevolution']]
+        start=lambda: self.track(alpha,beta)
+        return self._submit_move(axes,start,f'TRACK({alpha},{beta})')
+
+    def _submit_move(self,axes,start,description):
+        from synscan.moves import moveHandle,moveWorker
+        with self._motionLock:
+            if self._moveWorker is None:
+                self._moveWorker=moveWorker(self)
+        return self._moveWorker.submit(moveHandle(self,axes,start,description))
+
+    @_motion
     def track(self,alpha,beta):
         '''GOTO. alpha,beta in degrees per second'''
         logging.info(f'TRACK speeds axis1={alpha} axis2={beta} degrees per seconds')
@@ -496,38 +1076,19 @@ class motors(comm):
         if self.params[2]['countsPerRevolution']:
           self.axis_track(2,beta)
 
-    def update_current_values(self,logaxis=2):
+    def update_current_values(self,logaxis=2,timeout=UPDATE_VALUES_TIMEOUT):
         '''Update current status and values
         logaxis can be 1,2,3 or None. 1 for only log current values of axis 1... 
+        If comm fails it is retried with backoff. NameError('updateValuesTimeout')
+        is raised after timeout seconds
         '''
-        parameterDict={ 'GotoTarget':'h', # Inquire Goto Target Position
-                        'Position':'j',   # Inquire Position
-                        'StepPeriod':'i', # Inquire Step Period 
-                        'Status':'f'      # Inquire Status 
-                        }
-        retrySec = 2
-        try:
-          params=self.get_values(parameterDict, initDone=False)
-
-          for parameter in ['GotoTarget','Position']:
-              for axis in range(1,3):
-                  #Position values are offseting by 0x800000
-                  params[axis][parameter]=params[axis][parameter]-0x800000
-                  if self.params[axis]['countsPerRevolution']:
-                    params[axis][parameter+'Deg']=params[axis][parameter]*360/self.params[axis]['countsPerRevolution']
-                  else:
-                    params[axis][parameter+'Deg']=0
-          for axis in range(1,3):
-              params[axis]['Status']=self._decode_status(params[axis]['Status'])
-              if not self.params[axis]['countsPerRevolution']:
-                params[axis]['Status']['Blocked']=True
-        except (NameError,KeyError,TypeError) as error:
-            logging.warning(error)
-            logging.warning(f'Retrying in {retrySec}...')
-            time.sleep(retrySec)
-            params = self.update_current_values(logaxis)
+        def _update():
+            params=self.get_values(VALUES_CMDS, initDone=False)
+            for axis in range(1,3):
+                params[axis]=dict(self._decode_values(axis,params[axis]))
+            return params
+        params=_retry(_update,timeout,'updateValuesTimeout',(NameError,KeyError,TypeError))
 
-        self.values=params
         if logaxis==3:
             logging.info(f'{params}')
         if logaxis in [1,2] and self.params[logaxis]['countsPerRevolution']:
@@ -0,0 +1,244 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Non blocking moves.
+
+motors.goto_async and motors.track_async return a moveHandle, a
+concurrent.futures.Future that resolves (with the final values of the
+axes) when all the axes of the move are stopped::
+
+    move=smc.goto_async(30,10)
+    move.add_done_callback(lambda m: print('arrived',m.result()))
+    ...
+    move.cancel()           # soft stop (K)
+    move.cancel(hard=True)  # instant stop (L)
+
+One worker thread per motors instance starts the moves and watches all
+of them, polling the involved axes in a single batch. The thread exits
+after idleSec seconds without moves and is started again by the next one.
+
+Gotos are polled like motors.axes_wait2stop (with the same overshoot
+check). Tracking axes only stop on request, so they are polled every
+waitPollMax and densely once a stop is sent through motors.
+'''
+
+import concurrent.futures
+import logging
+import threading
+import time
+
+
+class moveHandle(concurrent.futures.Future):
+    '''
+    Future of a move. The handle stays pending while the move is in
+    progress so cancel() is possible until the axes stop.
+    A new move on the same axes supersedes (cancels) this one.
+    '''
+    def __init__(self,smc,axes,start,description=''):
+        super(moveHandle, self).__init__()
+        self.smc=smc
+        self.axes=axes
+        self.description=description
+        self.started=False
+        self._start=start
+
+    def __repr__(self):
+        return f'<moveHandle {self.description} axes={self.axes} done={self.done()}>'
+
+    def cancel(self,hard=False):
+        '''Stop the move (soft K stop, or instant L stop if hard) and cancel the handle.
+        Returns False if the move has already finished'''
+        if self.done():
+            return False
+        if self.started:
+            for axis in self.axes:
+                if hard:
+                    self.smc.axis_stop_motion_hard(axis,synchronous=False)
+                else:
+                    self.smc.axis_stop_motion(axis,synchronous=False)
+        return self._supersede()
+
+    def _supersede(self):
+        '''Cancel without stopping the axes (a new move took them)'''
+        if not super(moveHandle, self).cancel():
+            return False
+        #Wake up concurrent.futures.wait/as_completed waiters
+        self.set_running_or_notify_cancel()
+        return True
+
+
+class moveWorker:
+    '''
+    Shared worker that starts queued moves and resolves them when
+    their axes stop. The thread runs only while there are moves
+    (see stop to end it at once).
+    '''
+    def __init__(self,smc,idleSec=0.5):
+        self.smc=smc
+        self.idleSec=idleSec
+        self.queue=[]
+        self.active=[]
+        #Last (position,time) and measured speed (counts per second) of moving axes
+        self._last={}
+        self._speed={}
+        #Position-GotoTarget of moving axes at the first poll (see motors._wait2stop_check)
+        self._CW0={}
+        #Axes asked to stop (see notify_stop)
+        self._stopRequested=set()
+        self._interval=None
+        self._lock=threading.Lock()
+        self._wakeup=threading.Event()
+        self._stopping=False
+        self._thread=None
+
+    def submit(self,handle):
+        with self._lock:
+            self.queue.append(handle)
+            if self._thread is None:
+                self._stopping=False
+                self._thread=threading.Thread(target=self._loop,name='synscanMoves',daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return handle
+
+    def notify_stop(self,axis):
+        '''A stop was sent to axis. Poll it at once and densely until it stops'''
+        with self._lock:
+            self._stopRequested.add(axis)
+        self._wakeup.set()
+
+    def stop(self):
+        '''End the thread. Pending handles are cancelled without stopping the axes'''
+        with self._lock:
+            thread=self._thread
+            self._stopping=True
+        self._wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _start_queued(self):
+        with self._lock:
+            queued,self.queue=self.queue,[]
+        for handle in queued:
+            if handle.done():
+                continue
+            for other in self.active:
+                if set(other.axes)&set(handle.axes):
+                    other._supersede()
+            for axis in handle.axes:
+                self._forget(axis)
+            self._interval=None
+            try:
+                handle._start()
+                handle.started=True
+                if handle.cancelled():
+                    #Cancelled while starting. Stop what was just started
+                    for axis in handle.axes:
+                        self.smc.axis_stop_motion(axis,synchronous=False)
+                    continue
+                self.active.append(handle)
+            except Exception as error:
+                logging.warning(f'Move {handle.description} failed: {error}')
+                handle.set_exception(error)
+
+    def _check_active(self):
+        '''Poll the axes of active moves and resolve the stopped ones.
+        Returns the seconds to wait until the next poll'''
+        self.active=[handle for handle in self.active if not handle.done()]
+        if not self.active:
+            return self.idleSec
+        axes=sorted({axis for handle in self.active for axis in handle.axes})
+        try:
+            values=self.smc.axes_get_values(axes,['GotoTarget','Position','Status'],maxAge=0)
+        except NameError as error:
+            logging.warning(f'Moves: {error}')
+            return self.smc.waitPollMax
+        #Fresh values (maxAge=0): time of the speed samples
+        now=time.monotonic()
+        stopped={axis for axis in axes if values[axis]['Status']['Stopped']}
+        for handle in self.active:
+            if set(handle.axes)<=stopped and not handle.done():
+                result={axis:dict(values[axis]) for axis in handle.axes}
+                try:
+                    handle.set_result(result)
+                except concurrent.futures.InvalidStateError:
+                    #Cancelled meanwhile
+                    pass
+        moving=[axis for axis in axes if axis not in stopped]
+        for axis in stopped:
+            self._forget(axis)
+        for axis in moving:
+            self._measure_speed(axis,values[axis]['Position'],now)
+            self._check_overshoot(axis,values[axis])
+        if not moving:
+            self._interval=None
+            return 0
+        self._interval=min(self._axis_interval(axis,values[axis]) for axis in moving)
+        return self._interval
+
+    def _axis_interval(self,axis,values):
+        '''Seconds to the next poll of a moving axis'''
+        if values['Status']['Tracking'] and axis not in self._stopRequested:
+            #Runs until a stop. Stops sent through motors wake up the worker
+            return self.smc.waitPollMax
+        return self.smc._wait2stop_interval(values,self._speed.get(axis,0),self._interval)
+
+    def _check_overshoot(self,axis,values):
+        '''Stop a goto that went too far (see motors.axes_wait2stop)'''
+        CW0=self._CW0.setdefault(axis,values['Position']-values['GotoTarget'])
+        check=self.smc._wait2stop_check(values,CW0)
+        try:
+            if check=='soft':
+                self.smc.axis_stop_motion(axis,synchronous=False)
+            elif check=='hard':
+                self.smc.axis_stop_motion_hard(axis,synchronous=False)
+        except NameError as error:
+            logging.warning(f'Moves: {error}')
+
+    def _forget(self,axis):
+        '''Drop the motion state of an axis that stopped or starts a new move'''
+        self._last.pop(axis,None)
+        self._speed.pop(axis,None)
+        self._CW0.pop(axis,None)
+        with self._lock:
+            self._stopRequested.discard(axis)
+
+    def _measure_speed(self,axis,position,now):
+        '''Speed of axis from consecutive positions taken at monotonic time now
+        (see motors.axes_wait2stop)'''
+        if axis in self._last:
+            lastPosition,lastTime=self._last[axis]
+            if now>lastTime and position!=lastPosition:
+                self._speed[axis]=abs(position-lastPosition)/(now-lastTime)
+        self._last[axis]=(position,now)
+
+    def _exit(self):
+        '''Leave the loop if stopping or idle. Returns True to exit'''
+        with self._lock:
+            if self._stopping:
+                pending,self.queue=self.queue+self.active,[]
+            elif self.queue or self.active:
+                return False
+            else:
+                pending=[]
+            self.active=[]
+            self._thread=None
+        for handle in pending:
+            handle._supersede()
+        return True
+
+    def _loop(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            self._start_queued()
+            wait=self._check_active()
+            if not self.active:
+                #Idle: wait for a new move or exit
+                if not self._wakeup.wait(self.idleSec) and self._exit():
+                    return
+            elif wait:
+                self._wakeup.wait(wait)
+        self._exit()
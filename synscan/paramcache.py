@@ -0,0 +1,90 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+On-disk cache of mount parameters.
+
+countsPerRevolution, TimerInterruptFreq, MotorBoardVersion and
+HighSpeedRatio do not change for a given mount, so motors stores them
+in a JSON file keyed by endpoint ('udp:192.168.4.1:11880',
+'serial:/dev/ttyUSB0'). On startup the cached values are validated with
+the motor board version of both axes (see motors.load_parameters).
+
+The file is $SYNSCAN_PARAMS_CACHE, or synscan/params.json in
+$XDG_CACHE_HOME (~/.cache by default). Set SYNSCAN_PARAMS_CACHE to an
+empty string to disable the cache. A single motors instance can opt out
+with motors(...,paramCache=False), i.e. for simulators on random ports.
+'''
+
+import json
+import logging
+import os
+
+
+def default_path():
+    path=os.getenv('SYNSCAN_PARAMS_CACHE')
+    if path is not None:
+        return path or None
+    directory=os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),'.cache')
+    return os.path.join(directory,'synscan','params.json')
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError,ValueError) as error:
+        logging.warning(f'Parameters cache {path} not readable: {error}')
+        return {}
+
+
+def _write(path,data):
+    try:
+        os.makedirs(os.path.dirname(path) or '.',exist_ok=True)
+        tmp=f'{path}.{os.getpid()}.tmp'
+        with open(tmp,'w') as f:
+            json.dump(data,f,indent=4)
+        os.replace(tmp,path)
+    except OSError as error:
+        logging.warning(f'Parameters cache {path} not writable: {error}')
+
+
+def load(endpoint,path=None):
+    '''Cached parameters {1:{..},2:{..}} of endpoint or None'''
+    path=path or default_path()
+    if not path or not endpoint:
+        return None
+    params=_read(path).get(endpoint)
+    if not params:
+        return None
+    try:
+        return {int(axis):values for axis,values in params.items()}
+    except ValueError:
+        return None
+
+
+def store(endpoint,params,path=None):
+    '''Save the parameters of endpoint'''
+    path=path or default_path()
+    if not path or not endpoint:
+        return
+    data=_read(path)
+    data[endpoint]={str(axis):values for axis,values in params.items()}
+    _write(path,data)
+
+
+def forget(endpoint=None,path=None):
+    '''Remove endpoint from the cache (all endpoints if None)'''
+    path=path or default_path()
+    if not path:
+        return
+    data=_read(path)
+    if endpoint is None:
+        data={}
+    else:
+        data.pop(endpoint,None)
+    _write(path,data)
@@ -0,0 +1,232 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Vectorized planning helpers (NumPy required: pip install numpy).
+
+Convert whole grids or paths of angles in one call::
+
+    from synscan import planning
+    points=numpy.array([[az,alt] for az in range(0,360,5) for alt in range(0,90,5)])
+    counts=planning.degrees2counts(smc,points)
+    times=planning.slew_times(smc,points[:-1],points[1:])
+    total=planning.path_slew_time(smc,points)
+
+Order a mosaic to minimise the slewing between frames::
+
+    plan=planning.plan_mosaic(smc,points,start=(az0,alt0))
+    for az,alt in plan['points']:
+        smc.goto(az,alt,synchronous=True)
+
+smc is a motors (or AsyncMotors) instance: only its parameters are used,
+nothing is sent to the mount. Points are (N,2) arrays of axis1,axis2 degrees.
+
+Slew times are estimates: every axis accelerates at GOTO_ACCELERATION up to
+GOTO_SPEED (trapezoidal profile) and both axes move at the same time, so a
+move takes the time of the slowest axis plus GOTO_OVERHEAD.
+'''
+
+import time
+
+from synscan.motors import FAST_SPEED_T1,MIN_T1_PRESET,MAX_T1_PRESET
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#Estimated goto kinematics per axis (AZ-GTI like). Scalars or (axis1,axis2) pairs
+GOTO_SPEED=4.0          # degrees per second
+GOTO_ACCELERATION=4.0   # degrees per second^2
+GOTO_OVERHEAD=0.0       # seconds per goto (commands, settle...)
+
+
+def _numpy():
+    if np is None:
+        raise ImportError('synscan.planning needs NumPy (pip install numpy)')
+    return np
+
+
+def _points(points):
+    points=_numpy().asarray(points,dtype=float)
+    if points.ndim==1:
+        points=points.reshape(1,2)
+    return points
+
+
+def degrees2counts(smc,points):
+    '''(N,2) degrees to (N,2) integer counts of each axis'''
+    points=_points(points)
+    factors=np.array([smc.axisConstants[axis]['countsPerDegree'] for axis in (1,2)])
+    return np.rint(points*factors).astype(np.int64)
+
+
+def counts2degrees(smc,counts):
+    '''(N,2) counts to (N,2) degrees'''
+    counts=_numpy().asarray(counts,dtype=float).reshape(-1,2)
+    factors=np.array([smc.axisConstants[axis]['degreesPerCount'] for axis in (1,2)])
+    return counts*factors
+
+
+def speed_plans(smc,axis,speeds):
+    '''
+    Vectorized motors.axis_speed_plan (without hysteresis) for an array of
+    speeds (degrees per second) of one axis. Returns a dictionary of arrays:
+    fastSpeed, T1preset, speed (achievable) and error. Speeds too slow for
+    a 24 bits T1 preset are planned as stops (speed 0)
+    '''
+    speeds=_numpy().asarray(speeds,dtype=float)
+    constants=smc.axisConstants[axis]
+    TMR_Freq=constants['timerFreq']
+    ratio=constants['highSpeedRatio']
+    countsPerSecond=np.abs(speeds*constants['countsPerDegree'])
+    moving=countsPerSecond>0
+    with np.errstate(divide='ignore'):
+        slowT1=np.where(moving,TMR_Freq/np.where(moving,countsPerSecond,1),TMR_Freq)
+    moving&=slowT1<=MAX_T1_PRESET
+    slowT1=np.where(moving,slowT1,TMR_Freq)
+    fast=moving & (ratio>1) & (slowT1<FAST_SPEED_T1)
+    countsPerInterrupt=np.where(fast,ratio,1)
+    T1preset=np.maximum(MIN_T1_PRESET,np.rint(slowT1*countsPerInterrupt)).astype(np.int64)
+    speed=np.where(moving,np.sign(speeds)*TMR_Freq*countsPerInterrupt/T1preset*constants['degreesPerCount'],0.0)
+    return {'fastSpeed':fast,
+            'T1preset':T1preset,
+            'speed':speed,
+            'error':speed-speeds,
+            }
+
+
+def axis_slew_times(distances,speed=GOTO_SPEED,acceleration=GOTO_ACCELERATION):
+    '''Time to move distances (degrees, any shape) with a trapezoidal profile'''
+    distances=np.abs(_numpy().asarray(distances,dtype=float))
+    speed=np.asarray(speed,dtype=float)
+    acceleration=np.asarray(acceleration,dtype=float)
+    #Distance needed to reach full speed and stop again
+    ramp=speed*speed/acceleration
+    return np.where(distances<ramp,
+                    2*np.sqrt(distances/acceleration),
+                    distances/speed+speed/acceleration)
+
+
+def slew_times(smc,start,targets,speed=GOTO_SPEED,acceleration=GOTO_ACCELERATION,overhead=GOTO_OVERHEAD):
+    '''
+    Estimated goto time from start to targets: max over both axes.
+    start and targets are (N,2) (or (2,), broadcast) arrays of degrees.
+    Axes without motor (countsPerRevolution==0) do not count
+    '''
+    delta=_points(targets)-_points(start)
+    times=axis_slew_times(delta,speed,acceleration)
+    present=np.array([bool(smc.axisConstants[axis]['countsPerDegree']) for axis in (1,2)])
+    times=np.where(present,times,0)
+    return np.maximum(times[...,0],times[...,1])+overhead
+
+
+def path_slew_time(smc,points,start=None,**kwargs):
+    '''Total estimated time of visiting points in order (from start if given).
+    kwargs are passed to slew_times'''
+    points=_points(points)
+    if start is not None:
+        points=np.vstack([_points(start),points])
+    if len(points)<2:
+        return 0.0
+    return float(np.sum(slew_times(smc,points[:-1],points[1:],**kwargs)))
+
+
+def _nearest_neighbour(smc,coords,**kwargs):
+    '''Greedy path from coords[0] visiting all the coords'''
+    n=len(coords)
+    order=np.empty(n,dtype=np.int64)
+    order[0]=0
+    visited=np.zeros(n,dtype=bool)
+    visited[0]=True
+    current=0
+    for k in range(1,n):
+        costs=slew_times(smc,coords[current],coords,**kwargs)
+        costs[visited]=np.inf
+        current=int(np.argmin(costs))
+        order[k]=current
+        visited[current]=True
+    return order
+
+
+def _two_opt(smc,coords,order,maxPasses,maxSeconds=None,**kwargs):
+    '''
+    Improve an open path (first node fixed) reversing segments while it pays.
+    Every i evaluates all the j in one vectorized row. Stops after maxPasses
+    passes or maxSeconds seconds (None for no limit)
+    '''
+    n=len(order)
+    deadline=time.monotonic()+maxSeconds if maxSeconds is not None else None
+    #path follows order: reversed in place with it
+    path=coords[order]
+    #Slew times are symmetric, so a reversed segment costs the same
+    for _ in range(maxPasses):
+        improved=False
+        for i in range(n-2):
+            a,b=path[i],path[i+1]
+            #Reverse path[i+1:j+1] for every j>=i+2: edges (a,b) and (c,d)
+            #become (a,c) and (b,d). The last j has no d (open path)
+            c=path[i+2:]
+            d=path[i+3:]
+            m=len(c)
+            #One call for the (c,d), (a,c) and (b,d) edges of the row
+            times=slew_times(smc,np.vstack([c[:-1],np.broadcast_to(a,c.shape),np.broadcast_to(b,d.shape)]),
+                             np.vstack([d,c,d]),**kwargs)
+            gain=slew_times(smc,a,b,**kwargs)-times[m-1:2*m-1]
+            gain[:-1]+=times[:m-1]-times[2*m-1:]
+            best=int(np.argmax(gain))
+            if gain[best]>1e-9:
+                j=i+2+best
+                order[i+1:j+1]=order[i+1:j+1][::-1]
+                path[i+1:j+1]=path[i+1:j+1][::-1]
+                improved=True
+            if deadline is not None and time.monotonic()>deadline:
+                return order
+        if not improved:
+            break
+    return order
+
+
+def plan_mosaic(smc,points,start=None,maxPasses=10,maxSeconds=None,speed=GOTO_SPEED,acceleration=GOTO_ACCELERATION,overhead=GOTO_OVERHEAD):
+    '''
+    Order mosaic/panorama points to minimise the total slew time.
+
+    Both axes move at the same time, so the cost of a move is the time of the
+    slowest axis (see slew_times). The order is seeded with nearest neighbour
+    and improved with 2-opt: at most maxPasses passes (O(N^2) each) and, if
+    given, maxSeconds seconds. If start (the current position) is given the
+    path begins there, otherwise at points[0].
+
+    speed, acceleration and overhead are the goto kinematics of the mount
+    (scalars or (axis1,axis2) pairs, see slew_times). The mount does not
+    report them: the defaults are AZ-GTI estimates, pass the figures of
+    other mounts.
+
+    Returns a dictionary with:
+
+        * order: indices of points in visiting order
+        * points: (N,2) points in visiting order, ready for goto::
+
+            for az,alt in plan['points']:
+                smc.goto(az,alt,synchronous=True)
+
+        * time: estimated total slew time of the plan (seconds)
+        * originalTime: estimated total slew time in the given order
+    '''
+    points=_points(points)
+    kwargs={'speed':speed,'acceleration':acceleration,'overhead':overhead}
+    if not len(points):
+        return {'order':np.empty(0,dtype=np.int64),'points':points,'time':0.0,'originalTime':0.0}
+    coords=points if start is None else np.vstack([_points(start),points])
+    order=_nearest_neighbour(smc,coords,**kwargs)
+    order=_two_opt(smc,coords,order,maxPasses,maxSeconds,**kwargs)
+    if start is not None:
+        order=order[1:]-1
+    ordered=points[order]
+    return {'order':order,
+            'points':ordered,
+            'time':path_slew_time(smc,ordered,start,**kwargs),
+            'originalTime':path_slew_time(smc,points,start,**kwargs),
+            }
@@ -0,0 +1,127 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Background telemetry poller.
+
+A single thread refreshes the current values of both axes at a
+configurable rate per field and publishes immutable snapshots.
+Readers take the last snapshot without touching the link::
+
+    smc.start_poller({'Position':10,'Status':5})
+    snap=smc.snapshot()
+    snap[1]['PositionDeg'], snap[2]['Status']['Stopped']
+
+Polling pauses automatically while a motion sequence (goto, track,
+stop...) is using the link. See motors.motion_sequence.
+'''
+
+import logging
+import threading
+import time
+import types
+
+from synscan.motors import VALUES_CMDS
+
+#Default polling rates (Hz)
+POLL_RATES={ 'GotoTarget':0.5,
+             'Position':5.0,
+             'StepPeriod':1.0,
+             'Status':5.0,
+             }
+
+
+def _freeze(value):
+    '''Read only view of nested dictionaries'''
+    if isinstance(value,dict):
+        return types.MappingProxyType({k:_freeze(v) for k,v in value.items()})
+    return value
+
+
+class telemetryPoller:
+    '''
+    Poll a motors instance in a background thread.
+
+    rates is a dictionary field:Hz (see POLL_RATES). Fields with rate 0
+    are not polled. The last snapshot is in the snapshot attribute
+    (None until the first poll): a read only mapping with the keys
+    1, 2 (values of each axis, like update_current_values) and 'time'
+    (time.monotonic() of the poll).
+    '''
+    def __init__(self,smc,rates=None,retrySec=1):
+        self.smc=smc
+        self.rates=dict(POLL_RATES)
+        if rates:
+            self.rates.update(rates)
+        self.retrySec=retrySec
+        self.snapshot=None
+        self.polls=0
+        self.errors=0
+        self._next={field:0.0 for field in self.rates}
+        self._stop=threading.Event()
+        self._thread=None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread=threading.Thread(target=self._loop,name='synscanPoller',daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread=None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _due(self,now):
+        due=[]
+        for field,rate in self.rates.items():
+            if rate>0 and now>=self._next[field]:
+                due.append(field)
+                self._next[field]=now+1/rate
+        return due
+
+    def _wait_time(self,now):
+        nexts=[t for field,t in self._next.items() if self.rates[field]>0]
+        if not nexts:
+            return 1
+        return max(0,min(nexts)-now)
+
+    def poll(self,fields):
+        '''Query fields of both axes in one batch and publish a new snapshot'''
+        axes=[axis for axis in (1,2) if self.smc.params[axis]['countsPerRevolution']]
+        cmds=[(VALUES_CMDS[field],axis,None) for axis in axes for field in fields]
+        responses=iter(self.smc._send_cmds(cmds))
+        snapshot={'time':time.monotonic()}
+        for axis in (1,2):
+            if axis in axes:
+                raw={field:next(responses) for field in fields}
+                self.smc._decode_values(axis,raw)
+            snapshot[axis]=dict(self.smc.values.get(axis,{}))
+        self.snapshot=_freeze(snapshot)
+        self.polls+=1
+        return self.snapshot
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if self.smc.motion_active():
+                self._stop.wait(0.01)
+                continue
+            now=time.monotonic()
+            fields=self._due(now)
+            if not fields:
+                self._stop.wait(self._wait_time(now))
+                continue
+            try:
+                self.poll(fields)
+            except NameError as error:
+                self.errors+=1
+                logging.warning(f'Poller: {error}. Retrying in {self.retrySec}...')
+                self._stop.wait(self.retrySec)
@@ -16,10 +16,10 @@ import os
 @click.argument('altitude',type=float)
 def goto(host, port,azimuth,altitude,wait):
     """Do a GOTO to a target azimuth/altitude. Use '--' before AZIMUTH ALTITUDE with negative values"""
-    import synscan
+    from synscan.daemon import connect
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",port))
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=connect(UDP_IP,UDP_PORT)
     smc.goto(azimuth,altitude,synchronous=wait)
 
 
@@ -31,10 +31,10 @@ def goto(host, port,azimuth,altitude,wait):
 @click.argument('altitude_speed',type=float)
 def track(host, port, azimuth_speed, altitude_speed):
     """Move at desired speed (degrees per second). Use '--' before AZIMUTH ALTITUDE with negative values"""
-    import synscan
+    from synscan.daemon import connect
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",port))
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=connect(UDP_IP,UDP_PORT)
     smc.track(azimuth_speed,altitude_speed)
 
 #STOP
@@ -44,10 +44,10 @@ def track(host, port, azimuth_speed, altitude_speed):
 @click.option('--wait', type=bool, help='Wait until finished', default=True)
 def stop(host, port,wait):
     """Stop Motors"""
-    import synscan
+    from synscan.daemon import connect
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",port))
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=connect(UDP_IP,UDP_PORT)
     smc.axis_stop_motion(1,synchronous=wait)
     smc.axis_stop_motion(2,synchronous=wait)
 
@@ -59,14 +59,22 @@ def stop(host, port,wait):
 @click.option('--seconds', type=float, help='Show every N seconds (default 1s)', default=1)
 def watch(host, port,seconds):
     """Watch values"""
-    import synscan
+    from synscan.daemon import connect,daemonClient
     import json
     import time
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",port))
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=connect(UDP_IP,UDP_PORT)
+    if not isinstance(smc,daemonClient):
+        rate=1/seconds
+        smc.start_poller({'GotoTarget':rate,'Position':rate,'StepPeriod':rate,'Status':rate})
+    while smc.snapshot() is None:
+        time.sleep(0.01)
     while True:
-        response=smc.update_current_values(logaxis=3)
+        snapshot=smc.snapshot()
+        response={axis:dict(snapshot[axis]) for axis in (1,2)}
+        for axis in (1,2):
+            response[axis]['Status']=dict(response[axis]['Status'])
         t = time.localtime()
         response['TIME']=time.strftime("%H:%M:%S", t)
         print(json.dumps(
@@ -85,10 +93,10 @@ def watch(host, port,seconds):
 @click.argument('altitude',type=float)
 def synchronize(host, port,azimuth,altitude):
     """Synchronize actual position with the azimuth/altitude provided. Use '--' before AZIMUTH ALTITUDE with negative values"""
-    import synscan
+    from synscan.daemon import connect
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",port))
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=connect(UDP_IP,UDP_PORT)
     smc.set_pos(azimuth,altitude)
 
 #Set On/off auxiliary switch
@@ -99,15 +107,145 @@ def synchronize(host, port,azimuth,altitude):
 @click.argument('on',type=bool)
 def switch(host, port, on,seconds):
     """Activate/Deactivate mount auxiliary switch. ON must be bool (1 or 0)"""
-    import synscan
+    from synscan.daemon import connect
+    from synscan.sequencer import wait_until
     import time
     UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
     UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",port))
-    smc=synscan.motors(UDP_IP,UDP_PORT)
+    smc=connect(UDP_IP,UDP_PORT)
     if seconds>0:
+        #Timed from the send of the first command: latencies cancel out
+        start=time.monotonic()
         smc.set_switch(on)
-        time.sleep(seconds)
+        wait_until(start+seconds)
         smc.set_switch(not on)
     else:
         smc.set_switch(on)
 
+
+#SIMULATOR
+@click.command()
+@click.option('--host', type=str, help='Address to listen on', default='127.0.0.1')
+@click.option('--port', type=int, help='UDP port to listen on', default=11880)
+@click.option('--serial', type=bool, help='Serve on a pseudo-terminal instead of UDP', default=False)
+@click.option('--latency', type=float, help='One way delay added to responses (seconds)', default=0)
+@click.option('--jitter', type=float, help='Random extra delay (seconds)', default=0)
+@click.option('--loss', type=float, help='Probability of dropping a command or response', default=0)
+@click.option('--daemon', 'serve', type=bool, help='Serve the other CLI tools through synscand (UDP only, default True)', default=True)
+def sim(host, port, serial, latency, jitter, loss, serve):
+    """Run a local simulated mount (UDP or pseudo-terminal serial).
+
+    Over UDP a synscand session (without parameters cache) is also started,
+    so the other CLI tools pointed to the simulator do not cache it."""
+    import time
+    import synscan
+    from synscan.sim import simUDPServer,simPtyServer
+    from synscan.daemon import synscanDaemon,socket_path
+    if serial:
+        server=simPtyServer(latency=latency,jitter=jitter,loss=loss)
+        print(f'Simulated mount on serial device {server.device}')
+    else:
+        server=simUDPServer(host,port,latency=latency,jitter=jitter,loss=loss)
+        print(f'Simulated mount on UDP {server.address[0]}:{server.address[1]}')
+    with server:
+        if serve and not serial:
+            smc=synscan.motors(*server.address,paramCache=False)
+            daemon=synscanDaemon(smc,socket_path(*server.address))
+            print(f'synscand serving {server.address[0]}:{server.address[1]} on {daemon.path}')
+            try:
+                daemon.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            return
+        while True:
+            time.sleep(1)
+
+
+#FLEET
+@click.command()
+@click.option('--mount', 'mounts', type=str, multiple=True, help='Mount endpoint: host[:port] or serial device. Repeat for every mount')
+@click.option('--wait', type=bool, help='Wait until finished (goto/stop, default False)', default=False)
+@click.option('--seconds', type=float, help='Show every N seconds (watch, default 1s)', default=1)
+@click.argument('action',type=click.Choice(['goto','track','stop','switch','sync','watch']))
+@click.argument('values',type=float,nargs=-1)
+def fleet(mounts, wait, seconds, action, values):
+    """Send the same command to several mounts at once.
+
+    \b
+    ACTION VALUES:
+      goto AZIMUTH ALTITUDE
+      track AZIMUTH_SPEED ALTITUDE_SPEED
+      stop
+      switch ON
+      sync AZIMUTH ALTITUDE
+      watch
+    Use '--' before VALUES with negative values. Mounts can also be given
+    as a comma separated list in SYNSCAN_FLEET"""
+    import asyncio
+    import json
+    import time
+    from synscan.fleet import fleet as synscanFleet
+    if not mounts:
+        mounts=[m for m in os.getenv("SYNSCAN_FLEET","").split(',') if m]
+    if not mounts:
+        raise click.UsageError('No mounts. Use --mount or SYNSCAN_FLEET')
+    nvalues={'goto':2,'track':2,'stop':0,'switch':1,'sync':2,'watch':0}[action]
+    if len(values)!=nvalues:
+        raise click.UsageError(f'{action} needs {nvalues} values')
+
+    def _printable(results):
+        response={}
+        for name,result in results.items():
+            if isinstance(result,Exception):
+                response[name]=f'ERROR: {result!r}'
+            elif isinstance(result,dict):
+                response[name]={axis:dict(v,Status=dict(v['Status'])) for axis,v in result.items()}
+            else:
+                response[name]='OK'
+        return response
+
+    async def _run():
+        smcs=await synscanFleet.create(mounts)
+        try:
+            if action=='watch':
+                while True:
+                    response=_printable(await smcs.telemetry())
+                    response['TIME']=time.strftime("%H:%M:%S", time.localtime())
+                    print(json.dumps(response,sort_keys=False,indent=4,separators=(',', ': ')))
+                    await asyncio.sleep(seconds)
+            if action=='goto':
+                results=await smcs.goto(*values,synchronous=wait)
+            elif action=='track':
+                results=await smcs.track(*values)
+            elif action=='stop':
+                results=await smcs.stop(synchronous=wait)
+            elif action=='switch':
+                results=await smcs.set_switch(bool(values[0]))
+            elif action=='sync':
+                results=await smcs.set_pos(*values)
+            results.update(smcs.errors)
+            print(json.dumps(_printable(results),indent=4))
+        finally:
+            smcs.close()
+
+    asyncio.run(_run())
+
+
+#DAEMON
+@click.command()
+@click.option('--host', type=str, help='Synscan mount IP address', default='192.168.4.1')
+@click.option('--port', type=int, help='Synscan mount port', default=11880)
+@click.option('--socket', 'path', type=str, help='Unix socket to listen on (default: per mount in XDG_RUNTIME_DIR)', default=None)
+def daemon(host, port, path):
+    """Keep the mount connection open and serve the other CLI tools on a Unix socket"""
+    import synscan
+    from synscan.daemon import synscanDaemon,socket_path
+    UDP_IP = os.getenv("SYNSCAN_UDP_IP",host)
+    UDP_PORT = int(os.getenv("SYNSCAN_UDP_PORT",port))
+    smc=synscan.motors(UDP_IP,UDP_PORT)
+    server=synscanDaemon(smc,path or socket_path(UDP_IP,UDP_PORT))
+    print(f'synscand serving {UDP_IP}:{UDP_PORT} on {server.path}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
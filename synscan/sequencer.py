@@ -0,0 +1,188 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Pipelined capture sequencer (panoramas, mosaics...).
+
+Visit a list of (axis1,axis2) points and take one exposure at each one
+with the auxiliary switch (camera shutter release)::
+
+    sequencer=smc.capture(plan['points'],exposure=2,settle=0.5)
+    print(sequencer.stats)
+
+Per frame, instead of goto (stop, wait, read, program, start) followed by
+switch on, sleep and switch off:
+
+* All the targets are validated before the first move.
+* While the shutter is open the axes are stopped, so the motion mode and
+  goto target of the next frame are programmed during the exposure.
+* The batch closing the exposure also starts the next slew (O then J).
+* The exposure is timed on the monotonic clock. The switch off is sent
+  exposure seconds after the switch on was sent, so the one way latency
+  of both commands cancels out.
+* settle seconds are counted from the measured arrival, not from a fixed sleep.
+'''
+
+import logging
+import math
+import threading
+import time
+
+#Seconds before a deadline to stop sleeping and spin
+SPIN_SEC=0.002
+
+
+def wait_until(deadline,stopEvent=None):
+    '''Sleep until time.monotonic()>=deadline. Returns False if stopEvent is set first'''
+    while True:
+        remaining=deadline-time.monotonic()
+        if remaining<=0:
+            return True
+        if remaining>SPIN_SEC:
+            if stopEvent is not None:
+                if stopEvent.wait(remaining-SPIN_SEC):
+                    return False
+            else:
+                time.sleep(remaining-SPIN_SEC)
+        elif stopEvent is not None and stopEvent.is_set():
+            return False
+
+
+class captureSequencer:
+    '''
+    Take one exposure at every point.
+
+    * points: iterable of (axis1,axis2) degrees (i.e. planning.plan_mosaic points).
+    * exposure: seconds the auxiliary switch stays on.
+    * settle: seconds to wait after the axes arrive before the exposure.
+    * callback: called with the record of every frame once it is exposed.
+
+    run() blocks until the last frame (or stop()) and leaves the switch off.
+    frames holds one record per frame and stats the totals.
+    '''
+    def __init__(self,smc,points,exposure=2.0,settle=0.0,callback=None):
+        self.smc=smc
+        self.points=[(float(point[0]),float(point[1])) for point in points]
+        self.exposure=exposure
+        self.settle=settle
+        self.callback=callback
+        self.axes=[axis for axis in (1,2) if smc.params[axis]['countsPerRevolution']]
+        self.targets=self._validate(self.points)
+        self.frames=[]
+        self.stats={}
+        self._stop=threading.Event()
+
+    def _validate(self,points):
+        '''Target counts of every point. Raise before moving if any is not reachable'''
+        targets=[]
+        for index,point in enumerate(points):
+            target={}
+            for axis in self.axes:
+                degrees=point[axis-1]
+                if not math.isfinite(degrees):
+                    raise(NameError(f'CaptureInvalidTarget: frame {index} axis{axis}={degrees}'))
+                counts=int(self.smc.degrees2counts(axis,degrees))
+                #Positions are 24 bits offset by 0x800000
+                if not -0x800000<=counts<0x800000:
+                    raise(NameError(f'CaptureTargetOutOfRange: frame {index} axis{axis}={degrees} degrees'))
+                target[axis]=counts
+            targets.append(target)
+        return targets
+
+    def stop(self):
+        '''Stop the sequence (from another thread)'''
+        self._stop.set()
+
+    def _program(self,target):
+        '''Set motion mode and goto target of the axes that have to move.
+        Axes must be stopped. Returns the axes to start'''
+        positions=self.smc.axes_get_values(self.axes,['Position'],maxAge=0)
+        cmds=[]
+        moving=[]
+        for axis in self.axes:
+            position=positions[axis]['Position']
+            if target[axis]==position:
+                continue
+            value=self.smc._motion_mode_value(False,(target[axis]<position),True)
+            cmds.append(('G',axis,value,2))                 # SetMotionMode
+            cmds.append(('S',axis,target[axis]+0x800000))   # SetGotoTarget
+            moving.append(axis)
+        if cmds:
+            self.smc._send_cmds(cmds)
+        return moving
+
+    def _arrive(self,moving,started):
+        '''Wait for the axes to arrive and settle. Returns the slew seconds'''
+        self.smc.axes_wait2stop(moving)
+        arrival=time.monotonic()
+        if self.settle:
+            wait_until(arrival+self.settle,self._stop)
+        return arrival-started
+
+    def _switch(self,on):
+        '''Switch on/off. Returns the monotonic times before sending and at the reply'''
+        sent=time.monotonic()
+        self.smc.set_switch(on)
+        return sent,time.monotonic()
+
+    def run(self):
+        switchOn=False
+        self.frames=[]
+        t0=time.monotonic()
+        try:
+            if self.points:
+                #First frame: plain goto, the axes may be moving
+                started=time.monotonic()
+                self.smc.goto(*self.points[0],synchronous=True)
+                slew=self._arrive(self.axes,started)
+            lastOff=None
+            for index,point in enumerate(self.points):
+                if self._stop.is_set():
+                    break
+                with self.smc.motion_sequence():
+                    onSent,onReply=self._switch(True)
+                    switchOn=True
+                    deadline=onSent+self.exposure
+                    #Prepare the next slew while the shutter is open
+                    moving=self._program(self.targets[index+1]) if index+1<len(self.points) else []
+                    if not wait_until(deadline,self._stop):
+                        break
+                    #Close the exposure and start the next slew in one batch
+                    offSent=time.monotonic()
+                    self.smc._send_cmds([('O',1,0,1)]+[('J',axis,None) for axis in moving])
+                    offReply=time.monotonic()
+                    switchOn=False
+                frame={'index':index,
+                       'point':point,
+                       'slew':slew,
+                       'gap':onSent-lastOff if lastOff is not None else None,
+                       'exposure':(offSent+offReply)/2-(onSent+onReply)/2,
+                       }
+                self.frames.append(frame)
+                logging.info(f'CAPTURE: frame {frame}')
+                if self.callback is not None:
+                    self.callback(frame)
+                lastOff=offReply
+                if moving:
+                    slew=self._arrive(moving,offReply)
+                else:
+                    slew=0.0
+                    if self.settle:
+                        wait_until(time.monotonic()+self.settle,self._stop)
+        finally:
+            if switchOn:
+                self.smc.set_switch(False)
+            if self._stop.is_set():
+                for axis in self.axes:
+                    self.smc.axis_stop_motion(axis,synchronous=False)
+            gaps=[frame['gap'] for frame in self.frames if frame['gap'] is not None]
+            self.stats={'frames':len(self.frames),
+                        'elapsed':time.monotonic()-t0,
+                        'meanGap':sum(gaps)/len(gaps) if gaps else None,
+                        'meanSlew':sum(frame['slew'] for frame in self.frames)/len(self.frames) if self.frames else None,
+                        'maxExposureError':max(abs(frame['exposure']-self.exposure) for frame in self.frames) if self.frames else None,
+                        }
+        logging.info(f'CAPTURE: finished {self.stats}')
+        return self.stats
@@ -0,0 +1,14 @@
+'''
+Local simulator of the Synscan motor controller.
+
+Useful to test, load-test and benchmark the package without a mount::
+
+    from synscan.sim import simUDPServer
+    with simUDPServer(latency=0.005,loss=0.01) as sim:
+        smc=synscan.motors(*sim.address,paramCache=False)
+'''
+
+__all__ = ['simMount','simAxis','simUDPServer','simPtyServer','commSim']
+
+from synscan.sim.mount import simMount,simAxis
+from synscan.sim.server import simUDPServer,simPtyServer,commSim
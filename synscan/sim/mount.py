@@ -0,0 +1,277 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+import logging
+import threading
+import time
+
+from synscan import codec
+from synscan.codec import debug_enabled
+
+# Default parameters as reported by a SkyWatcher AZ-GTI (see reverse_engineering/captura.ok)
+AZGTI_PARAMS={'countsPerRevolution':6912000,
+              'TimerInterruptFreq':50000,
+              'MotorBoardVersion':0x005120,
+              'HighSpeedRatio':2,
+              }
+
+# Error codes. See comm._send_cmd
+UNKNOWN_COMMAND=0
+COMMAND_LENGTH_ERROR=1
+MOTOR_NOT_STOPPED=2
+INVALID_CHARACTER=3
+NOT_INITIALIZED=4
+
+# Expected data length (hex digits) of every command
+CMD_DATA_LENGTH={'a':0,'b':0,'e':0,'g':0,'i':0,'j':0,'h':0,'f':0,
+                 'F':0,'J':0,'K':0,'L':0,
+                 'G':2,'O':1,
+                 'I':6,'S':6,'H':6,'M':6,'E':6,
+                 }
+
+
+class simAxis:
+    '''
+    Kinematic model of one motor axis.
+
+    Position is kept in counts (without the 0x800000 offset).
+    Speeds are in counts per second and change with a constant
+    acceleration, so gotos and speed changes ramp like a real mount.
+    '''
+    def __init__(self,countsPerRevolution,TimerInterruptFreq,HighSpeedRatio,
+                 gotoSpeed=4.0,acceleration=4.0,minT1=6):
+        self.countsPerRevolution=countsPerRevolution
+        self.TimerInterruptFreq=TimerInterruptFreq
+        self.HighSpeedRatio=HighSpeedRatio
+        # gotoSpeed and acceleration in degrees per second (per second)
+        self.gotoSpeed=gotoSpeed*countsPerRevolution/360
+        self.acceleration=acceleration*countsPerRevolution/360
+        self.minT1=minT1
+        self.position=0.0
+        self.speed=0.0
+        self.target=0
+        self.breakPoint=0
+        self.T1=TimerInterruptFreq
+        self.tracking=True
+        self.fast=False
+        self.ccw=False
+        # (fast,ccw) of the tracking mode to restore after a goto
+        self.trackingMode=None
+        self.running=False
+        self.stopping=False
+        self.blocked=False
+        self.initDone=False
+
+    def _tracking_speed(self):
+        '''Requested (signed) speed in tracking mode'''
+        speed=self.TimerInterruptFreq/max(self.T1,self.minT1)
+        if self.fast:
+            speed=speed*self.HighSpeedRatio
+        return -speed if self.ccw else speed
+
+    def _approach(self,current,wanted,dt):
+        step=self.acceleration*dt
+        if abs(wanted-current)<=step:
+            return wanted
+        return current+step if wanted>current else current-step
+
+    def advance(self,dt):
+        '''Integrate the axis motion for dt seconds'''
+        if not self.running or dt<=0:
+            return
+        if self.stopping:
+            self.speed=self._approach(self.speed,0.0,dt)
+            self.position+=self.speed*dt
+            if self.speed==0:
+                self.running=False
+                self.stopping=False
+            return
+        if self.tracking:
+            self.speed=self._approach(self.speed,self._tracking_speed(),dt)
+            self.position+=self.speed*dt
+            return
+        # Goto: trapezoidal profile towards target
+        distance=self.target-self.position
+        direction=1 if distance>=0 else -1
+        brakingSpeed=(2*self.acceleration*abs(distance))**0.5
+        wanted=direction*min(self.gotoSpeed,brakingSpeed)
+        self.speed=self._approach(self.speed,wanted,dt)
+        newPosition=self.position+self.speed*dt
+        if abs(distance)<1 or (self.target-newPosition)*direction<=0:
+            self.position=float(self.target)
+            self.speed=0.0
+            self.running=False
+            if self.trackingMode is not None:
+                self.tracking=True
+                self.fast,self.ccw=self.trackingMode
+                self.trackingMode=None
+        else:
+            self.position=newPosition
+
+    def status(self):
+        '''Status in the 3 HEX digits format. See motors._decode_status'''
+        A=int(self.tracking)+2*int(self.ccw)+4*int(self.fast)
+        B=int(self.running)+2*int(self.blocked)
+        C=int(self.initDone)
+        return f'{A:X}{B:X}{C:X}'
+
+
+class simMount:
+    '''
+    Motor controller side of the Synscan protocol.
+
+    handle() takes a raw command (i.e. b':j1\\r') and returns the raw
+    response (i.e. b'=000080\\r'), advancing the axes kinematics to the
+    current time of the given clock. It is thread safe.
+
+    Data is coded with synscan.codec so both ends share the same rules.
+
+    Unlike the goto mode, that stays set after the goto, the mode
+    active before a goto (i.e. tracking) is restored on arrival.
+    '''
+    def __init__(self,params=AZGTI_PARAMS,gotoSpeed=4.0,acceleration=4.0,clock=time.monotonic):
+        self.params=dict(AZGTI_PARAMS)
+        self.params.update(params)
+        self.axes={axis:simAxis(self.params['countsPerRevolution'],
+                                self.params['TimerInterruptFreq'],
+                                self.params['HighSpeedRatio'],
+                                gotoSpeed,acceleration)
+                   for axis in (1,2)}
+        self.clock=clock
+        self.lastTime=clock()
+        self.switch=False
+        self.lock=threading.Lock()
+
+    def advance(self):
+        '''Bring the axes up to the clock time'''
+        now=self.clock()
+        dt=now-self.lastTime
+        self.lastTime=now
+        #Integrate in small steps to keep ramps accurate
+        while dt>0:
+            step=min(dt,0.01)
+            for axis in self.axes.values():
+                axis.advance(step)
+            dt-=step
+
+    def handle(self,msg):
+        '''Process a raw command and return the raw response'''
+        with self.lock:
+            self.advance()
+            try:
+                data=self._process(msg)
+            except simError as error:
+                if debug_enabled():
+                    logging.debug(f'SIM: {msg} => error {error.code}')
+                return b'!'+codec.encode(error.code,1)+b'\r'
+            if debug_enabled():
+                logging.debug(f'SIM: {msg} => {data}')
+            return b'='+data+b'\r'
+
+    def _process(self,msg):
+        msg=msg.strip(b'\r\n')
+        if len(msg)<3 or msg[0:1]!=b':':
+            raise simError(COMMAND_LENGTH_ERROR)
+        cmd=chr(msg[1])
+        if cmd not in CMD_DATA_LENGTH:
+            raise simError(UNKNOWN_COMMAND)
+        axisChar=chr(msg[2])
+        if axisChar not in '123':
+            raise simError(INVALID_CHARACTER)
+        data=msg[3:]
+        if len(data)!=CMD_DATA_LENGTH[cmd]:
+            raise simError(COMMAND_LENGTH_ERROR)
+        try:
+            value=codec.decode(data)
+        except ValueError:
+            raise simError(INVALID_CHARACTER)
+        # Axis '3' addresses both axes. Inquiries answer for axis 1
+        axes=[1,2] if axisChar=='3' else [int(axisChar)]
+        response=b''
+        for axis in reversed(axes):
+            response=self._axis_cmd(cmd,self.axes[axis],value)
+        return response
+
+    def _axis_cmd(self,cmd,axis,value):
+        if cmd=='a':
+            return codec.encode(self.params['countsPerRevolution'])
+        if cmd=='b':
+            return codec.encode(self.params['TimerInterruptFreq'])
+        if cmd=='e':
+            return codec.encode(self.params['MotorBoardVersion'])
+        if cmd=='g':
+            return codec.encode(self.params['HighSpeedRatio'],2)
+        if cmd=='i':
+            return codec.encode(axis.T1)
+        if cmd=='j':
+            return codec.encode((int(round(axis.position))+0x800000) & 0xFFFFFF)
+        if cmd=='h':
+            return codec.encode((axis.target+0x800000) & 0xFFFFFF)
+        if cmd=='f':
+            return axis.status().encode('ascii')
+        if cmd=='F':
+            axis.initDone=True
+            return b''
+        if cmd=='O':
+            self.switch=bool(value)
+            return b''
+        if cmd=='G':
+            if axis.running:
+                raise simError(MOTOR_NOT_STOPPED)
+            tracking=bool(value & 0x10)
+            if not tracking:
+                if axis.tracking:
+                    axis.trackingMode=(axis.fast,axis.ccw)
+            else:
+                axis.trackingMode=None
+            axis.tracking=tracking
+            speedBit=bool(value & 0x20)
+            #Speed bit meaning is inverted in goto mode
+            axis.fast=speedBit if axis.tracking else not speedBit
+            axis.ccw=bool(value & 0x01)
+            return b''
+        if cmd=='I':
+            axis.T1=value
+            return b''
+        if cmd=='S':
+            if axis.running:
+                raise simError(MOTOR_NOT_STOPPED)
+            axis.target=value-0x800000
+            return b''
+        if cmd=='H':
+            if axis.running:
+                raise simError(MOTOR_NOT_STOPPED)
+            increment=value-0x800000
+            axis.target=int(round(axis.position))+(-increment if axis.ccw else increment)
+            return b''
+        if cmd=='M':
+            axis.breakPoint=value
+            return b''
+        if cmd=='E':
+            axis.position=float(value-0x800000)
+            return b''
+        if cmd=='J':
+            if not axis.initDone:
+                raise simError(NOT_INITIALIZED)
+            axis.running=True
+            axis.stopping=False
+            return b''
+        if cmd=='K':
+            if axis.running:
+                axis.stopping=True
+            return b''
+        if cmd=='L':
+            axis.running=False
+            axis.stopping=False
+            axis.speed=0.0
+            return b''
+        raise simError(UNKNOWN_COMMAND)
+
+
+class simError(Exception):
+    '''Protocol error. Answered as !code'''
+    def __init__(self,code):
+        super(simError, self).__init__(code)
+        self.code=code
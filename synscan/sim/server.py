@@ -0,0 +1,195 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+import heapq
+import logging
+import os
+import random
+import select
+import socket
+import threading
+import time
+
+from synscan.sim.mount import simMount
+
+
+class commSim:
+    '''
+    In-process transport. Commands are handled directly by a simMount,
+    without sockets. Same interface as commUDP::
+
+        smc=synscan.motors(transport=commSim())
+    '''
+    def __init__(self,mount=None):
+        self.mount=mount if mount is not None else simMount()
+        self.commOK=True
+        self.lock=threading.Lock()
+
+    def cmd(self,cmd,timeout_in_seconds=2):
+        with self.lock:
+            return self.mount.handle(cmd)
+
+    def cmds(self,cmds,timeout_in_seconds=2):
+        with self.lock:
+            return [self.mount.handle(cmd) for cmd in cmds]
+
+
+class _simServer:
+    '''
+    Virtual. Common link impairments and thread handling.
+
+    * latency: one way delay (seconds) added to every response
+    * jitter: random extra delay (seconds, uniform 0..jitter). Responses
+      keep their order (like the single hop link of a real mount), so a
+      response is never sent before the previous one
+    * loss: probability of dropping a command or its response
+
+    Connect with paramCache=False so the parameters of the simulated
+    endpoint are not stored in the on-disk cache (see synscan.paramcache).
+    '''
+    def __init__(self,mount=None,latency=0,jitter=0,loss=0,seed=None):
+        self.mount=mount if mount is not None else simMount()
+        self.latency=latency
+        self.jitter=jitter
+        self.loss=loss
+        self._random=random.Random(seed)
+        self._queue=[]
+        self._seq=0
+        self._lastDue=0
+        self._running=False
+        self._thread=None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*args):
+        self.stop()
+
+    def start(self):
+        self._running=True
+        self._thread=threading.Thread(target=self._loop,daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running=False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread=None
+
+    def _lost(self):
+        return self.loss>0 and self._random.random()<self.loss
+
+    def _schedule(self,response,dest):
+        '''Queue response to be sent after the configured delay'''
+        delay=self.latency
+        if self.jitter:
+            delay+=self._random.uniform(0,self.jitter)
+        due=max(time.monotonic()+delay,self._lastDue)
+        self._lastDue=due
+        self._seq+=1
+        heapq.heappush(self._queue,(due,self._seq,response,dest))
+
+    def _next_timeout(self):
+        if not self._queue:
+            return 0.05
+        return max(0,min(0.05,self._queue[0][0]-time.monotonic()))
+
+    def _flush(self):
+        '''Send all due responses'''
+        now=time.monotonic()
+        while self._queue and self._queue[0][0]<=now:
+            due,seq,response,dest=heapq.heappop(self._queue)
+            self._send(response,dest)
+
+    def _process(self,msg,dest):
+        if self._lost():
+            logging.debug(f'SIM: dropping command {msg}')
+            return
+        response=self.mount.handle(msg)
+        if self._lost():
+            logging.debug(f'SIM: dropping response {response}')
+            return
+        self._schedule(response,dest)
+
+
+class simUDPServer(_simServer):
+    '''
+    Serve a simMount on a local UDP port.
+    Use port=0 to let the OS choose a free one (see address)::
+
+        with simUDPServer(latency=0.01) as sim:
+            smc=synscan.motors(*sim.address,paramCache=False)
+    '''
+    def __init__(self,host='127.0.0.1',port=0,**kwargs):
+        super(simUDPServer, self).__init__(**kwargs)
+        self._sock=socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self._sock.bind((host,port))
+        self._sock.setblocking(0)
+        self.address=self._sock.getsockname()
+
+    def stop(self):
+        super(simUDPServer, self).stop()
+        self._sock.close()
+
+    def _send(self,response,dest):
+        self._sock.sendto(response,dest)
+
+    def _loop(self):
+        logging.info(f'SIM: serving UDP on {self.address}')
+        while self._running:
+            ready=select.select([self._sock],[],[],self._next_timeout())
+            if ready[0]:
+                try:
+                    msg,dest=self._sock.recvfrom(1024)
+                except OSError:
+                    continue
+                self._process(msg,dest)
+            self._flush()
+
+
+class simPtyServer(_simServer):
+    '''
+    Serve a simMount on a pseudo-terminal so it can be used by commSerial.
+    The slave device path is in device::
+
+        with simPtyServer() as sim:
+            smc=synscan.motors(serial_dev=sim.device,paramCache=False)
+
+    If echo is True every command is echoed before its response,
+    like some direct serial links do.
+    '''
+    def __init__(self,echo=False,**kwargs):
+        import pty
+        import tty
+        super(simPtyServer, self).__init__(**kwargs)
+        self.echo=echo
+        self._master,self._slave=pty.openpty()
+        tty.setraw(self._slave)
+        self.device=os.ttyname(self._slave)
+        self._buffer=b''
+
+    def stop(self):
+        super(simPtyServer, self).stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _send(self,response,dest):
+        os.write(self._master,response)
+
+    def _loop(self):
+        logging.info(f'SIM: serving serial on {self.device}')
+        while self._running:
+            ready=select.select([self._master],[],[],self._next_timeout())
+            if ready[0]:
+                self._buffer+=os.read(self._master,1024)
+                while b'\r' in self._buffer:
+                    msg,self._buffer=self._buffer.split(b'\r',1)
+                    msg=msg+b'\r'
+                    if self.echo:
+                        self._send(msg,None)
+                    self._process(msg,None)
+            self._flush()
@@ -0,0 +1,216 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Wire traces of Synscan conversations.
+
+A trace is a list of records. Every record is a dict with the keys:
+
+* t: seconds since the start of the recording (None if unknown)
+* cmd: command sent, i.e. ':j1\\r'
+* response: response received, i.e. '=0606A0\\r'. None if the command timed out
+
+Traces are stored as JSON lines (one record per line).
+
+* commRecorder wraps a transport (commUDP, commSerial...) and records
+  every command, response and timestamp.
+* commReplay is a transport that serves recorded responses back.
+* parse_capture/load_capture read the raw captures in reverse_engineering/ (:cmd=response).
+
+Typical use::
+
+    smc=synscan.motors(transport=commRecorder(commUDP()))
+    ...
+    smc.comm.save('session.trace')
+
+    smc=synscan.motors(transport=commReplay(load('session.trace')))
+'''
+
+import json
+import logging
+import threading
+import time
+
+
+def load(path):
+    '''Load a trace from a JSON lines file'''
+    records=[]
+    with open(path,encoding='utf-8') as f:
+        for line in f:
+            line=line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def save(records,path):
+    '''Save a trace to a JSON lines file'''
+    with open(path,'w',encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record)+'\n')
+
+
+def parse_capture(data):
+    '''Parse a raw capture (see reverse_engineering/README).
+
+    Commands and responses are separated by \\r. Annotations after '||'
+    and non protocol lines are ignored. A command followed by another
+    command (a retry) is recorded as unanswered.
+
+    data is the capture contents (str or bytes). See load_capture.
+    '''
+    if isinstance(data,bytes):
+        data=data.decode('latin-1')
+    records=[]
+    pending=None
+    for token in data.replace('\n','\r').split('\r'):
+        token=token.split('||')[0].strip()
+        if token.startswith(':'):
+            if pending is not None:
+                records.append(pending)
+            pending={'t':None,'cmd':':'+token.lstrip(':')+'\r','response':None}
+        elif token[:1] in ('=','!'):
+            if pending is None:
+                logging.debug(f'Capture: response without command {token}')
+                continue
+            pending['response']=token+'\r'
+            records.append(pending)
+            pending=None
+        elif token:
+            logging.debug(f'Capture: ignoring {token}')
+    if pending is not None:
+        records.append(pending)
+    return records
+
+
+def load_capture(path):
+    '''Load and parse a raw capture file'''
+    with open(path,'rb') as f:
+        return parse_capture(f.read())
+
+
+class commRecorder:
+    '''
+    Transport wrapper that records every command, response and timestamp.
+    If path is given records are also appended to that file as they happen.
+    '''
+    def __init__(self,transport,path=None):
+        self.transport=transport
+        self.records=[]
+        self.path=path
+        self.t0=time.monotonic()
+        self._lock=threading.Lock()
+
+    @property
+    def commOK(self):
+        return self.transport.commOK
+
+    def _record(self,t,cmd,response):
+        record={'t':round(t-self.t0,6),
+                'cmd':cmd.decode('latin-1'),
+                'response':response.decode('latin-1') if response is not None else None}
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path,'a',encoding='utf-8') as f:
+                    f.write(json.dumps(record)+'\n')
+
+    def cmd(self,cmd,timeout_in_seconds=2):
+        t=time.monotonic()
+        try:
+            response=self.transport.cmd(cmd,timeout_in_seconds)
+        except NameError:
+            self._record(t,cmd,None)
+            raise
+        self._record(t,cmd,response)
+        return response
+
+    def cmds(self,cmds,timeout_in_seconds=2):
+        t=time.monotonic()
+        if not hasattr(self.transport,'cmds'):
+            return [self.cmd(cmd,timeout_in_seconds) for cmd in cmds]
+        try:
+            responses=self.transport.cmds(cmds,timeout_in_seconds)
+        except NameError:
+            for cmd in cmds:
+                self._record(t,cmd,None)
+            raise
+        for cmd,response in zip(cmds,responses):
+            self._record(t,cmd,response)
+        return responses
+
+    def save(self,path):
+        '''Save recorded trace as JSON lines'''
+        with self._lock:
+            save(self.records,path)
+
+
+class commReplay:
+    '''
+    Transport that serves recorded responses back.
+
+    * strict=True: commands must arrive in the recorded order. A different
+      command raises NameError('ReplayMismatchError').
+    * strict=False: the next record with the same command is served. If there
+      is none, the last response seen for that command is repeated. Useful
+      to replay captures of other clients (i.e. SynScan Pro).
+
+    Unanswered records and commands never seen raise
+    NameError('SynscanSocketTimeoutError') like a real timeout.
+    If realtime is True the recorded timing is reproduced, otherwise
+    responses are served at full CPU speed.
+    '''
+    def __init__(self,records,strict=False,realtime=False):
+        self.records=list(records)
+        self.strict=strict
+        self.realtime=realtime
+        self.position=0
+        self.commOK=False
+        self.lock=threading.Lock()
+        self._last={}
+        self._t0=None
+
+    def _wait(self,record):
+        if not self.realtime or record['t'] is None:
+            return
+        if self._t0 is None:
+            self._t0=time.monotonic()-record['t']
+        delay=self._t0+record['t']-time.monotonic()
+        if delay>0:
+            time.sleep(delay)
+
+    def _find(self,cmd):
+        if self.strict:
+            if self.position>=len(self.records):
+                raise(NameError('ReplayExhaustedError'))
+            record=self.records[self.position]
+            if record['cmd']!=cmd:
+                logging.warning(f"Replay mismatch. Expected {record['cmd']!r} got {cmd!r}")
+                raise(NameError('ReplayMismatchError'))
+            self.position+=1
+            return record
+        for i in range(self.position,len(self.records)):
+            if self.records[i]['cmd']==cmd:
+                self.position=i+1
+                return self.records[i]
+        return self._last.get(cmd)
+
+    def cmd(self,cmd,timeout_in_seconds=2):
+        '''Serve the recorded response for cmd'''
+        key=cmd.decode('latin-1')
+        with self.lock:
+            record=self._find(key)
+            if record is not None:
+                self._wait(record)
+            if record is None or record['response'] is None:
+                self.commOK=False
+                logging.debug(f"Replay timeout for {cmd}")
+                raise(NameError('SynscanSocketTimeoutError'))
+            self._last[key]=record
+            self.commOK=True
+            return record['response'].encode('latin-1')
+
+    def cmds(self,cmds,timeout_in_seconds=2):
+        return [self.cmd(cmd,timeout_in_seconds) for cmd in cmds]
@@ -0,0 +1,211 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Follow a time tagged path (satellite pass, comet ephemeris...).
+
+Samples are (t, axis1Degrees, axis2Degrees) tuples, from any iterable
+(a generator, a list or the rows of a NumPy array of shape (N,3)). They
+are read lazily, so a path can be streamed while it is being followed::
+
+    follower=smc.follow(samples,cadence=0.2)   # blocks until the path ends
+    print(follower.stats)
+
+Every cadence seconds (on the monotonic clock) the positions of both
+axes are read in one batch and a new speed is sent with axis_track:
+
+    speed = feed-forward (path velocity) + gain*position error/cadence
+
+The position error is predicted at the time the new speed takes effect,
+using the measured command latency (half the round trip of the reads).
+Positions are mount degrees: unwrap azimuth before (no 360 wrapping).
+
+Speeds below minSpeed (by default the slowest speed the controller can
+do) stop the axis without waiting. A tick failing on the link is logged
+and skipped.
+'''
+
+import collections
+import logging
+import threading
+import time
+
+from synscan.motors import MAX_T1_PRESET
+
+
+class pathSamples:
+    '''
+    Lazy linear interpolation of (t,axis1,axis2) samples.
+    Times must be increasing.
+    '''
+    def __init__(self,samples):
+        self._samples=iter(samples)
+        self._buffer=collections.deque()
+        self.exhausted=False
+
+    def _fill(self,t):
+        while not self.exhausted and (len(self._buffer)<2 or self._buffer[-1][0]<t):
+            try:
+                sample=next(self._samples)
+            except StopIteration:
+                self.exhausted=True
+                break
+            self._buffer.append((float(sample[0]),float(sample[1]),float(sample[2])))
+
+    def start(self):
+        '''Time of the first sample'''
+        self._fill(float('-inf'))
+        if not self._buffer:
+            raise ValueError('Empty path')
+        return self._buffer[0][0]
+
+    def end(self):
+        '''Time of the last sample. None while there are samples to read'''
+        return self._buffer[-1][0] if self.exhausted and self._buffer else None
+
+    def discard_before(self,t):
+        '''Forget samples not needed to interpolate at t or later'''
+        while len(self._buffer)>2 and self._buffer[1][0]<=t:
+            self._buffer.popleft()
+
+    def at(self,t):
+        '''Interpolated (axis1,axis2) at t. Clamped to the first/last sample'''
+        self._fill(t)
+        buffer=self._buffer
+        if t<=buffer[0][0] or len(buffer)==1:
+            return buffer[0][1],buffer[0][2]
+        for i in range(1,len(buffer)):
+            if buffer[i][0]>=t:
+                t0,a0,b0=buffer[i-1]
+                t1,a1,b1=buffer[i]
+                k=(t-t0)/(t1-t0) if t1>t0 else 1
+                return a0+k*(a1-a0),b0+k*(b1-b0)
+        return buffer[-1][1],buffer[-1][2]
+
+
+class trajectoryFollower:
+    '''
+    Follow a path with speed commands.
+
+    * samples: iterable of (t,axis1,axis2). t in seconds, relative to the first
+      sample, or time.time() values if absolute=True.
+    * cadence: seconds between speed updates.
+    * gain: fraction of the position error corrected in one cadence (0 disables
+      the feedback, 1 is dead beat).
+    * maxSpeed: speed limit in degrees per second (None for no limit).
+    * minSpeed: slower speeds stop the axis (degrees per second). None for the
+      slowest achievable speed (T1 preset MAX_T1_PRESET).
+    * axes: axes to drive.
+
+    follow() blocks until the end of the path (or stop()) and leaves the
+    axes stopped. stats holds the error and latency figures.
+    '''
+    def __init__(self,smc,samples,cadence=0.2,gain=0.7,maxSpeed=None,minSpeed=None,absolute=False,axes=(1,2)):
+        self.smc=smc
+        self.path=pathSamples(samples)
+        self.cadence=cadence
+        self.gain=gain
+        self.maxSpeed=maxSpeed
+        self.absolute=absolute
+        self.axes=[axis for axis in axes if smc.params[axis]['countsPerRevolution']]
+        if minSpeed is None:
+            minSpeed={axis:smc.counts2degrees(axis,smc.params[axis]['TimerInterruptFreq']/MAX_T1_PRESET) for axis in self.axes}
+        else:
+            minSpeed={axis:minSpeed for axis in self.axes}
+        self.minSpeed=minSpeed
+        self.latency=None
+        self.stats={}
+        self._stop=threading.Event()
+
+    def stop(self):
+        '''Stop following (from another thread)'''
+        self._stop.set()
+
+    def _path_time(self,now,t0,pathStart):
+        '''Monotonic time to path time'''
+        if self.absolute:
+            return now+t0
+        return now-t0+pathStart
+
+    def _read_positions(self):
+        '''Positions of the axes and the estimated time they were measured'''
+        t=time.monotonic()
+        values=self.smc.axes_get_values(self.axes,['Position'],maxAge=0)
+        positions={axis:values[axis]['PositionDeg'] for axis in self.axes}
+        rtt=time.monotonic()-t
+        oneWay=rtt/2
+        self.latency=oneWay if self.latency is None else 0.8*self.latency+0.2*oneWay
+        return positions,t+oneWay
+
+    def _speed(self,axis,target,targetNext,predicted):
+        speed=(targetNext-target)/self.cadence+self.gain*(target-predicted)/self.cadence
+        if self.maxSpeed is not None:
+            speed=max(-self.maxSpeed,min(self.maxSpeed,speed))
+        return speed
+
+    def _drive(self,axis,speed,current):
+        '''Send speed to axis. Returns the speed achieved'''
+        if abs(speed)<self.minSpeed[axis]:
+            if current:
+                self.smc.axis_stop_motion(axis,synchronous=False)
+            return 0.0
+        plan=self.smc.axis_track(axis,speed)
+        return plan['speed'] if plan else speed
+
+    def follow(self):
+        pathStart=self.path.start()
+        if self.absolute:
+            #Offset from monotonic to wall clock
+            t0=time.time()-time.monotonic()
+        else:
+            t0=time.monotonic()
+        speeds={axis:0.0 for axis in self.axes}
+        errors=[]
+        ticks=0
+        commErrors=0
+        tick=time.monotonic()
+        try:
+            while not self._stop.is_set():
+                try:
+                    positions,measured=self._read_positions()
+                    pathMeasured=self._path_time(measured,t0,pathStart)
+                    self.path.discard_before(pathMeasured)
+                    end=self.path.end()
+                    if end is not None and pathMeasured>=end:
+                        break
+                    truth=self.path.at(pathMeasured)
+                    errors.append(max(abs(truth[axis-1]-positions[axis]) for axis in self.axes))
+                    #New speeds take effect after the command latency
+                    effect=self._path_time(time.monotonic()+self.latency,t0,pathStart)
+                    target=self.path.at(effect)
+                    targetNext=self.path.at(effect+self.cadence)
+                    for axis in self.axes:
+                        predicted=positions[axis]+speeds[axis]*(effect-pathMeasured)
+                        speed=self._speed(axis,target[axis-1],targetNext[axis-1],predicted)
+                        speeds[axis]=self._drive(axis,speed,speeds[axis])
+                except NameError as error:
+                    commErrors+=1
+                    logging.warning(f'TRAJECTORY: {error}. Skipping tick')
+                ticks+=1
+                tick+=self.cadence
+                now=time.monotonic()
+                if tick<now:
+                    logging.warning(f'TRAJECTORY: {now-tick:.3f}s late. Skipping ticks')
+                    tick=now
+                self._stop.wait(tick-now)
+        finally:
+            for axis in self.axes:
+                try:
+                    self.smc.axis_stop_motion(axis,synchronous=False)
+                except NameError as error:
+                    logging.warning(f'TRAJECTORY: {error}')
+            self.stats={'ticks':ticks,
+                        'commErrors':commErrors,
+                        'maxError':max(errors) if errors else None,
+                        'rmsError':(sum(e*e for e in errors)/len(errors))**0.5 if errors else None,
+                        'latency':self.latency,
+                        }
+        logging.info(f'TRAJECTORY: finished {self.stats}')
+        return self.stats
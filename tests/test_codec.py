@@ -0,0 +1,114 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+Regression of synscan.codec against the original string based
+comm._int2hex/_hex2int implementation
+'''
+
+import pytest
+
+from synscan import codec
+from synscan.comm import comm
+
+
+def old_int2hex(data,ndigits=6):
+    '''comm._int2hex before the codec module'''
+    strData=f'{data:0{ndigits}X}' if ndigits else ''
+    strHEX=''
+    for i in range(len(strData),0,-2):
+        strHEX=strHEX+f'{strData[i-2:i]}'
+    return strHEX
+
+
+def old_hex2int(data):
+    '''comm._hex2int before the codec module'''
+    strData=data.decode("utf-8")
+    length=len(strData)
+    if length==0:
+        return ''
+    if length==3:
+        return strData
+    strHEX=''
+    for i in range(length,0,-2):
+        strHEX=strHEX+f'{strData[i-2:i]}'
+    return int(strHEX,16)
+
+
+VALUES={1:[0,1,0x7,0xA,0xF],
+        2:[0,1,0x12,0x7F,0xA5,0xFF],
+        4:[0,1,0x12,0x1234,0xABCD,0xFF00,0xFFFF],
+        6:[0,1,0x12,0x1234,0x123456,0x800000,0x7FFFFF,0xABCDEF,0xFFFFFF],
+        }
+
+
+@pytest.mark.parametrize('ndigits,value',[(n,v) for n,values in VALUES.items() for v in values])
+def test_encode_matches_old(ndigits,value):
+    assert codec.encode(value,ndigits).decode('ascii')==old_int2hex(value,ndigits)
+
+
+@pytest.mark.parametrize('ndigits,value',[(n,v) for n,values in VALUES.items() for v in values if n!=1])
+def test_decode_data_matches_old(ndigits,value):
+    data=old_int2hex(value,ndigits).encode('ascii')
+    assert codec.decode_data(data)==old_hex2int(data)==value
+    assert codec.decode_data(memoryview(data))==value
+
+
+@pytest.mark.parametrize('ndigits,value',[(n,v) for n,values in VALUES.items() for v in values])
+def test_round_trip(ndigits,value):
+    assert codec.decode(codec.encode(value,ndigits))==value
+
+
+def test_decode_data_special_cases():
+    assert codec.decode_data(b'')==old_hex2int(b'')==''
+    #Status is returned as string
+    assert codec.decode_data(b'101')==old_hex2int(b'101')=='101'
+    with pytest.raises(ValueError):
+        codec.decode_data(b'12345678')
+
+
+@pytest.mark.parametrize('ndigits,value',[(1,0x10),(2,0x100),(4,0x10000),(6,0x1000000),(6,-1)])
+def test_encode_out_of_range(ndigits,value):
+    with pytest.raises(ValueError):
+        codec.encode(value,ndigits)
+
+
+def test_build_cmd():
+    assert codec.build_cmd('j',1)==b':j1\r'
+    assert codec.build_cmd('S',2,0x123456)==b':S2563412\r'
+    assert codec.build_cmd('G',1,0x30,2)==b':G130\r'
+    assert codec.build_cmd('O',1,1,1)==b':O11\r'
+
+
+class fixedTransport:
+    '''Transport answering every command with response'''
+    def __init__(self,response):
+        self.response=response
+
+    def cmd(self,cmd,timeout_in_seconds=2):
+        return self.response
+
+    def cmds(self,cmds,timeout_in_seconds=2):
+        return [self.response for cmd in cmds]
+
+
+@pytest.mark.parametrize('response,error',[(b'!0\r','UnknownCommand'),
+                                           (b'!2\r','MotorNotStopped'),
+                                           (b'!8\r','NoValidPECdata'),
+                                           (b'!6\r','CMDUnknowError'),
+                                           (b'?\r','CMDUnknowError'),
+                                           ])
+def test_error_responses(response,error):
+    smc=comm(transport=fixedTransport(response),basicConfig=False)
+    with pytest.raises(NameError,match=error):
+        smc._send_cmd('J',1)
+    with pytest.raises(NameError,match=error):
+        smc._send_cmds([('j',1,None),('J',1,None)])
+
+
+def test_error_response_shape():
+    assert codec.response_matches(b':J1\r',b'!2\r')
+    assert codec.response_matches(b':j1\r',b'=563412\r')
+    assert not codec.response_matches(b':j1\r',b'=101\r')
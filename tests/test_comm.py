@@ -0,0 +1,206 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+commUDP against synscan.sim with scripted loss, reordering and late replies
+'''
+
+import heapq
+import random
+import time
+
+import pytest
+
+from synscan import metrics
+from synscan.comm import commUDP,commSerial,rttEstimator,IDEMPOTENT_CMDS
+from synscan.sim import simUDPServer,simPtyServer
+
+#Max delay of a swapped response (seconds)
+SWAP_SEC=0.02
+
+
+class scriptedServer(simUDPServer):
+    '''
+    simUDPServer whose impairments are chosen per command by script(msg).
+    script returns None (answer at once), 'drop', 'swap' (the response
+    is sent after the next one, or after SWAP_SEC) or the delay (seconds)
+    of the response.
+    Delays keep the order of the responses (see comm.commUDP.cmds).
+    Received commands are kept in received as (time,msg).
+    '''
+    def __init__(self,script=None,**kwargs):
+        super(scriptedServer, self).__init__(**kwargs)
+        self.script=script
+        self.received=[]
+        self._swapDue=None
+
+    def _process(self,msg,dest):
+        self.received.append((time.monotonic(),msg))
+        action=self.script(msg) if self.script is not None else None
+        if action=='drop':
+            return
+        response=self.mount.handle(msg)
+        if action=='swap' and self._swapDue is None:
+            #Out of the order: only the next response goes before
+            self._swapDue=time.monotonic()+SWAP_SEC
+            self._push(self._swapDue,response,dest)
+            return
+        self._later(response,dest,action if action not in (None,'swap') else 0)
+        if self._swapDue is not None:
+            self._lastDue=max(self._lastDue,self._swapDue)
+            self._swapDue=None
+
+    def _later(self,response,dest,delay):
+        due=max(time.monotonic()+delay,self._lastDue)
+        self._lastDue=due
+        self._push(due,response,dest)
+
+    def _push(self,due,response,dest):
+        self._seq+=1
+        heapq.heappush(self._queue,(due,self._seq,response,dest))
+
+    def count(self,msg):
+        return sum(1 for t,received in self.received if received==msg)
+
+
+def drop_first(*cmds):
+    '''Script dropping the first receipt of every cmd'''
+    seen=set()
+    def script(msg):
+        if msg in cmds and msg not in seen:
+            seen.add(msg)
+            return 'drop'
+        return None
+    return script
+
+
+@pytest.fixture
+def server():
+    with scriptedServer() as sim:
+        #Stationary mount with distinct values, so every answer is known
+        for axis,offset in ((1,1000),(2,5000)):
+            sim.mount.axes[axis].position=float(offset)
+            sim.mount.axes[axis].target=offset+500
+            sim.mount.axes[axis].T1=offset+7
+        yield sim
+
+
+@pytest.fixture
+def link(server):
+    metrics.registry.reset()
+    return commUDP(*server.address)
+
+
+def test_retransmit_idempotent(server,link):
+    server.script=drop_first(b':j1\r')
+    assert link.cmds([b':j1\r',b':f1\r'],timeout_in_seconds=3)==[server.mount.handle(b':j1\r'),server.mount.handle(b':f1\r')]
+    assert server.count(b':j1\r')==2
+    assert metrics.registry.retransmits>0
+
+
+@pytest.mark.parametrize('cmd',[b':J1\r',b':H1E80300\r',b':M1AC0D00\r'])
+def test_no_retransmit_not_idempotent(server,link,cmd):
+    assert cmd[1] not in IDEMPOTENT_CMDS
+    server.script=drop_first(cmd)
+    with pytest.raises(NameError,match='SynscanSocketTimeoutError'):
+        link.cmds([b':j1\r',cmd],timeout_in_seconds=0.5)
+    assert server.count(cmd)==1
+    assert metrics.registry.retransmits==0
+
+
+def test_no_mismatched_replies(server,link):
+    '''Random loss, late and swapped replies: a call returns the right
+    answers or raises, never an answer of another command.
+
+    Replies are late by more than the RTO but less than twice it and
+    only replies of different shape are swapped: the limits of matching
+    replies without ids (see comm.commUDP.cmds)'''
+    #No two consecutive replies of the same shape
+    batch=[b':a1\r',b':f1\r',b':j1\r',b':g1\r',b':h1\r',b':f2\r',b':j2\r',
+           b':F1\r',b':h2\r',b':g2\r',b':i1\r',b':f1\r',b':i2\r']
+    for cmd in batch:
+        server.mount.handle(cmd)
+    expected=[server.mount.handle(cmd) for cmd in batch]
+    link.rtt=rttEstimator(initial=0.2,minimum=0.2)
+    rng=random.Random(7)
+    def script(msg):
+        draw=rng.random()
+        if draw<0.04:
+            return 'drop'
+        if draw<0.08:
+            return rng.uniform(0.25,0.35)
+        if draw<0.15:
+            return 'swap'
+        return None
+    server.script=script
+    answered=0
+    for i in range(12):
+        try:
+            responses=link.cmds(batch,timeout_in_seconds=3)
+        except NameError:
+            continue
+        assert responses==expected
+        answered+=1
+    assert answered>=8
+    assert metrics.registry.retransmits>0
+
+
+def test_rto_backoff_and_recovery(server,link):
+    link.rtt=rttEstimator(initial=0.05)
+    drops=iter(range(3))
+    def script(msg):
+        if msg==b':j1\r' and next(drops,None) is not None:
+            return 'drop'
+        return None
+    server.script=script
+    link.cmds([b':j1\r'],timeout_in_seconds=3)
+    sends=[t for t,msg in server.received if msg==b':j1\r']
+    assert len(sends)==4
+    gaps=[b-a for a,b in zip(sends,sends[1:])]
+    #Retransmissions of the recovery double the timeout
+    assert gaps[2]>1.5*gaps[1]
+    #Lossless again: answered without retransmissions, the RTO follows the fast link
+    retransmits=metrics.registry.retransmits
+    for i in range(20):
+        link.cmds([b':j1\r',b':f1\r'],timeout_in_seconds=3)
+    assert metrics.registry.retransmits==retransmits
+    assert link.rtt.rto<0.05
+
+
+def test_late_reply_of_other_shape_discarded(server,link):
+    '''The late reply of a timed out command is discarded, not decoded
+    as the response of the next one'''
+    server.script=lambda msg: 0.3 if msg.startswith(b':H1') else None
+    with pytest.raises(NameError,match='SynscanSocketTimeoutError'):
+        link.cmds([b':H1E80300\r'],timeout_in_seconds=0.1)
+    #Wait for the response longer than the late reply takes
+    link.rtt=rttEstimator(initial=1.0)
+    assert link.cmds([b':f1\r'],timeout_in_seconds=2)==[server.mount.handle(b':f1\r')]
+    assert metrics.registry.discarded=={'mismatch':1}
+    assert metrics.registry.retransmits==0
+
+
+class splitPtyServer(simPtyServer):
+    '''simPtyServer writing every response (and echo) a few bytes at a time'''
+    def _send(self,response,dest):
+        for i in range(0,len(response),2):
+            super(splitPtyServer, self)._send(response[i:i+2],dest)
+            time.sleep(0.001)
+
+
+def test_serial_echo_and_split_frames():
+    pytest.importorskip('serial')
+    metrics.registry.reset()
+    with splitPtyServer(echo=True) as sim:
+        link=commSerial(sim.device)
+        batch=[b':a1\r',b':j1\r',b':f1\r',b':g1\r',b':h2\r',b':i2\r',b':X1\r']
+        expected=[sim.mount.handle(cmd) for cmd in batch]
+        assert expected[-1]==b'!0\r'
+        for i in range(5):
+            assert link.cmds(batch,timeout_in_seconds=2)==expected
+        assert link.cmd(b':f2\r')==sim.mount.handle(b':f2\r')
+        link.serial.close()
+    #Echoes are skipped, not counted as mismatching responses
+    assert metrics.registry.discarded=={}
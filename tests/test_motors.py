@@ -0,0 +1,166 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+motors against the in-process simulator, counting the commands on the wire
+'''
+
+import pytest
+
+from synscan import metrics
+from synscan.motors import motors,SHADOW_INVALIDATING_CMDS,MIN_T1_PRESET,FAST_SPEED_T1,FAST_SPEED_HYSTERESIS
+from synscan.sim import simMount,commSim
+
+
+class countingMount(simMount):
+    '''simMount keeping every command received in sent'''
+    def __init__(self,**kwargs):
+        super(countingMount, self).__init__(**kwargs)
+        self.sent=[]
+
+    def handle(self,msg):
+        self.sent.append(msg)
+        return super(countingMount, self).handle(msg)
+
+    def count(self,cmd,axis=1):
+        header=f':{cmd}{axis}'.encode()
+        return sum(1 for msg in self.sent if msg.startswith(header))
+
+
+@pytest.fixture
+def mount():
+    return countingMount(gotoSpeed=20.0,acceleration=40.0)
+
+
+@pytest.fixture
+def smc(mount):
+    smc=motors(transport=commSim(mount),lazy=True,paramCache=False)
+    smc.params
+    mount.sent.clear()
+    metrics.registry.reset()
+    return smc
+
+
+def write_shadowed(smc):
+    '''Goto mode, T1 preset and goto target of axis 1'''
+    smc.axis_set_motion_mode(1,False,False,True)
+    smc._set_T1_preset(1,100)
+    smc.axis_set_goto_targetCounts(1,1000)
+
+
+def test_suppress_unchanged_writes(smc,mount):
+    for i in range(3):
+        write_shadowed(smc)
+    assert [mount.count(cmd) for cmd in 'GIS']==[1,1,1]
+    assert metrics.registry.suppressed=={'G':2,'I':2,'S':2}
+    #A changed value is written
+    smc._set_T1_preset(1,101)
+    assert mount.count('I')==2
+    #Other axis, own shadow
+    smc._set_T1_preset(2,101)
+    assert mount.count('I',2)==1
+
+
+def test_track_same_speed(smc,mount):
+    for i in range(5):
+        smc.axis_track(1,0.01)
+    assert mount.count('G')==1
+    assert mount.count('I')==1
+    assert mount.count('J')==1
+    smc.axis_stop_motion(1)
+
+
+@pytest.mark.parametrize('cmd,data',[('K',None),('L',None),('H',0x800010),('M',0x000DAC)])
+def test_invalidating_cmds(smc,mount,cmd,data):
+    write_shadowed(smc)
+    smc._send_cmd(cmd,1,data)
+    mount.sent.clear()
+    write_shadowed(smc)
+    forgotten=SHADOW_INVALIDATING_CMDS[cmd]
+    assert {c:mount.count(c) for c in 'GIS'}=={c:int(c in forgotten) for c in 'GIS'}
+
+
+def test_goto_start_forgets_mode_and_period(smc,mount):
+    write_shadowed(smc)
+    smc.axis_start_motion(1)
+    smc.axis_wait2stop(1)
+    mount.sent.clear()
+    write_shadowed(smc)
+    assert {c:mount.count(c) for c in 'GIS'}=={'G':1,'I':1,'S':0}
+
+
+def test_tracking_start_keeps_shadow(smc,mount):
+    smc.axis_set_motion_mode(1,True,False,False)
+    smc._set_T1_preset(1,5000)
+    smc.axis_start_motion(1)
+    mount.sent.clear()
+    #Running: a G on the wire would be answered with MotorNotStopped
+    smc.axis_set_motion_mode(1,True,False,False)
+    smc._set_T1_preset(1,5000)
+    assert mount.count('G')==0 and mount.count('I')==0
+    smc.axis_stop_motion(1)
+
+
+def test_error_forgets_shadow(smc,mount):
+    smc.axis_set_goto_targetCounts(1,1000)
+    smc.axis_set_motion_mode(1,True,False,False)
+    smc.axis_start_motion(1)
+    with pytest.raises(NameError,match='MotorNotStopped'):
+        smc.axis_set_goto_targetCounts(1,2000)
+    smc.axis_stop_motion(1)
+    mount.sent.clear()
+    #K keeps S, the error forgot it
+    smc.axis_set_goto_targetCounts(1,1000)
+    assert mount.count('S')==1
+
+
+def slow_T1_speed(smc,T1):
+    '''Speed (degrees per second) of axis 1 with a low speed T1 preset'''
+    return smc.counts2degrees(1,smc.params[1]['TimerInterruptFreq']/T1)
+
+
+def test_speed_plan_too_slow_is_stop(smc,mount):
+    plan=smc.axis_speed_plan(1,1e-7)
+    assert plan['speed']==0 and plan['error']==-1e-7
+    assert slow_T1_speed(smc,0xFFFFFF)>1e-7
+    smc.axis_track(1,1e-7)
+    assert mount.count('I')==0 and mount.count('J')==0
+    smc.axis_set_speed(1,-1e-7)
+    assert mount.count('I')==0 and mount.count('K')>=1
+
+
+def test_speed_plan_min_T1(smc):
+    plan=smc.axis_speed_plan(1,-100)
+    assert plan['fastSpeed'] and plan['T1preset']==MIN_T1_PRESET
+    ratio=smc.params[1]['HighSpeedRatio']
+    assert plan['speed']==pytest.approx(-slow_T1_speed(smc,MIN_T1_PRESET)*ratio)
+    assert plan['error']==pytest.approx(plan['speed']+100)
+    #Low speed mode is clamped too
+    smc.params[1]['HighSpeedRatio']=1
+    plan=smc.axis_speed_plan(1,100)
+    assert not plan['fastSpeed'] and plan['T1preset']==MIN_T1_PRESET
+    assert plan['speed']==pytest.approx(slow_T1_speed(smc,MIN_T1_PRESET))
+
+
+def test_speed_plans_bounds(smc):
+    pytest.importorskip('numpy')
+    from synscan.planning import speed_plans
+    plans=speed_plans(smc,1,[1e-7,0,100,-0.004])
+    assert list(plans['speed'][:2])==[0,0]
+    assert plans['T1preset'][2]==MIN_T1_PRESET
+    assert plans['speed'][3]==pytest.approx(smc.axis_speed_plan(1,-0.004)['speed'])
+
+
+@pytest.mark.parametrize('T1,current,fast',[(0.9*FAST_SPEED_T1,None,True),
+                                            (0.9*FAST_SPEED_T1,False,True),
+                                            (1.1*FAST_SPEED_T1,None,False),
+                                            (1.1*FAST_SPEED_T1,False,False),
+                                            (1.1*FAST_SPEED_T1,True,True),
+                                            (1.1*FAST_SPEED_T1*FAST_SPEED_HYSTERESIS,True,False),
+                                            ])
+def test_speed_plan_hysteresis(smc,T1,current,fast):
+    plan=smc.axis_speed_plan(1,slow_T1_speed(smc,T1),current)
+    assert plan['fastSpeed']==fast
+    assert abs(plan['relativeError'])<0.02
@@ -0,0 +1,88 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+synscan.planning mosaic ordering
+'''
+
+import time
+
+import pytest
+
+np=pytest.importorskip('numpy')
+
+from synscan import planning
+from synscan.motors import motors
+from synscan.sim import simMount,commSim
+
+KWARGS={'speed':planning.GOTO_SPEED,'acceleration':planning.GOTO_ACCELERATION,'overhead':planning.GOTO_OVERHEAD}
+
+
+@pytest.fixture
+def smc():
+    return motors(transport=commSim(simMount()),lazy=True,paramCache=False)
+
+
+def random_points(n,seed=1):
+    return np.random.default_rng(seed).uniform([0,0],[360,80],(n,2))
+
+
+def reference_two_opt(smc,coords,order,maxPasses,**kwargs):
+    '''_two_opt scalar reference: same moves, one (i,j) at a time'''
+    n=len(order)
+    order=list(order)
+    cost=lambda p,q: float(planning.slew_times(smc,coords[p],coords[q],**kwargs)[0])
+    for _ in range(maxPasses):
+        improved=False
+        for i in range(n-2):
+            gains=[]
+            for j in range(i+2,n):
+                old=cost(order[i],order[i+1])+(cost(order[j],order[j+1]) if j<n-1 else 0)
+                new=cost(order[i],order[j])+(cost(order[i+1],order[j+1]) if j<n-1 else 0)
+                gains.append(old-new)
+            best=int(np.argmax(gains))
+            if gains[best]>1e-9:
+                j=i+2+best
+                order[i+1:j+1]=order[i+1:j+1][::-1]
+                improved=True
+        if not improved:
+            break
+    return order
+
+
+@pytest.mark.parametrize('seed',[1,2,3])
+def test_two_opt_matches_reference(smc,seed):
+    coords=random_points(40,seed)
+    order=planning._nearest_neighbour(smc,coords,**KWARGS)
+    expected=reference_two_opt(smc,coords,order,10,**KWARGS)
+    assert list(planning._two_opt(smc,coords,order.copy(),10,**KWARGS))==expected
+
+
+def test_plan_mosaic(smc):
+    points=random_points(100)
+    plan=planning.plan_mosaic(smc,points,start=(10,10))
+    assert sorted(plan['order'])==list(range(100))
+    assert np.array_equal(plan['points'],points[plan['order']])
+    assert plan['time']==pytest.approx(planning.path_slew_time(smc,plan['points'],(10,10)))
+    assert plan['time']<plan['originalTime']/4
+    nearest=planning.plan_mosaic(smc,points,start=(10,10),maxPasses=0)
+    assert plan['time']<nearest['time']
+
+
+def test_plan_mosaic_time_budget(smc):
+    points=random_points(800)
+    t=time.monotonic()
+    plan=planning.plan_mosaic(smc,points,maxSeconds=0.05)
+    #Nearest neighbour and the path times are not budgeted
+    assert time.monotonic()-t<1.0
+    assert sorted(plan['order'])==list(range(800))
+
+
+def test_plan_mosaic_axis_kinematics(smc):
+    '''A slow axis 2 is moved less'''
+    points=random_points(60)
+    plans=[planning.plan_mosaic(smc,points,speed=(4.0,speed),acceleration=4.0) for speed in (4.0,0.5)]
+    moves=[np.sum(np.abs(np.diff(plan['points'],axis=0)),axis=0) for plan in plans]
+    assert moves[1][1]<moves[0][1]
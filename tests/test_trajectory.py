@@ -0,0 +1,89 @@
+# -*- coding: iso-8859-15 -*-
+#
+# pysynscan
+# Copyright (c) July 2020 Nacho Mas
+
+'''
+trajectoryFollower against the in-process simulator
+'''
+
+import pytest
+
+from synscan.motors import motors
+from synscan.sim import simMount,commSim
+
+CADENCE=0.1
+
+
+class flakyTransport(commSim):
+    '''commSim failing every period-th batch with a socket timeout'''
+    def __init__(self,mount,period=4):
+        super(flakyTransport, self).__init__(mount)
+        self.period=period
+        self.calls=0
+
+    def cmds(self,cmds,timeout_in_seconds=2):
+        self.calls+=1
+        if self.period and self.calls%self.period==0:
+            raise(NameError('SynscanSocketTimeoutError'))
+        return super(flakyTransport, self).cmds(cmds,timeout_in_seconds)
+
+
+@pytest.fixture
+def mount():
+    return simMount()
+
+
+@pytest.fixture
+def smc(mount):
+    smc=motors(transport=commSim(mount),lazy=True,paramCache=False)
+    smc.params
+    return smc
+
+
+def linear_path(start,speed,seconds):
+    return [(t*CADENCE,start+speed*t*CADENCE,start) for t in range(int(seconds/CADENCE)+1)]
+
+
+def assert_stopped(smc):
+    smc.axes_wait2stop((1,2))
+    values=smc.axes_get_values((1,2),['Status'],maxAge=0)
+    assert all(values[axis]['Status']['Stopped'] for axis in (1,2))
+
+
+@pytest.mark.parametrize('speed',[0,1e-7,1e-8])
+def test_follow_stationary_path(smc,speed):
+    '''No speed too slow for a T1 preset reaches the mount'''
+    start=smc.axis_get_values(1,['Position'],maxAge=0)['PositionDeg']
+    follower=smc.follow(linear_path(start,speed,1.0),cadence=CADENCE)
+    stats=follower.stats
+    #No blocking stop per tick
+    assert stats['ticks']>=0.7/CADENCE
+    assert stats['commErrors']==0
+    assert stats['maxError']<smc.counts2degrees(1,2)
+    assert_stopped(smc)
+
+
+def test_follow_slow_path(smc):
+    '''A few counts per second, slower than the deadband of one axis'''
+    speed=smc.counts2degrees(1,5)
+    follower=smc.follow(linear_path(0.0,speed,2.0),cadence=CADENCE,minSpeed=smc.counts2degrees(1,0.5))
+    stats=follower.stats
+    assert stats['ticks']>=1.6/CADENCE
+    assert stats['maxError']<smc.counts2degrees(1,5)
+    position=smc.axis_get_values(1,['Position'],maxAge=0)['PositionDeg']
+    assert position==pytest.approx(2.0*speed,abs=smc.counts2degrees(1,5))
+    assert_stopped(smc)
+
+
+def test_follow_survives_link_errors(mount):
+    smc=motors(transport=flakyTransport(mount),lazy=True,paramCache=False)
+    smc.params
+    speed=0.05
+    follower=smc.follow(linear_path(0.0,speed,1.5),cadence=CADENCE)
+    stats=follower.stats
+    assert stats['commErrors']>0
+    assert stats['ticks']>=1.2/CADENCE
+    assert stats['maxError']<0.05
+    smc.comm.period=None
+    assert_stopped(smc)